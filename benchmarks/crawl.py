@@ -0,0 +1,158 @@
+"""
+End-to-end crawl benchmark. Runs both spiders against a local fake Gumtree
+(benchmarks/fake_gumtree.py), with PostgreSQL replaced by a stand-in, at
+increasing page counts and concurrency levels, and writes a JSON report:
+
+    python -m benchmarks.crawl --pages 2 5 10 --concurrency 8 16 32 --output report.json
+
+Each crawl runs in its own process, so CPU time and peak RSS are the
+crawl's own; the fake server runs in another one.
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from scrapy.crawler import CrawlerProcess
+from scrapy.utils.project import get_project_settings
+
+SPIDERS = ("properties", "properties-v2")
+
+
+def run_crawl(args):
+    """Runs one crawl in this process and prints its results as JSON"""
+    settings = get_project_settings()
+    settings.setdict(
+        {
+            "LOG_LEVEL": "INFO",
+            "LOG_FILE": None,
+            "LATENCIES_METRICS_FILE": None,
+            "EXTENSIONS": {"scrapy.extensions.telnet.TelnetConsole": None, "gumtree_scraper.extensions.Latencies": 200},
+            "DOWNLOAD_HANDLERS": {
+                "http": "benchmarks.fake_gumtree.LocalDownloadHandler",
+                "https": "benchmarks.fake_gumtree.LocalDownloadHandler",
+            },
+            "BENCHMARK_SERVER": args.server,
+            "CONCURRENT_REQUESTS": args.worker_concurrency,
+            "CONCURRENT_REQUESTS_PER_DOMAIN": args.worker_concurrency,
+            "CRAWL_SEEDS": [("flats-houses", "london")],
+            "CRAWL_MAX_PAGES": args.worker_pages,
+            "ITEM_PIPELINES": {
+                "scrapy.pipelines.images.ImagesPipeline": 1,
+                "benchmarks.standins.StandInPostgresWriter": 300,
+            },
+            "POSTGRES_PIPELINE_URL": "postgresql://benchmark@localhost/benchmark",
+            "IMAGES_STORE": tempfile.mkdtemp(prefix="gumtree-images-"),
+            "RECRAWL_ENABLED": False,
+            "PARSE_WORKERS": args.parse_workers,
+        },
+        priority="cmdline",
+    )
+
+    process = CrawlerProcess(settings, install_root_handler=False)
+    crawler = process.create_crawler(args.worker)
+    process.crawl(crawler, max_page=args.worker_pages)
+
+    started = time.time()
+    process.start()
+    elapsed = time.time() - started
+
+    stats = crawler.stats.get_stats()
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    items = stats.get("item_scraped_count", 0)
+    result = {
+        "spider": args.worker,
+        "pages": args.worker_pages,
+        "concurrency": args.worker_concurrency,
+        "parse_workers": args.parse_workers,
+        "items": items,
+        "seconds": round(elapsed, 3),
+        "items_per_second": round(items / elapsed, 1) if elapsed else 0,
+        "cpu_seconds": round(usage.ru_utime + usage.ru_stime, 3),
+        # Linux reports ru_maxrss in KiB
+        "peak_rss_mb": round(usage.ru_maxrss / 1024.0, 1),
+        "time_to_first_item": stats.get("latencies/time_to_first_item"),
+    }
+    for stage in ("latency", "download", "parse"):
+        for percentile in ("p50", "p95", "p99"):
+            result["%s_%s" % (stage, percentile)] = stats.get("latencies/%s/%s" % (stage, percentile))
+    print("RESULT " + json.dumps(result), flush=True)
+
+
+def start_server(args, pages):
+    server = subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.fake_gumtree", "--port", str(args.port), "--pages", str(pages), "--delay", str(args.delay)],
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    server.stdout.readline()  # "listening on ..."
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--spiders", nargs="+", default=list(SPIDERS), choices=SPIDERS)
+    parser.add_argument("--pages", type=int, nargs="+", default=[2, 5, 10])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[8, 16, 32])
+    parser.add_argument("--port", type=int, default=8901)
+    parser.add_argument("--delay", type=float, default=0.01, help="seconds the fake server waits before each response")
+    parser.add_argument("--parse-workers", type=int, default=0, help="PARSE_WORKERS of every crawl")
+    parser.add_argument("--output", help="write the report here as well")
+    # Used internally to run a single crawl
+    parser.add_argument("--worker", choices=SPIDERS, help=argparse.SUPPRESS)
+    parser.add_argument("--worker-pages", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--worker-concurrency", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--server", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_crawl(args)
+        return
+
+    results = []
+    for pages in args.pages:
+        server = start_server(args, pages)
+        try:
+            for spider in args.spiders:
+                for concurrency in args.concurrency:
+                    output = subprocess.run(
+                        [
+                            sys.executable, "-m", "benchmarks.crawl",
+                            "--worker", spider,
+                            "--worker-pages", str(pages),
+                            "--worker-concurrency", str(concurrency),
+                            "--server", "http://127.0.0.1:%d" % args.port,
+                            "--parse-workers", str(args.parse_workers),
+                        ],
+                        capture_output=True,
+                        text=True,
+                    ).stdout
+                    for line in output.splitlines():
+                        if line.startswith("RESULT "):
+                            result = json.loads(line[len("RESULT "):])
+                            results.append(result)
+                            print(json.dumps(result), flush=True)
+        finally:
+            server.terminate()
+            server.wait()
+
+    report = {"commit": git_commit(), "time": time.time(), "results": results}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], text=True, cwd=os.path.dirname(__file__)).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == "__main__":
+    main()
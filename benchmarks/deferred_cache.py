@@ -0,0 +1,97 @@
+"""
+Lookups/s of DeferredCache under heavy key reuse, against the unbounded
+implementation it replaced, with a stand-in geocoder that answers after a
+short delay.
+
+    python -m benchmarks.deferred_cache --lookups 200000 --keys 5000
+"""
+
+import argparse
+import json
+import random
+from time import time
+
+from twisted.internet import defer, reactor, task
+
+from gumtree_scraper.pipelines import DeferredCache
+
+
+class LegacyDeferredCache(object):
+    """The previous DeferredCache: unbounded, failures kept as closures"""
+
+    def __init__(self, key_not_found_callback):
+        self.records = {}
+        self.deferreds_waiting = {}
+        self.key_not_found_callback = key_not_found_callback
+
+    @defer.inlineCallbacks
+    def find(self, key):
+        rv = defer.Deferred()
+
+        if key in self.deferreds_waiting:
+            self.deferreds_waiting[key].append(rv)
+        else:
+            self.deferreds_waiting[key] = [rv]
+
+            if not key in self.records:
+                try:
+                    value = yield self.key_not_found_callback(key)
+                    self.records[key] = lambda d: d.callback(value)
+                except Exception as e:
+                    self.records[key] = lambda d: d.errback(e)
+
+            action = self.records[key]
+            for d in self.deferreds_waiting.pop(key):
+                reactor.callFromThread(action, d)
+
+        value = yield rv
+        defer.returnValue(value)
+
+
+def make_keys(count, keys):
+    """Zipf-like stream of addresses: a few are looked up over and over"""
+    rnd = random.Random(42)
+    return ["%d Some Street, London" % min(int(rnd.paretovariate(1.2)), keys) for _ in range(count)]
+
+
+@defer.inlineCallbacks
+def run(cache_cls, keys, args):
+    def geocode(address):
+        return task.deferLater(reactor, args.delay, lambda: {"lat": 51.5, "lon": -0.1})
+
+    if cache_cls is DeferredCache:
+        cache = DeferredCache(geocode, max_entries=args.max_entries)
+    else:
+        cache = cache_cls(geocode)
+
+    started = time()
+    # Lookups arrive in waves, like items leaving the spider
+    for i in range(0, len(keys), args.wave):
+        yield defer.DeferredList([cache.find(key) for key in keys[i : i + args.wave]])
+    elapsed = time() - started
+
+    return {"implementation": cache_cls.__name__, "lookups_per_second": round(len(keys) / elapsed, 1), "cached_keys": len(cache.records)}
+
+
+@defer.inlineCallbacks
+def main(args):
+    keys = make_keys(args.lookups, args.keys)
+    results = []
+    for cache_cls in (LegacyDeferredCache, DeferredCache):
+        results.append((yield run(cache_cls, keys, args)))
+    print(json.dumps({"lookups": args.lookups, "distinct_keys": len(set(keys)), "results": results}))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lookups", type=int, default=200000)
+    parser.add_argument("--keys", type=int, default=5000, help="largest key of the Zipf-like distribution")
+    parser.add_argument("--wave", type=int, default=1000, help="lookups issued together")
+    parser.add_argument("--delay", type=float, default=0.001, help="seconds the stand-in geocoder takes")
+    parser.add_argument("--max-entries", type=int, default=200, help="below the distinct keys, so the cache evicts")
+    args = parser.parse_args()
+
+    d = main(args)
+    d.addErrback(lambda failure: failure.printTraceback())
+    d.addBoth(lambda _: reactor.stop())
+    reactor.run()
@@ -0,0 +1,86 @@
+"""
+A local stand-in for the geocoder, answering single lookups the way
+Google's geocoding API does and batches the way BatchGeocoder expects.
+Locations are made up from a hash of the address.
+
+    python -m benchmarks.fake_geocoder --port 9312 --over-limit 0.05
+"""
+
+import argparse
+import hashlib
+import json
+import random
+
+from twisted.internet import reactor
+from twisted.web import resource, server
+
+
+def fake_location(address):
+    """A point in Greater London that only depends on the address"""
+    digest = hashlib.md5(address.encode("utf-8")).digest()
+    return {"lat": 51.3 + digest[0] / 255.0 * 0.4, "lng": -0.5 + digest[1] / 255.0 * 0.8}
+
+
+class FakeGeocoder(resource.Resource):
+    """
+    GET /maps/api/geocode/json?address=... and POST /maps/api/geocode/batch.
+    Each address is turned down with OVER_QUERY_LIMIT with probability
+    ```over_limit```, after ```delay``` seconds per call.
+    """
+
+    isLeaf = True
+
+    def __init__(self, delay=0.02, over_limit=0.0, seed=42):
+        super().__init__()
+        self.delay = delay
+        self.over_limit = over_limit
+        self.random = random.Random(seed)
+        self.calls = 0
+        self.addresses = 0
+
+    def result(self, address):
+        self.addresses += 1
+        if self.random.random() < self.over_limit:
+            return {"status": "OVER_QUERY_LIMIT"}
+        return {"status": "OK", "location": fake_location(address)}
+
+    def render_GET(self, request):
+        address = request.args.get(b"address", [b""])[0].decode("utf-8")
+        result = self.result(address)
+        if result["status"] == "OK":
+            body = {"status": "OK", "results": [{"geometry": {"location": result["location"]}}]}
+        else:
+            body = {"status": result["status"], "results": []}
+        return self.respond(request, body)
+
+    def render_POST(self, request):
+        addresses = json.loads(request.content.read())["addresses"]
+        return self.respond(request, {"results": [self.result(address) for address in addresses]})
+
+    def respond(self, request, body):
+        self.calls += 1
+        request.setHeader(b"Content-Type", b"application/json")
+        data = json.dumps(body).encode("utf-8")
+
+        def finish():
+            request.write(data)
+            request.finish()
+
+        reactor.callLater(self.delay, finish)
+        return server.NOT_DONE_YET
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=9312)
+    parser.add_argument("--delay", type=float, default=0.02, help="seconds before each response")
+    parser.add_argument("--over-limit", type=float, default=0.0, help="fraction of addresses turned down")
+    args = parser.parse_args()
+
+    port = reactor.listenTCP(args.port, server.Site(FakeGeocoder(args.delay, args.over_limit)), interface="127.0.0.1")
+    print("listening on http://127.0.0.1:%d" % port.getHost().port, flush=True)
+    reactor.run()
+
+
+if __name__ == "__main__":
+    main()
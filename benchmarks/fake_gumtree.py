@@ -0,0 +1,34 @@
+"""
+Runs the fake Gumtree of tests/fakes.py, a local HTTP server that serves
+synthetic listing pages, ads and carousel images with the markup the
+spiders expect.
+
+    python -m benchmarks.fake_gumtree --port 8901 --pages 10
+"""
+
+import argparse
+
+from twisted.internet import reactor
+from twisted.web import server
+
+# LocalDownloadHandler is what the benchmark crawls use as DOWNLOAD_HANDLERS
+from tests.fakes import FakeGumtree, LocalDownloadHandler  # noqa: F401
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8901)
+    parser.add_argument("--pages", type=int, default=10)
+    parser.add_argument("--ads-per-page", type=int, default=25)
+    parser.add_argument("--images-per-ad", type=int, default=3)
+    parser.add_argument("--delay", type=float, default=0.0, help="seconds before each response")
+    args = parser.parse_args()
+
+    site = server.Site(FakeGumtree(args.pages, args.ads_per_page, args.images_per_ad, args.delay))
+    port = reactor.listenTCP(args.port, site, interface="127.0.0.1")
+    print("listening on http://127.0.0.1:%d" % port.getHost().port, flush=True)
+    reactor.run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+Lookups/s and hit rate of the offline gazetteer on Gumtree-like location
+strings, against an index of made-up London postcodes and place names.
+
+    python -m benchmarks.gazetteer --lookups 200000 --postcodes 100000
+"""
+
+import argparse
+import json
+import os
+import random
+import tempfile
+from time import perf_counter
+
+from benchmarks.fake_geocoder import fake_location
+from gumtree_scraper.gazetteer import Gazetteer, build
+
+AREAS = ["E", "EC", "N", "NW", "SE", "SW", "W", "WC"]
+PLACES = ["Camden", "Stratford", "Brixton", "Hackney", "Ealing", "Croydon", "Camden Town", "Clapham", "Islington", "Wimbledon"]
+
+
+def make_rows(postcodes, rnd):
+    """Place names, every district and ```postcodes``` full postcodes"""
+    rows = [(place, fake_location(place)) for place in PLACES + ["London"]]
+    outcodes = ["%s%d" % (area, n) for area in AREAS for n in range(1, 21)]
+    rows += [(outcode, fake_location(outcode)) for outcode in outcodes]
+    for _ in range(postcodes):
+        postcode = "%s %d%s%s" % (rnd.choice(outcodes), rnd.randint(0, 9), rnd.choice("ABDEFGHJLNPQRSTUWXYZ"), rnd.choice("ABDEFGHJLNPQRSTUWXYZ"))
+        rows.append((postcode, fake_location(postcode)))
+    return [(name, location["lat"], location["lng"]) for name, location in rows], outcodes
+
+
+def make_locations(count, outcodes, rnd):
+    """The kinds of location string ads come with, some unknown"""
+    kinds = [
+        lambda: "%s, London" % rnd.choice(PLACES),
+        lambda: rnd.choice(outcodes),
+        lambda: "%s, London %s" % (rnd.choice(PLACES), rnd.choice(outcodes)),
+        lambda: "%s Station, London" % rnd.choice(PLACES),
+        lambda: "Somewhere %d" % rnd.randint(1, 1000),
+    ]
+    return [rnd.choice(kinds)() for _ in range(count)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lookups", type=int, default=200000)
+    parser.add_argument("--postcodes", type=int, default=100000, help="full postcodes in the index")
+    args = parser.parse_args()
+
+    rnd = random.Random(42)
+    rows, outcodes = make_rows(args.postcodes, rnd)
+    locations = make_locations(args.lookups, outcodes, rnd)
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "gazetteer.idx")
+        started = perf_counter()
+        names = build(rows, path)
+        build_seconds = perf_counter() - started
+
+        gazetteer = Gazetteer(path)
+        started = perf_counter()
+        hits = sum(1 for location in locations if gazetteer.lookup(location) is not None)
+        elapsed = perf_counter() - started
+        gazetteer.close()
+
+        print(
+            json.dumps(
+                {
+                    "names": names,
+                    "index_bytes": os.path.getsize(path),
+                    "build_seconds": round(build_seconds, 3),
+                    "lookups": args.lookups,
+                    "lookups_per_second": round(args.lookups / elapsed, 1),
+                    "microseconds_per_lookup": round(elapsed / args.lookups * 1e6, 2),
+                    "hit_rate": round(hits / args.lookups, 4),
+                }
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
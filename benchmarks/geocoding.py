@@ -0,0 +1,85 @@
+"""
+Time GeoPipeline takes to geocode a crawl's worth of items, one call per
+address against batches, with the stand-in geocoder of
+benchmarks/fake_geocoder.py running in the same process.
+
+    python -m benchmarks.geocoding --items 2000 --addresses 500 --rate 20
+"""
+
+import argparse
+import json
+import random
+from time import time
+
+from scrapy import Spider
+from scrapy.utils.test import get_crawler
+from twisted.internet import defer, reactor
+from twisted.web import server
+
+from benchmarks.fake_geocoder import FakeGeocoder
+from gumtree_scraper.pipelines import GeoPipeline
+
+
+@defer.inlineCallbacks
+def run(mode, geocoder, port, args):
+    crawler = get_crawler(Spider)
+    spider = Spider(name="benchmark")
+
+    base = "http://127.0.0.1:%d/maps/api/geocode/" % port
+    pipeline = GeoPipeline(
+        crawler.stats,
+        rate=args.rate,
+        batch_endpoint=base + "batch" if mode == "batch" else None,
+        batch_size=args.batch_size,
+        max_retries=args.max_retries,
+    )
+    pipeline.endpoint = base + "json"
+
+    rnd = random.Random(1)
+    items = [{"address": ["%d High Street, London" % rnd.randint(1, args.addresses)]} for _ in range(args.items)]
+
+    calls, started = geocoder.calls, time()
+    yield defer.DeferredList([pipeline.process_item(item, spider) for item in items])
+    elapsed = time() - started
+    pipeline.close_spider(spider)
+
+    stats = crawler.stats.get_stats()
+    return {
+        "mode": mode,
+        "seconds": round(elapsed, 2),
+        "items_per_second": round(len(items) / elapsed, 1),
+        "geocoder_calls": geocoder.calls - calls,
+        "geocoded": sum(1 for item in items if "location" in item),
+        "retries": stats.get("geo_pipeline/retries", 0),
+        "errors": stats.get("geo_pipeline/errors", 0),
+    }
+
+
+@defer.inlineCallbacks
+def main(args):
+    geocoder = FakeGeocoder(args.delay, args.over_limit)
+    listening = reactor.listenTCP(0, server.Site(geocoder), interface="127.0.0.1")
+    port = listening.getHost().port
+
+    results = []
+    for mode in ("single", "batch"):
+        results.append((yield run(mode, geocoder, port, args)))
+    print(json.dumps({"items": args.items, "addresses": args.addresses, "rate": args.rate, "results": results}))
+    yield listening.stopListening()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--items", type=int, default=2000)
+    parser.add_argument("--addresses", type=int, default=500, help="distinct addresses among the items")
+    parser.add_argument("--rate", type=float, default=20.0, help="geocoder calls per second")
+    parser.add_argument("--batch-size", type=int, default=50)
+    parser.add_argument("--max-retries", type=int, default=3)
+    parser.add_argument("--delay", type=float, default=0.02, help="seconds the geocoder takes per call")
+    parser.add_argument("--over-limit", type=float, default=0.02, help="fraction of addresses turned down")
+    args = parser.parse_args()
+
+    d = main(args)
+    d.addErrback(lambda failure: failure.printTraceback())
+    d.addBoth(lambda _: reactor.stop())
+    reactor.run()
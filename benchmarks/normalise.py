@@ -0,0 +1,108 @@
+"""
+Price strings normalised per second, one at a time and in batches, over a
+corpus built from the price formats Gumtree ads use. Also times
+NormalisePipeline on whole items.
+
+    python -m benchmarks.normalise --strings 1000000 --batch-size 100
+"""
+
+import argparse
+import json
+import random
+from time import perf_counter
+
+from scrapy import Spider
+from scrapy.utils.test import get_crawler
+
+from gumtree_scraper.items import PropertyAttributes
+from gumtree_scraper.normalisation import normalise_price, normalise_prices
+from gumtree_scraper.pipelines import NormalisePipeline
+
+FORMATS = [
+    "£{:,}pcm",
+    "£{:,}pw",
+    "£{:,} pcm",
+    "£{:,} pw",
+    "£{:,} PCM",
+    "£{:,} per month",
+    "£{:,} per week",
+    "£{:,} p/w",
+    "£{:,} pppw",
+    "£{:,} pa",
+    "£{:,}",
+    "£{:,}pw (£{:,}pcm)",
+]
+
+
+def make_prices(count, rnd):
+    """Rents cluster on round numbers, so the same strings come up often"""
+    prices = []
+    for _ in range(count):
+        amount = rnd.choice((25, 50, 50, 100)) * rnd.randint(4, 80)
+        prices.append(rnd.choice(FORMATS).format(amount, amount * 52 // 12))
+    # Some ads don't say
+    for i in range(0, count, 50):
+        prices[i] = rnd.choice(("POA", "Price on application", ""))
+    return prices
+
+
+def time_strings(prices, batch_size):
+    known = {}
+    started = perf_counter()
+    if batch_size:
+        for i in range(0, len(prices), batch_size):
+            normalise_prices(prices[i : i + batch_size], known)
+    else:
+        for price in prices:
+            normalise_price(price)
+    elapsed = perf_counter() - started
+    return {"batch_size": batch_size, "strings_per_second": round(len(prices) / elapsed, 1)}
+
+
+def time_pipeline(prices, batch_size):
+    crawler = get_crawler(Spider)
+    pipeline = NormalisePipeline(crawler.stats)
+    items = [
+        {
+            "price": price,
+            "date": "2024-06-01T12:00:00",
+            "attributes": PropertyAttributes(number_of_bedrooms=str(i % 5 + 1), date_available="%02d Jul 2024" % (i % 28 + 1)),
+        }
+        for i, price in enumerate(prices)
+    ]
+
+    started = perf_counter()
+    if batch_size:
+        # What flush() does with a full batch
+        for i in range(0, len(items), batch_size):
+            pipeline.normalise(items[i : i + batch_size])
+    else:
+        for item in items:
+            pipeline.process_item(item, None)
+    elapsed = perf_counter() - started
+    return {"batch_size": batch_size, "items_per_second": round(len(items) / elapsed, 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--strings", type=int, default=1000000)
+    parser.add_argument("--items", type=int, default=100000)
+    parser.add_argument("--batch-size", type=int, default=100)
+    args = parser.parse_args()
+
+    rnd = random.Random(42)
+    prices = make_prices(args.strings, rnd)
+    print(
+        json.dumps(
+            {
+                "strings": len(prices),
+                "distinct_strings": len(set(prices)),
+                "prices": [time_strings(prices, batch_size) for batch_size in (0, args.batch_size)],
+                "pipeline": [time_pipeline(prices[: args.items], batch_size) for batch_size in (0, args.batch_size)],
+            }
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Parses/s of PropertiesSpider.parse_item over the saved ad pages in
+benchmarks/fixtures, against the ItemLoader based extraction it replaced.
+
+    python -m benchmarks.parse_item --seconds 3
+"""
+
+import argparse
+import glob
+import json
+import os
+from time import perf_counter
+
+from itemloaders.processors import MapCompose, TakeFirst
+from lxml import html
+from scrapy.http import HtmlResponse
+from scrapy.item import Field
+from scrapy.loader import ItemLoader
+from scrapy.utils.test import get_crawler
+from w3lib.html import remove_tags
+
+from gumtree_scraper.extractors import format_paragraph, process_attr_str
+from gumtree_scraper.items import GumtreePropertiesItem
+from gumtree_scraper.spiders.properties import PropertiesSpider
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures")
+
+
+def legacy_parse_item(response):
+    """The ItemLoader extraction, without the housekeeping fields"""
+    item_loader = ItemLoader(item=GumtreePropertiesItem(), response=response)
+
+    item_loader.add_xpath("title", "//h1[1]/text()", MapCompose(str.strip, str.title))
+    item_loader.add_xpath("location", '//h4[@data-q="ad-location"]/text()', MapCompose(str.strip))
+    item_loader.add_xpath("price", '//h3[@data-q="ad-price"]/text()', MapCompose(str.strip))
+    item_loader.add_xpath("image_urls", '//li[contains(@class,"carousel-item")]/img/@src')
+    item_loader.add_xpath("description", '//p[@itemprop="description"]', MapCompose(remove_tags, format_paragraph))
+    item_loader.add_xpath("seller", '//h2[@class="truncate-line seller-rating-block-name"]/text()', MapCompose(str.strip, str.title))
+
+    attributes_container = response.xpath('//div[@data-q="attribute-container"]//dl').getall()
+    for each_attribute in attributes_container:
+        html_selector = html.fromstring(each_attribute)
+        attribute_field = html_selector.xpath("//dt/text()")[0]
+        attribute_value = html_selector.xpath("//dd/text()")[0]
+
+        item_key = process_attr_str(attribute_field)
+        GumtreePropertiesItem.fields[item_key] = Field(output_processor=TakeFirst())
+        item_loader.add_value(item_key, attribute_value)
+
+    return item_loader.load_item()
+
+
+def load_fixtures():
+    """(url, body) of every saved ad page"""
+    fixtures = []
+    for path in sorted(glob.glob(os.path.join(FIXTURES, "ad_*.html"))):
+        with open(path, "rb") as f:
+            url = "https://www.gumtree.com/p/property-to-rent/" + os.path.basename(path)
+            fixtures.append((url, f.read()))
+    return fixtures
+
+
+def measure(parse, fixtures, seconds):
+    """Parses a fresh response per call, so HTML parsing is included"""
+    parses = 0
+    started = perf_counter()
+    while perf_counter() - started < seconds:
+        for url, body in fixtures:
+            parse(HtmlResponse(url, body=body, encoding="utf-8"))
+            parses += 1
+    return parses / (perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seconds", type=float, default=3.0, help="time spent on each implementation")
+    args = parser.parse_args()
+
+    crawler = get_crawler(PropertiesSpider)
+    spider = PropertiesSpider.from_crawler(crawler)
+    fixtures = load_fixtures()
+
+    before = measure(legacy_parse_item, fixtures, args.seconds)
+    after = measure(spider.parse_item, fixtures, args.seconds)
+
+    print(json.dumps({"fixtures": len(fixtures), "itemloader_parses_per_second": round(before, 1), "extractor_parses_per_second": round(after, 1), "speedup": round(after / before, 2)}))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""
+Ad pages extracted per second by ParsePool's worker function with 1, 2, 4,
+... worker processes, up to the number of cores, over the saved ad pages
+in benchmarks/fixtures. Jobs are bounded the same way ParsePool bounds them.
+
+    python -m benchmarks.parse_pool --pages 2000
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from time import perf_counter
+
+from benchmarks.parse_item import load_fixtures
+from gumtree_scraper.parsing import extract_ad
+
+
+def measure(workers, fixtures, pages, max_in_flight):
+    """Pages per second with ```workers``` processes, once they're started"""
+    with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+        # Start the workers and build their extractors outside the timing
+        list(executor.map(extract_ad, *zip(*[(body, "utf-8", url) for url, body in fixtures * workers])))
+
+        in_flight = set()
+        started = perf_counter()
+        for i in range(pages):
+            if len(in_flight) >= max_in_flight:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    future.result()
+            url, body = fixtures[i % len(fixtures)]
+            in_flight.add(executor.submit(extract_ad, body, "utf-8", url))
+        for future in in_flight:
+            future.result()
+        return pages / (perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=2000, help="ad pages extracted per worker count")
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    fixtures = load_fixtures()
+
+    started = perf_counter()
+    for i in range(args.pages):
+        url, body = fixtures[i % len(fixtures)]
+        extract_ad(body, "utf-8", url)
+    in_process = args.pages / (perf_counter() - started)
+
+    results = []
+    workers = 1
+    while workers <= args.max_workers:
+        rate = measure(workers, fixtures, args.pages, 2 * workers)
+        results.append({"workers": workers, "pages_per_second": round(rate, 1), "speedup": round(rate / in_process, 2)})
+        workers *= 2
+
+    print(json.dumps({"cores": os.cpu_count(), "in_process_pages_per_second": round(in_process, 1), "pools": results}))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Compares PostgresWriter's per-item path with its batched COPY path against
+a stand-in PostgreSQL that only simulates round trips.
+
+    python -m benchmarks.postgres_writer --items 5000 --round-trip 0.002
+"""
+
+import argparse
+import json
+from time import time
+
+from scrapy import Spider
+from scrapy.utils.test import get_crawler
+from twisted.internet import defer, reactor
+
+from benchmarks.standins import StandInConnectionPool
+from gumtree_scraper.pipelines import PostgresWriter
+
+
+def make_items(count):
+    """Items shaped like the ones the spiders produce"""
+    return [
+        {
+            "url": "https://www.gumtree.com/p/property-to-rent/ad/%d" % i,
+            "title": "Two Bedroom Flat %d" % i,
+            "price": "£1,950pcm",
+            "location": "Camden, London",
+        }
+        for i in range(count)
+    ]
+
+
+@defer.inlineCallbacks
+def run_writer(batch_size, args):
+    """Pushes every item through the writer and returns the elapsed time"""
+    crawler = get_crawler(Spider)
+    spider = Spider(name="benchmark")
+
+    writer = PostgresWriter("postgresql://benchmark@localhost/benchmark", crawler.stats, batch_size, flush_interval=1.0)
+    writer.dbpool = StandInConnectionPool(args.round_trip, args.row_cost, args.connections)
+
+    semaphore = defer.DeferredSemaphore(args.concurrency)
+    started = time()
+    yield writer.open_spider(spider)
+    yield defer.DeferredList([semaphore.run(writer.process_item, item, spider) for item in make_items(args.items)])
+    yield writer.close_spider(spider)
+    elapsed = time() - started
+
+    return {
+        "mode": "batch" if batch_size else "per-item",
+        "batch_size": batch_size,
+        "items": args.items,
+        "seconds": round(elapsed, 3),
+        "items_per_second": round(args.items / elapsed, 1),
+        "interactions": writer.dbpool.interactions,
+        "max_batch_latency": crawler.stats.get_value("postgres_writer/max_batch_latency"),
+    }
+
+
+@defer.inlineCallbacks
+def main(args):
+    results = []
+    for batch_size in [0] + args.batch_sizes:
+        results.append((yield run_writer(batch_size, args)))
+    for result in results:
+        print(json.dumps(result))
+    reactor.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--items", type=int, default=2000)
+    parser.add_argument("--round-trip", type=float, default=0.002, help="seconds per simulated round trip")
+    parser.add_argument("--row-cost", type=float, default=0.00001, help="simulated server seconds per row")
+    parser.add_argument("--connections", type=int, default=5, help="size of the connection pool")
+    parser.add_argument("--concurrency", type=int, default=100, help="items in flight, like CONCURRENT_ITEMS")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[100, 500])
+    reactor.callWhenRunning(main, parser.parse_args())
+    reactor.run()
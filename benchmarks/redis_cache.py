@@ -0,0 +1,115 @@
+"""
+Redis round trips and items/s of RedisCache against the one GET and one SET
+per item it replaced, on a stand-in Redis. Items reuse addresses the way
+ads do, and part of them were cached by earlier crawls.
+
+    python -m benchmarks.redis_cache --items 20000 --addresses 2000
+"""
+
+import argparse
+import json
+import random
+from time import time
+
+from scrapy import Spider
+from scrapy.utils.test import get_crawler
+from twisted.internet import defer, reactor
+
+from benchmarks.fake_geocoder import fake_location
+from gumtree_scraper.pipelines import RedisCache
+from tests.fakes import FakeRedis
+
+
+class LegacyRedisCache(object):
+    """The previous RedisCache: a GET in process_item, a SET in item_scraped"""
+
+    redis_nm = "ADDRESS_CACHE"
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    @defer.inlineCallbacks
+    def process_item(self, item, spider):
+        value = yield self.connection.get(self.redis_nm + ":" + item["location"])
+        if value:
+            item["geo"] = json.loads(value)
+        defer.returnValue(item)
+
+    def item_scraped(self, item, spider):
+        value = json.dumps(item["geo"], ensure_ascii=False)
+        return self.connection.set(self.redis_nm + ":" + item["location"], value)
+
+    def close_spider(self, spider):
+        return defer.succeed(None)
+
+
+def make_locations(count, addresses):
+    """Zipf-like: a few areas have most of the ads"""
+    rnd = random.Random(42)
+    return ["Area %d, London" % min(int(rnd.paretovariate(0.7)), addresses) for _ in range(count)]
+
+
+@defer.inlineCallbacks
+def run(name, locations, args):
+    crawler = get_crawler(Spider)
+    spider = Spider(name="benchmark")
+
+    redis = FakeRedis(args.round_trip)
+    # What earlier crawls left behind
+    for location in sorted(set(locations))[: int(len(set(locations)) * args.cached)]:
+        redis.values["ADDRESS_CACHE:" + location] = json.dumps(fake_location(location))
+
+    if name == "legacy":
+        cache = LegacyRedisCache(redis)
+    else:
+        cache = RedisCache(crawler, redis, max_entries=args.max_entries, ttl=86400)
+
+    @defer.inlineCallbacks
+    def one(location):
+        item = yield cache.process_item({"location": location}, spider)
+        if "geo" not in item:
+            # GeoPipeline's part
+            item["geo"] = fake_location(location)
+        yield cache.item_scraped(item, spider)
+
+    started = time()
+    # Items arrive in waves, like they leave the spider
+    for i in range(0, len(locations), args.wave):
+        yield defer.DeferredList([one(location) for location in locations[i : i + args.wave]])
+    yield cache.close_spider(spider)
+    elapsed = time() - started
+
+    stats = crawler.stats.get_stats()
+    return {
+        "implementation": name,
+        "seconds": round(elapsed, 2),
+        "items_per_second": round(len(locations) / elapsed, 1),
+        "round_trips": redis.round_trips,
+        "l1_hit_rate": stats.get("redis_cache/l1_hit_rate"),
+        "l2_hit_rate": stats.get("redis_cache/l2_hit_rate"),
+    }
+
+
+@defer.inlineCallbacks
+def main(args):
+    locations = make_locations(args.items, args.addresses)
+    results = []
+    for name in ("legacy", "tiered"):
+        results.append((yield run(name, locations, args)))
+    print(json.dumps({"items": args.items, "distinct_addresses": len(set(locations)), "results": results}))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--items", type=int, default=20000)
+    parser.add_argument("--addresses", type=int, default=2000, help="largest address of the Zipf-like distribution")
+    parser.add_argument("--cached", type=float, default=0.5, help="fraction of addresses already in Redis")
+    parser.add_argument("--wave", type=int, default=100, help="items in the pipelines at once")
+    parser.add_argument("--round-trip", type=float, default=0.0005, help="seconds per Redis round trip")
+    parser.add_argument("--max-entries", type=int, default=10000, help="in-process cache size")
+    args = parser.parse_args()
+
+    d = main(args)
+    d.addErrback(lambda failure: failure.printTraceback())
+    d.addBoth(lambda _: reactor.stop())
+    reactor.run()
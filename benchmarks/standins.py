@@ -0,0 +1,69 @@
+"""Local stand-ins for the external services used by the pipelines."""
+
+from time import sleep
+
+from twisted.internet import reactor, threads
+from twisted.python.threadpool import ThreadPool
+
+from gumtree_scraper.pipelines import PostgresWriter
+
+
+class StandInCursor(object):
+    """
+    A DB-API cursor that does no work but sleeps for the time a round trip
+    to a PostgreSQL server would take
+    """
+
+    def __init__(self, round_trip, row_cost):
+        self.round_trip = round_trip
+        self.row_cost = row_cost
+        self.rowcount = -1
+        self.staged = 0
+
+    def execute(self, sql, args=None):
+        """One round trip, plus server-side work for the staged rows"""
+        sleep(self.round_trip + self.row_cost * self.staged)
+        self.rowcount = self.staged or 1
+
+    def copy_expert(self, sql, file):
+        """One round trip that streams every row of ```file```"""
+        self.staged = file.read().count("\n")
+        sleep(self.round_trip + self.row_cost * self.staged)
+
+
+class StandInConnectionPool(object):
+    """
+    Mimics twisted.enterprise.adbapi.ConnectionPool: interactions run in a
+    bounded thread pool and each one ends with a commit round trip
+    """
+
+    def __init__(self, round_trip=0.001, row_cost=0.00001, max_connections=5):
+        self.round_trip = round_trip
+        self.row_cost = row_cost
+        self.interactions = 0
+        self.threadpool = ThreadPool(1, max_connections)
+        self.threadpool.start()
+
+    def runInteraction(self, interaction, *args, **kw):
+        """Runs ```interaction``` with a stand-in cursor in the pool"""
+        return threads.deferToThreadPool(reactor, self.threadpool, self._run_interaction, interaction, *args, **kw)
+
+    def _run_interaction(self, interaction, *args, **kw):
+        cursor = StandInCursor(self.round_trip, self.row_cost)
+        result = interaction(cursor, *args, **kw)
+        # Commit
+        sleep(self.round_trip)
+        self.interactions += 1
+        return result
+
+    def close(self):
+        """Stop the pool's threads"""
+        self.threadpool.stop()
+
+
+class StandInPostgresWriter(PostgresWriter):
+    """PostgresWriter that writes to a StandInConnectionPool"""
+
+    def __init__(self, postgres_url, stats=None, batch_size=0, flush_interval=5.0):
+        super().__init__(postgres_url, stats, batch_size, flush_interval)
+        self.dbpool = StandInConnectionPool()
@@ -0,0 +1,95 @@
+"""
+Queue overhead of Throttler against the list based implementation it
+replaced: 100k waiters are queued and released on a simulated clock, so
+only the throttlers' own work is timed. Also counts the timer calls each
+one makes during a minute with nobody waiting.
+
+    python -m benchmarks.throttler --waiters 100000
+"""
+
+import argparse
+import json
+from time import perf_counter
+
+from twisted.internet import defer, task
+
+from gumtree_scraper.pipelines import Throttler
+
+
+class LegacyThrottler(object):
+    """The previous Throttler: a list and a LoopingCall ticking forever"""
+
+    def __init__(self, rate, clock):
+        self.queue = []
+        self.looping_call = task.LoopingCall(self._allow_one)
+        self.looping_call.clock = clock
+        self.looping_call.start(1.0 / float(rate))
+
+    def stop(self):
+        self.looping_call.stop()
+
+    def throttle(self):
+        d = defer.Deferred()
+        self.queue.append(d)
+        return d
+
+    def _allow_one(self):
+        if self.queue:
+            self.queue.pop(0).callback(None)
+
+
+class CountingClock(task.Clock):
+    """task.Clock that counts the calls it schedules"""
+
+    scheduled = 0
+
+    def callLater(self, *args, **kwargs):
+        self.scheduled += 1
+        return super().callLater(*args, **kwargs)
+
+
+def run(name, args):
+    clock = CountingClock()
+    if name == "legacy":
+        throttler = LegacyThrottler(args.rate, clock)
+    else:
+        throttler = Throttler(args.rate, burst=args.burst, clock=clock)
+
+    released = [0]
+
+    def done(_):
+        released[0] += 1
+
+    started = perf_counter()
+    for _ in range(args.waiters):
+        throttler.throttle().addCallback(done)
+    queued = perf_counter() - started
+
+    # Let the clock run until every waiter went through
+    step = 1.0 / args.rate
+    while released[0] < args.waiters:
+        clock.advance(step)
+    elapsed = perf_counter() - started
+
+    # A minute with nobody waiting
+    scheduled = clock.scheduled
+    for _ in range(int(60 * args.rate)):
+        clock.advance(step)
+    idle_calls = clock.scheduled - scheduled
+    throttler.stop()
+
+    return {"implementation": name, "queue_seconds": round(queued, 3), "total_seconds": round(elapsed, 3), "idle_timer_calls_per_minute": idle_calls}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--waiters", type=int, default=100000)
+    parser.add_argument("--rate", type=float, default=1000.0, help="releases per simulated second")
+    parser.add_argument("--burst", type=int, default=1)
+    args = parser.parse_args()
+
+    print(json.dumps({"waiters": args.waiters, "results": [run(name, args) for name in ("legacy", "token-bucket")]}))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+"""
+Append-only archive of downloaded responses, and a download handler that
+serves requests from it so that crawls can be replayed offline.
+
+An archive is two files: ```<path>``` holds one zlib-compressed record per
+response, ```<path>.idx``` holds fixed-size (fingerprint, offset, length)
+entries sorted by request fingerprint, which the reader memory-maps and
+binary searches. The writer appends to the index and sorts it when it's
+closed. An archive whose writer didn't get there, e.g. after a crash, is
+sorted when it's opened again.
+"""
+
+import bisect
+import json
+import mmap
+import os
+import struct
+import zlib
+
+from scrapy.exceptions import NotConfigured
+from scrapy.http import Headers
+from scrapy.responsetypes import responsetypes
+from twisted.internet import defer
+
+# Request fingerprint, offset and length of the record in the archive
+INDEX_ENTRY = struct.Struct("<20sQI")
+
+# Length of the JSON header at the start of a record
+HEADER_LENGTH = struct.Struct("<I")
+
+
+def sort_index(path):
+    """
+    Sorts the index of the archive at ```path``` unless it already is,
+    dropping a torn last entry and entries past the end of the records.
+    Returns the number of entries.
+    """
+    index_path = path + ".idx"
+    if not os.path.exists(index_path):
+        return 0
+
+    with open(index_path, "rb") as f:
+        raw = f.read()
+    size = os.path.getsize(path) if os.path.exists(path) else 0
+    complete = len(raw) - len(raw) % INDEX_ENTRY.size
+    entries = [raw[i : i + INDEX_ENTRY.size] for i in range(0, complete, INDEX_ENTRY.size)]
+    entries = [entry for entry in entries if sum(INDEX_ENTRY.unpack(entry)[1:]) <= size]
+
+    if len(entries) * INDEX_ENTRY.size == len(raw) and all(entries[i][:20] <= entries[i + 1][:20] for i in range(len(entries) - 1)):
+        return len(entries)
+
+    # Stable sort, so the latest copy of a response stays last
+    entries.sort(key=lambda entry: entry[:20])
+    with open(index_path + ".tmp", "wb") as f:
+        f.write(b"".join(entries))
+    os.replace(index_path + ".tmp", index_path)
+    return len(entries)
+
+
+class ResponseArchiveWriter(object):
+    """Appends responses to an archive"""
+
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        # Left unsorted by a writer that didn't close
+        sort_index(path)
+        self.data = open(path, "ab")
+        self.index = open(path + ".idx", "ab")
+
+    def append(self, fingerprint, response):
+        """Stores ```response``` under the request ```fingerprint```"""
+        header = json.dumps(
+            {
+                "url": response.url,
+                "status": response.status,
+                "headers": [
+                    [key.decode("latin-1"), [value.decode("latin-1") for value in values]]
+                    for key, values in response.headers.items()
+                ],
+                "flags": response.flags,
+            }
+        ).encode("utf-8")
+        record = zlib.compress(HEADER_LENGTH.pack(len(header)) + header + response.body)
+
+        offset = self.data.tell()
+        self.data.write(record)
+        self.index.write(INDEX_ENTRY.pack(fingerprint, offset, len(record)))
+
+    def close(self):
+        """Closes the archive and sorts its index for the reader"""
+        self.data.close()
+        self.index.close()
+        sort_index(self.path)
+
+
+class _Fingerprints(object):
+    """The fingerprints of a memory-mapped index, as a sequence for bisect"""
+
+    def __init__(self, index):
+        self.index = index
+
+    def __len__(self):
+        return len(self.index) // INDEX_ENTRY.size
+
+    def __getitem__(self, i):
+        start = i * INDEX_ENTRY.size
+        return self.index[start : start + 20]
+
+
+class ResponseArchiveReader(object):
+    """Looks responses up in an archive by request fingerprint"""
+
+    def __init__(self, path):
+        sort_index(path)
+        self.data_file = open(path, "rb")
+        self.index_file = open(path + ".idx", "rb")
+
+        # mmap can't map empty files
+        self.data = mmap.mmap(self.data_file.fileno(), 0, access=mmap.ACCESS_READ) if os.path.getsize(path) else b""
+        self.index = mmap.mmap(self.index_file.fileno(), 0, access=mmap.ACCESS_READ) if os.path.getsize(path + ".idx") else b""
+        self.fingerprints = _Fingerprints(self.index)
+
+    def __len__(self):
+        return len(self.fingerprints)
+
+    def get(self, fingerprint):
+        """Returns (header dict, body) for ```fingerprint```, or None"""
+        i = bisect.bisect_right(self.fingerprints, fingerprint) - 1
+        if i < 0 or self.fingerprints[i] != fingerprint:
+            return None
+
+        _, offset, length = INDEX_ENTRY.unpack_from(self.index, i * INDEX_ENTRY.size)
+        record = zlib.decompress(self.data[offset : offset + length])
+        (header_length,) = HEADER_LENGTH.unpack_from(record)
+        header_end = HEADER_LENGTH.size + header_length
+        return json.loads(record[HEADER_LENGTH.size : header_end]), record[header_end:]
+
+    def close(self):
+        for mapping in (self.data, self.index):
+            if isinstance(mapping, mmap.mmap):
+                mapping.close()
+        self.data_file.close()
+        self.index_file.close()
+
+
+class ReplayDownloadHandler(object):
+    """
+    Download handler that answers every request from the REPLAY_ARCHIVE
+    archive instead of the network. Requests that weren't recorded get an
+    empty 404.
+    """
+
+    lazy = False
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler.settings, crawler)
+
+    def __init__(self, settings, crawler=None):
+        path = settings.get("REPLAY_ARCHIVE")
+        if not path:
+            raise NotConfigured("ReplayDownloadHandler needs REPLAY_ARCHIVE")
+
+        self.crawler = crawler
+        self.archive = ResponseArchiveReader(path)
+
+    def download_request(self, request, spider):
+        stats = self.crawler.stats
+        record = self.archive.get(self.crawler.request_fingerprinter.fingerprint(request))
+        if record is None:
+            stats.inc_value("replay/misses", spider=spider)
+            return defer.succeed(responsetypes.from_args(url=request.url)(url=request.url, status=404, request=request, flags=["replay-miss"]))
+
+        stats.inc_value("replay/hits", spider=spider)
+        header, body = record
+        headers = Headers([(key, values) for key, values in header["headers"]])
+        respcls = responsetypes.from_args(headers=headers, url=header["url"], body=body)
+        response = respcls(
+            url=header["url"],
+            status=header["status"],
+            headers=headers,
+            body=body,
+            flags=header["flags"] + ["replayed"],
+            request=request,
+        )
+        return defer.succeed(response)
+
+    def close(self):
+        self.archive.close()
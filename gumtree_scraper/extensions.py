@@ -1,12 +1,19 @@
+import json
 import logging
 from time import time
 
 from scrapy import signals
 from scrapy.exceptions import NotConfigured
-from twisted.internet import task
+from twisted.internet import reactor, task
+from twisted.web import resource, server
+
+from gumtree_scraper.instrumentation import Histogram, stage_timed
 
 logger = logging.getLogger(__name__)
 
+# Sent by Latencies every LATENCIES_INTERVAL with the measurements it logs
+latencies_measured = object()
+
 
 class SetLoggingFileTerminal:
     @classmethod
@@ -76,6 +83,10 @@ class Latencies:
         if not self.interval:
             raise NotConfigured
 
+        # Optional JSON lines file the percentiles are appended to
+        self.metrics_file_name = crawler.settings.get("LATENCIES_METRICS_FILE")
+        self.metrics_file = None
+
         cs = crawler.signals
         cs.connect(self._spider_opened, signal=signals.spider_opened)
         cs.connect(self._spider_closed, signal=signals.spider_closed)
@@ -83,10 +94,24 @@ class Latencies:
         cs.connect(self._response_received, signal=signals.response_received)
         cs.connect(self._item_scraped, signal=signals.item_scraped)
         cs.connect(self._item_dropped, signal=signals.item_dropped)
+        cs.connect(self._stage_timed, signal=stage_timed)
 
-        self.latency, self.proc_latency, self.items = 0, 0, 0
+        self.latency, self.proc_latency, self.items, self.timed_items = 0, 0, 0, 0
+
+        # One histogram per stage, for the whole crawl
+        self.histograms = {
+            "latency": Histogram(),
+            "pipelines": Histogram(),
+            "download": Histogram(),
+        }
 
     def _spider_opened(self, spider):
+        self.started = time()
+        self.first_item = True
+
+        if self.metrics_file_name:
+            self.metrics_file = open(self.metrics_file_name, "a", encoding="utf-8")
+
         self.task = task.LoopingCall(self._log, spider)
         self.task.start(self.interval)
 
@@ -94,16 +119,41 @@ class Latencies:
         if hasattr(self, "task") and self.task.running:
             self.task.stop()
 
+        self._report(spider)
+        if self.metrics_file is not None:
+            self.metrics_file.close()
+            self.metrics_file = None
+
     def _request_scheduled(self, request, spider):
         request.meta["schedule_time"] = time()
 
     def _response_received(self, response, request, spider):
         request.meta["received_time"] = time()
 
+        download_latency = request.meta.get("download_latency")
+        if download_latency is not None:
+            self.histograms["download"].record(download_latency)
+
     def _item_scraped(self, item, response, spider):
-        self.latency += time() - response.meta["schedule_time"]
-        self.proc_latency += time() - response.meta["received_time"]
         self.items += 1
+        if self.first_item:
+            self.first_item = False
+            self.crawler.stats.set_value("latencies/time_to_first_item", time() - self.started)
+
+        # Items can come from responses that were never scheduled, e.g.
+        # replayed or built by hand
+        meta = getattr(response, "meta", None) or {}
+        if "schedule_time" not in meta or "received_time" not in meta:
+            return
+
+        now = time()
+        latency = now - meta["schedule_time"]
+        proc_latency = now - meta["received_time"]
+        self.latency += latency
+        self.proc_latency += proc_latency
+        self.timed_items += 1
+        self.histograms["latency"].record(latency)
+        self.histograms["pipelines"].record(proc_latency)
 
     def _item_dropped(self, item, response, exception, spider):
         stats = spider.crawler.stats.get_stats()
@@ -114,12 +164,251 @@ class Latencies:
         except:
             pass
 
+    def _stage_timed(self, stage, seconds):
+        histogram = self.histograms.get(stage)
+        if histogram is None:
+            histogram = self.histograms[stage] = Histogram()
+        histogram.record(seconds)
+
+    def _report(self, spider):
+        """Puts the percentiles in stats and in the metrics file"""
+        stats = self.crawler.stats
+        metrics = {"time": time(), "spider": spider.name}
+        for stage, histogram in self.histograms.items():
+            summary = histogram.summary()
+            metrics[stage] = summary
+            for key, value in summary.items():
+                stats.set_value("latencies/%s/%s" % (stage, key), value)
+
+        if self.metrics_file is not None:
+            self.metrics_file.write(json.dumps(metrics) + "\n")
+            self.metrics_file.flush()
+
     def _log(self, spider):
         irate = float(self.items) / self.interval
-        latency = self.latency / self.items if self.items else 0
-        proc_latency = self.proc_latency / self.items if self.items else 0
+        latency = self.latency / self.timed_items if self.timed_items else 0
+        proc_latency = self.proc_latency / self.timed_items if self.timed_items else 0
         spider.logger.info(
             ("Scraped %d items at %.1f items/s, avg latency: " "%.2f s and avg time in pipelines: %.2f s")
             % (self.items, irate, latency, proc_latency)
         )
-        self.latency, self.proc_latency, self.items = 0, 0, 0
+        self.crawler.signals.send_catch_log(
+            signal=latencies_measured,
+            spider=spider,
+            items=self.items,
+            rate=irate,
+            latency=latency,
+            proc_latency=proc_latency,
+        )
+        self._report(spider)
+        self.latency, self.proc_latency, self.items, self.timed_items = 0, 0, 0, 0
+
+
+class AdaptiveConcurrency:
+    """
+    Closed-loop controller for the downloader. Every time Latencies reports,
+    per-domain concurrency and delay are raised while items/s keeps up, and
+    cut when latency, the 429/503 rate or the number of items waiting in
+    the pipelines go over their targets. Don't use it with AutoThrottle.
+    """
+
+    throttled_statuses = (429, 503)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool("ADAPTIVE_CONCURRENCY_ENABLED"):
+            raise NotConfigured
+        # The measurements come from Latencies
+        if not settings.getfloat("LATENCIES_INTERVAL"):
+            raise NotConfigured("AdaptiveConcurrency needs LATENCIES_INTERVAL")
+
+        return cls(crawler)
+
+    def __init__(self, crawler):
+        self.crawler = crawler
+        settings = crawler.settings
+
+        self.target_latency = settings.getfloat("ADAPTIVE_CONCURRENCY_TARGET_LATENCY", 10.0)
+        self.target_error_rate = settings.getfloat("ADAPTIVE_CONCURRENCY_TARGET_ERROR_RATE", 0.05)
+        self.min_concurrency = settings.getint("ADAPTIVE_CONCURRENCY_MIN_CONCURRENCY", 1)
+        # The downloader never runs more than CONCURRENT_REQUESTS in total
+        global_max = settings.getint("CONCURRENT_REQUESTS")
+        self.max_concurrency = min(settings.getint("ADAPTIVE_CONCURRENCY_MAX_CONCURRENCY", global_max), global_max)
+        self.max_delay = settings.getfloat("ADAPTIVE_CONCURRENCY_MAX_DELAY", 10.0)
+        # Back-pressure: items being processed by the pipelines
+        self.max_pending_items = settings.getint("ADAPTIVE_CONCURRENCY_MAX_PENDING_ITEMS", settings.getint("CONCURRENT_ITEMS"))
+
+        # Per download slot: [responses, throttled responses] since last tick
+        self.responses = {}
+        self.last_rate = 0.0
+
+        cs = crawler.signals
+        # Before the downloader middlewares, where RetryMiddleware turns
+        # 429s and 503s into retries that response_received never sees
+        cs.connect(self._response_downloaded, signal=signals.response_downloaded)
+        cs.connect(self._latencies_measured, signal=latencies_measured)
+
+    def _response_downloaded(self, response, request, spider):
+        counts = self.responses.setdefault(request.meta.get("download_slot"), [0, 0])
+        counts[0] += 1
+        if response.status in self.throttled_statuses:
+            counts[1] += 1
+
+    def _latencies_measured(self, spider, items, rate, latency, proc_latency):
+        engine = self.crawler.engine
+        stats = self.crawler.stats
+
+        pending_items = engine.scraper.slot.itemproc_size
+        backpressure = pending_items > self.max_pending_items
+        if backpressure:
+            stats.inc_value("adaptive_concurrency/backpressure")
+
+        for key, slot in engine.downloader.slots.items():
+            responses, throttled = self.responses.pop(key, (0, 0))
+            error_rate = float(throttled) / responses if responses else 0.0
+
+            if error_rate > self.target_error_rate:
+                # The site is pushing back: halve concurrency, back off
+                slot.concurrency = max(self.min_concurrency, slot.concurrency // 2)
+                slot.delay = min(self.max_delay, max(slot.delay * 2, 0.25))
+                stats.inc_value("adaptive_concurrency/decreases")
+            elif backpressure or latency > self.target_latency:
+                # We are going faster than we can process
+                slot.concurrency = max(self.min_concurrency, slot.concurrency // 2)
+                stats.inc_value("adaptive_concurrency/decreases")
+            elif rate > 0 and rate >= 0.95 * self.last_rate:
+                # Throughput is holding up: drop the delay first, then probe
+                # one more concurrent request. No items at all isn't that
+                if slot.delay > 0:
+                    slot.delay = slot.delay / 2 if slot.delay > 0.05 else 0.0
+                else:
+                    slot.concurrency = min(self.max_concurrency, slot.concurrency + 1)
+                stats.inc_value("adaptive_concurrency/increases")
+
+            stats.set_value("adaptive_concurrency/%s/concurrency" % key, slot.concurrency)
+            stats.set_value("adaptive_concurrency/%s/delay" % key, slot.delay)
+
+        # What's left is from slots the downloader has closed since
+        self.responses.clear()
+        self.last_rate = rate
+
+
+class MetricsResource(resource.Resource):
+    """Renders the exporter's metrics in the Prometheus text format"""
+
+    isLeaf = True
+
+    def __init__(self, exporter):
+        super().__init__()
+        self.exporter = exporter
+
+    def render_GET(self, request):
+        request.setHeader(b"Content-Type", b"text/plain; version=0.0.4; charset=utf-8")
+        return self.exporter.render().encode("utf-8")
+
+
+class MetricsExporter:
+    """
+    Serves crawl metrics on http://METRICS_EXPORTER_HOST:METRICS_EXPORTER_PORT/metrics
+    for Prometheus: the main counters, every numeric crawler stat, and the
+    Latencies histograms
+    """
+
+    # Named metrics and the crawler stat each one is read from
+    counters = (
+        ("gumtree_requests_total", "downloader/request_count", "Requests sent"),
+        ("gumtree_responses_total", "downloader/response_count", "Responses received"),
+        ("gumtree_items_scraped_total", "item_scraped_count", "Items scraped"),
+        ("gumtree_items_dropped_total", "item_dropped_count", "Items dropped"),
+        ("gumtree_images_total", "file_count", "Images processed by the images pipeline"),
+        ("gumtree_images_downloaded_total", "file_status_count/downloaded", "Images downloaded"),
+    )
+    gauges = (("gumtree_db_pool_pending", "postgres_writer/pending", "PostgreSQL interactions queued or running"),)
+
+    # Upper bounds, in seconds, of the histogram buckets exported. Each one
+    # is exported as the edge of the Histogram bucket just below it, so the
+    # cumulative counts are exact
+    buckets = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool("METRICS_EXPORTER_ENABLED"):
+            raise NotConfigured
+
+        host = crawler.settings.get("METRICS_EXPORTER_HOST", "127.0.0.1")
+        port = crawler.settings.getint("METRICS_EXPORTER_PORT", 9410)
+        return cls(crawler, host, port)
+
+    def __init__(self, crawler, host, port):
+        self.crawler = crawler
+        self.host = host
+        self.port = port
+        self.listening_port = None
+
+        crawler.signals.connect(self._spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(self._spider_closed, signal=signals.spider_closed)
+
+    def _spider_opened(self, spider):
+        root = resource.Resource()
+        root.putChild(b"metrics", MetricsResource(self))
+        self.listening_port = reactor.listenTCP(self.port, server.Site(root), interface=self.host)
+        logger.info("Serving metrics on http://%s:%d/metrics", self.host, self.listening_port.getHost().port)
+
+    def _spider_closed(self, spider, reason):
+        if self.listening_port is not None:
+            port, self.listening_port = self.listening_port, None
+            return port.stopListening()
+
+    def _histograms(self):
+        """The histograms of the Latencies extension, if it is enabled"""
+        for extension in getattr(self.crawler.extensions, "middlewares", ()):
+            if isinstance(extension, Latencies):
+                return extension.histograms
+        return {}
+
+    @staticmethod
+    def _label(value):
+        return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+    def render(self):
+        """All metrics, in the Prometheus text exposition format"""
+        stats = self.crawler.stats.get_stats()
+        lines = []
+
+        for name, key, help_text in self.counters:
+            lines.append("# HELP %s %s" % (name, help_text))
+            lines.append("# TYPE %s counter" % name)
+            lines.append("%s %s" % (name, stats.get(key, 0)))
+
+        for name, key, help_text in self.gauges:
+            lines.append("# HELP %s %s" % (name, help_text))
+            lines.append("# TYPE %s gauge" % name)
+            lines.append("%s %s" % (name, stats.get(key, 0)))
+
+        lookups = stats.get("geo_pipeline/lookups", 0)
+        if lookups:
+            lines.append("# HELP gumtree_geocode_cache_hit_ratio Geocode lookups answered without an API call")
+            lines.append("# TYPE gumtree_geocode_cache_hit_ratio gauge")
+            lines.append("gumtree_geocode_cache_hit_ratio %s" % (1.0 - float(stats.get("geo_pipeline/misses", 0)) / lookups))
+
+        histograms = self._histograms()
+        if histograms:
+            lines.append("# HELP gumtree_stage_seconds Time spent in each stage of the crawl")
+            lines.append("# TYPE gumtree_stage_seconds histogram")
+            for stage, histogram in histograms.items():
+                stage = self._label(stage)
+                for bound in self.buckets:
+                    edge, count = histogram.count_below(bound)
+                    lines.append('gumtree_stage_seconds_bucket{stage="%s",le="%r"} %d' % (stage, edge, count))
+                lines.append('gumtree_stage_seconds_bucket{stage="%s",le="+Inf"} %d' % (stage, histogram.count))
+                lines.append('gumtree_stage_seconds_sum{stage="%s"} %s' % (stage, histogram.total))
+                lines.append('gumtree_stage_seconds_count{stage="%s"} %d' % (stage, histogram.count))
+
+        lines.append("# HELP gumtree_stat Every numeric crawler stat")
+        lines.append("# TYPE gumtree_stat gauge")
+        for key, value in sorted(stats.items()):
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                lines.append('gumtree_stat{key="%s"} %s' % (self._label(key), value))
+
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,79 @@
+"""Compiled XPath extraction of fields from Gumtree ad pages."""
+
+from lxml import etree
+
+from gumtree_scraper.items import PropertyAttributes
+
+
+def take_first(values):
+    """Like itemloaders' TakeFirst: the first value that isn't None or empty"""
+    for value in values:
+        if value is not None and value != "":
+            return value
+    return None
+
+
+def format_paragraph(job_description):
+    """Normalize whitespace: collapse spaces and newlines to single spaces."""
+    job_description = " ".join(job_description.split())
+
+    # Replace newline characters with space
+    job_description = job_description.replace("\n", " ")
+    return job_description
+
+
+def process_attr_str(input_string):
+    """Normalize attribute name to a lowercase, underscore-separated key."""
+    input_string = input_string.strip()
+
+    # Convert to lower case
+    input_string = input_string.lower()
+
+    input_string = "_".join(input_string.split())
+    return input_string
+
+
+class AdExtractor(object):
+    """
+    Extracts the fields of an ad from the lxml tree the response was already
+    parsed into. Every selector is compiled once, when the extractor is built.
+    """
+
+    def __init__(self):
+        self.title = etree.XPath("//h1[1]/text()")
+        self.location = etree.XPath('//h4[@data-q="ad-location"]/text()')
+        self.price = etree.XPath('//h3[@data-q="ad-price"]/text()')
+        self.image_urls = etree.XPath('//li[contains(@class,"carousel-item")]/img/@src')
+        self.description = etree.XPath('//p[@itemprop="description"]')
+        self.seller = etree.XPath('//h2[@class="truncate-line seller-rating-block-name"]/text()')
+
+        # Attribute <dl>s, and their term/value relative to each <dl>
+        self.attributes = etree.XPath('//div[@data-q="attribute-container"]//dl')
+        self.attribute_field = etree.XPath(".//dt/text()")
+        self.attribute_value = etree.XPath(".//dd/text()")
+
+        self.text = etree.XPath("string()")
+
+    def extract(self, root):
+        """
+        Returns the fields dict and the PropertyAttributes of the ad in
+        ```root```. Fields without a value are left out, like ItemLoader does.
+        """
+        fields = {
+            "title": take_first(value.strip().title() for value in self.title(root)),
+            "location": take_first(value.strip() for value in self.location(root)),
+            "price": take_first(value.strip() for value in self.price(root)),
+            "description": take_first(format_paragraph(self.text(element)) for element in self.description(root)),
+            "seller": take_first(value.strip().title() for value in self.seller(root)),
+            "image_urls": [str(value) for value in self.image_urls(root)],
+        }
+        fields = {key: value for key, value in fields.items() if value}
+
+        attributes = PropertyAttributes()
+        for element in self.attributes(root):
+            attribute_field = self.attribute_field(element)
+            attribute_value = self.attribute_value(element)
+            if attribute_field and attribute_value:
+                attributes.set(process_attr_str(attribute_field[0]), str(attribute_value[0]))
+
+        return fields, attributes
@@ -0,0 +1,172 @@
+"""
+Offline geocoding of Gumtree location strings against a gazetteer of UK
+postcodes, postcode districts and place names.
+
+The index is one file of fixed-size (name, lat, lng) entries sorted by
+normalised name, which the reader memory-maps and binary searches. Build it
+from a CSV with a name/postcode column and latitude/longitude columns:
+
+    python -m gumtree_scraper.gazetteer places.csv gazetteer.idx
+"""
+
+import argparse
+import bisect
+import csv
+import mmap
+import os
+import re
+import struct
+
+MAGIC = b"GZT1"
+HEADER = struct.Struct("<4sI")
+# Normalised name, NUL padded, latitude and longitude
+ENTRY = struct.Struct("<32sff")
+NAME_LENGTH = 32
+
+NAME_COLUMNS = ("name", "place", "place_name", "postcode", "outcode", "pcd", "district")
+LAT_COLUMNS = ("latitude", "lat")
+LNG_COLUMNS = ("longitude", "lng", "lon", "long")
+
+# A full postcode, or just its district ("outcode")
+POSTCODE_RE = re.compile(r"\b([A-Z]{1,2}[0-9][A-Z0-9]?)(?:\s*([0-9])([A-Z]{2}))?\b", re.IGNORECASE)
+NOT_WORD_RE = re.compile(r"[^a-z0-9]+")
+
+
+def normalise(name):
+    """Lower case words separated by single spaces, without punctuation"""
+    return NOT_WORD_RE.sub(" ", name.lower()).strip()
+
+
+def build(rows, path):
+    """
+    Writes the index of ```rows``` of (name, lat, lng) to ```path```. When a
+    name comes up more than once the first row wins. Returns the number of
+    entries written.
+    """
+    entries = {}
+    for name, lat, lng in rows:
+        key = normalise(name).encode("utf-8")[:NAME_LENGTH]
+        if key and key not in entries:
+            entries[key] = (float(lat), float(lng))
+
+    with open(path + ".tmp", "wb") as f:
+        f.write(HEADER.pack(MAGIC, len(entries)))
+        for key in sorted(entries):
+            f.write(ENTRY.pack(key, *entries[key]))
+    os.replace(path + ".tmp", path)
+    return len(entries)
+
+
+def read_csv(f):
+    """(name, lat, lng) rows of a gazetteer CSV, found by their headers"""
+    reader = csv.DictReader(f)
+    fields = {field.strip().lower(): field for field in reader.fieldnames}
+
+    def column(candidates):
+        for candidate in candidates:
+            if candidate in fields:
+                return fields[candidate]
+        raise ValueError("No %s column in %s" % ("/".join(candidates), ", ".join(reader.fieldnames)))
+
+    name, lat, lng = column(NAME_COLUMNS), column(LAT_COLUMNS), column(LNG_COLUMNS)
+    for row in reader:
+        if row[name] and row[lat] and row[lng]:
+            yield row[name], row[lat], row[lng]
+
+
+class _Names(object):
+    """The names of a memory-mapped index, as a sequence for bisect"""
+
+    def __init__(self, index, count):
+        self.index = index
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        start = HEADER.size + i * ENTRY.size
+        return self.index[start : start + NAME_LENGTH].rstrip(b"\0")
+
+
+class Gazetteer(object):
+    """
+    Looks location strings up in an index built by build(). Postcodes are
+    tried first, from the full postcode down to its district, then every
+    comma separated part of the location, most specific first: the whole
+    part, the part without its last words, and finally the first name that
+    starts with the part.
+    """
+
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        self.index = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, count = HEADER.unpack_from(self.index)
+        if magic != MAGIC:
+            raise ValueError("%s isn't a gazetteer index" % path)
+        self.names = _Names(self.index, count)
+
+    def __len__(self):
+        return len(self.names)
+
+    def close(self):
+        self.index.close()
+        self.file.close()
+
+    def _get(self, i):
+        _, lat, lng = ENTRY.unpack_from(self.index, HEADER.size + i * ENTRY.size)
+        return {"lat": round(lat, 6), "lon": round(lng, 6)}
+
+    def exact(self, key):
+        """Location of the name ```key``` (normalised, bytes), or None"""
+        i = bisect.bisect_left(self.names, key)
+        if i < len(self.names) and self.names[i] == key:
+            return self._get(i)
+        return None
+
+    def prefix(self, key):
+        """Location of the first name starting with ```key```, or None"""
+        i = bisect.bisect_left(self.names, key)
+        if i < len(self.names) and self.names[i].startswith(key):
+            return self._get(i)
+        return None
+
+    def lookup(self, location):
+        """{"lat", "lon"} for a location string, or None"""
+        for match in POSTCODE_RE.finditer(location):
+            outcode, sector, unit = match.groups()
+            keys = [outcode]
+            if sector:
+                keys[:0] = ["%s %s%s" % (outcode, sector, unit), "%s %s" % (outcode, sector)]
+            for key in keys:
+                found = self.exact(key.lower().encode("utf-8"))
+                if found is not None:
+                    return found
+
+        for part in location.split(","):
+            words = normalise(part).split()
+            # "Camden Town Station" -> "camden town station", "camden town", "camden"
+            for end in range(len(words), 0, -1):
+                found = self.exact(" ".join(words[:end]).encode("utf-8")[:NAME_LENGTH])
+                if found is not None:
+                    return found
+            if words:
+                found = self.prefix(" ".join(words).encode("utf-8")[:NAME_LENGTH])
+                if found is not None:
+                    return found
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("csv", help="gazetteer with name/postcode, latitude and longitude columns")
+    parser.add_argument("index", help="index file to write")
+    args = parser.parse_args()
+
+    with open(args.csv, newline="", encoding="utf-8") as f:
+        count = build(read_csv(f), args.index)
+    print("%d names written to %s" % (count, args.index))
+
+
+if __name__ == "__main__":
+    main()
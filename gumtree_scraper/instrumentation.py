@@ -0,0 +1,134 @@
+"""Latency histograms and per-stage timing of the item pipelines."""
+
+import math
+from time import perf_counter
+
+from scrapy.pipelines import ItemPipelineManager
+from twisted.internet.defer import Deferred
+
+# Sent with stage=<name> and seconds=<duration> every time a timed stage
+# (spider parsing, an item pipeline, ...) finishes
+stage_timed = object()
+
+
+class Histogram(object):
+    """
+    Fixed-bucket, log-linear histogram of durations in seconds. Buckets are
+    16 per power of two between 1us and ~1h, so percentiles are within ~6%
+    and memory doesn't grow with the number of values recorded.
+    """
+
+    __slots__ = ("counts", "count", "total", "max")
+
+    min_value = 1e-6
+    sub_buckets = 16
+    # 2**32 us is a bit over an hour
+    magnitudes = 32
+
+    def __init__(self):
+        self.counts = [0] * (self.magnitudes * self.sub_buckets)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def _index(self, value):
+        if value <= self.min_value:
+            return 0
+        mantissa, exponent = math.frexp(value / self.min_value)
+        index = (exponent - 1) * self.sub_buckets + int((mantissa - 0.5) * 2 * self.sub_buckets)
+        return min(index, len(self.counts) - 1)
+
+    def _upper_bound(self, index):
+        exponent, sub_bucket = divmod(index, self.sub_buckets)
+        return math.ldexp(1.0 + float(sub_bucket + 1) / self.sub_buckets, exponent) * self.min_value
+
+    def record(self, value):
+        """Adds one duration"""
+        self.counts[self._index(value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        """Adds the durations recorded by ```other```, e.g. another process's"""
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def percentile(self, percent):
+        """Upper bound of the bucket holding the ```percent```th percentile"""
+        if not self.count:
+            return 0.0
+        rank = math.ceil(self.count * percent / 100.0)
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(self._upper_bound(index), self.max)
+        return self.max
+
+    def count_below(self, bound):
+        """
+        (edge, count): the upper edge of the last bucket that ends at or
+        below ```bound```, and the number of values recorded below it. The
+        count is exact for ```edge```, not for ```bound```.
+        """
+        last = self._index(bound) - 1
+        if last < 0:
+            return self.min_value, 0
+        return self._upper_bound(last), sum(self.counts[: last + 1])
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def summary(self):
+        """Dict of count, mean, max and p50/p95/p99"""
+        return {
+            "count": self.count,
+            "mean": self.mean(),
+            "max": self.max,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+        }
+
+
+class TimedItemPipelineManager(ItemPipelineManager):
+    """
+    ItemPipelineManager that times every pipeline's process_item and sends
+    the durations with the stage_timed signal, as "pipeline/<class name>".
+    Enable it with ITEM_PROCESSOR.
+    """
+
+    signals = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        manager = super().from_crawler(crawler)
+        manager.signals = crawler.signals
+        return manager
+
+    def _add_middleware(self, pipe):
+        super()._add_middleware(pipe)
+        if hasattr(pipe, "process_item"):
+            process_item = self.methods["process_item"].pop()
+            stage = "pipeline/%s" % pipe.__class__.__name__
+            self.methods["process_item"].append(self._timed(stage, process_item))
+
+    def _timed(self, stage, process_item):
+        def timed_process_item(item, spider):
+            started = perf_counter()
+            result = process_item(item, spider)
+            if isinstance(result, Deferred):
+                return result.addBoth(self._stage_done, stage, started)
+            self._stage_done(None, stage, started)
+            return result
+
+        return timed_process_item
+
+    def _stage_done(self, result, stage, started):
+        if self.signals is not None:
+            self.signals.send_catch_log(signal=stage_timed, stage=stage, seconds=perf_counter() - started)
+        return result
@@ -3,9 +3,83 @@
 # See documentation in:
 # https://docs.scrapy.org/en/latest/topics/items.html
 
+import hashlib
+import json
+
 from itemloaders.processors import TakeFirst
 from scrapy.item import Field, Item
 
+# The fields that say what an ad is, hashed by content_hash(). The others
+# change on every crawl or are worked out from these
+CONTENT_FIELDS = ("url", "title", "price", "location", "description", "seller", "posted", "image_urls", "attributes")
+
+
+def content_hash(item):
+    """md5 of the CONTENT_FIELDS of ```item```, to tell whether an ad changed"""
+    content = {field: item.get(field) for field in CONTENT_FIELDS}
+    if content["attributes"] is not None:
+        content["attributes"] = content["attributes"].as_dict()
+    encoded = json.dumps(content, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.md5(encoded.encode("utf-8")).hexdigest()
+
+
+class PropertyAttributes(object):
+    """
+    The <dl> attributes of an ad. Attributes Gumtree is known to use get a
+    slot of their own, anything else goes to a bounded ```extra``` dict
+    """
+
+    __slots__ = (
+        "seller_type",
+        "property_type",
+        "number_of_bedrooms",
+        "number_of_bathrooms",
+        "date_available",
+        "furnishing",
+        "extra",
+    )
+
+    known = __slots__[:-1]
+
+    # Unknown attributes kept per ad, the rest are dropped
+    max_extra = 16
+
+    def __init__(self, **attributes):
+        for key in self.known:
+            setattr(self, key, None)
+        self.extra = None
+        for key, value in attributes.items():
+            self.set(key, value)
+
+    def set(self, key, value):
+        """Stores ```value``` in its slot, or in extra if there's room"""
+        if key in self.known:
+            setattr(self, key, value)
+            return
+
+        if self.extra is None:
+            self.extra = {}
+        if key in self.extra or len(self.extra) < self.max_extra:
+            self.extra[key] = value
+
+    def get(self, key, default=None):
+        if key in self.known:
+            value = getattr(self, key)
+            return default if value is None else value
+        if self.extra:
+            return self.extra.get(key, default)
+        return default
+
+    def as_dict(self):
+        """Flat dict of the attributes that have a value"""
+        attributes = {key: getattr(self, key) for key in self.known if getattr(self, key) is not None}
+        if self.extra:
+            attributes.update(self.extra)
+        return attributes
+
+    def __repr__(self):
+        return "PropertyAttributes(%r)" % self.as_dict()
+
 
 class GumtreePropertiesItem(Item):
     # define the fields for your item here like:
@@ -19,11 +93,17 @@ class GumtreePropertiesItem(Item):
     image_urls = Field()
     images = Field()
 
-    # Dynamic fields
-    # property_type = Field(output_processor=TakeFirst())
-    # seller_type = Field(output_processor=TakeFirst())
-    # number_of_bedrooms = Field(output_processor=TakeFirst())
-    # date_available = Field(output_processor=TakeFirst())
+    # Calculated fields, {"lat", "lon"} of the location, see GeoPipeline
+    geo = Field()
+
+    # Normalised fields, see NormalisePipeline
+    monthly_price_pence = Field()
+    price_period = Field()
+    bedrooms = Field()
+    date_available = Field()
+
+    # Dynamic fields, the <dl> attributes of the ad (PropertyAttributes)
+    attributes = Field(serializer=PropertyAttributes.as_dict)
 
     # Housekeeping fields
     url = Field(output_processor=TakeFirst())
@@ -3,13 +3,24 @@
 # See documentation in:
 # https://docs.scrapy.org/en/latest/topics/spider-middleware.html
 
+import os
+import re
+import sqlite3
+from time import perf_counter, time
+
 import scrapy
 
 # useful for handling different item types with a single interface
 from itemadapter import ItemAdapter, is_item
 from scrapy import signals
-from scrapy.http.response.text import TextResponse
-from w3lib.html import remove_comments
+from scrapy.exceptions import IgnoreRequest, NotConfigured
+from scrapy.http.request import NO_CALLBACK
+from scrapy.http.response.html import HtmlResponse
+from scrapy.utils.project import data_path
+
+from gumtree_scraper.archive import ResponseArchiveWriter
+from gumtree_scraper.instrumentation import stage_timed
+from gumtree_scraper.items import content_hash
 
 # Modifying or dropping Requests/Responses—domain-
 # specific, may be reused across projects.
@@ -23,6 +34,10 @@ from w3lib.html import remove_comments
 
 # All other problems. Write an extension.
 
+# w3lib.html.remove_comments' expression, on bytes so that bodies don't have
+# to be decoded and encoded again
+_COMMENTS_RE = re.compile(rb"<!--.*?(?:-->|$)", re.DOTALL)
+
 
 class GumtreeScraperSpiderMiddleware:
     # Not all methods need to be defined. If a method is not defined,
@@ -71,6 +86,66 @@ class GumtreeScraperSpiderMiddleware:
         spider.logger.info("Spider opened: %s" % spider.name)
 
 
+class ParseTimingMiddleware:
+    """
+    Times spider callbacks and sends the duration with the stage_timed
+    signal. Only time spent running the callback is counted, not the time
+    its output waits while Scrapy processes what it already yielded.
+    """
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler.signals)
+
+    def __init__(self, signals):
+        self.signals = signals
+
+    def process_spider_input(self, response, spider):
+        response.meta["parse_start"] = perf_counter()
+        return None
+
+    def process_spider_output(self, response, result, spider):
+        # Callbacks that return instead of yielding have already run
+        return self._timed(response, result, self._elapsed(response))
+
+    async def process_spider_output_async(self, response, result, spider):
+        elapsed = self._elapsed(response)
+        result = result.__aiter__()
+        while True:
+            started = perf_counter()
+            try:
+                i = await result.__anext__()
+            except StopAsyncIteration:
+                break
+            finally:
+                if elapsed is not None:
+                    elapsed += perf_counter() - started
+            yield i
+        self._parse_done(elapsed)
+
+    def _elapsed(self, response):
+        started = response.meta.get("parse_start")
+        return perf_counter() - started if started is not None else None
+
+    def _timed(self, response, result, elapsed):
+        result = iter(result)
+        while True:
+            started = perf_counter()
+            try:
+                i = next(result)
+            except StopIteration:
+                break
+            finally:
+                if elapsed is not None:
+                    elapsed += perf_counter() - started
+            yield i
+        self._parse_done(elapsed)
+
+    def _parse_done(self, elapsed):
+        if elapsed is not None:
+            self.signals.send_catch_log(signal=stage_timed, stage="parse", seconds=elapsed)
+
+
 class GumtreeScraperDownloaderMiddleware:
     # Not all methods need to be defined. If a method is not defined,
     # scrapy acts as if the downloader middleware does not modify the
@@ -79,10 +154,13 @@ class GumtreeScraperDownloaderMiddleware:
     @classmethod
     def from_crawler(cls, crawler):
         # This method is used by Scrapy to create your spiders.
-        s = cls()
+        s = cls(crawler.stats)
         crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
         return s
 
+    def __init__(self, stats=None):
+        self.stats = stats
+
     def process_request(self, request, spider):
         # Called for each request that goes through the downloader
         # middleware.
@@ -97,9 +175,10 @@ class GumtreeScraperDownloaderMiddleware:
 
     def process_response(self, request, response, spider):
         # Called with the response returned from the downloader.
-        if isinstance(response, TextResponse):
-            if response.body:
-                response = response.replace(body=remove_comments(response.body))
+        # Only HTML going to a spider callback is stripped; media and
+        # robots.txt requests are made with NO_CALLBACK
+        if isinstance(response, HtmlResponse) and request.callback is not NO_CALLBACK:
+            response = self.strip_comments(response)
 
         # Must either;
         # - return a Response object
@@ -107,6 +186,24 @@ class GumtreeScraperDownloaderMiddleware:
         # - or raise IgnoreRequest
         return response
 
+    def strip_comments(self, response):
+        """Removes HTML comments in one pass over the raw body"""
+        started = perf_counter()
+
+        body = response.body
+        # Most bodies are returned as they are, without a copy
+        if b"<!--" in body:
+            stripped = _COMMENTS_RE.sub(b"", body)
+            response = response.replace(body=stripped)
+            if self.stats is not None:
+                self.stats.inc_value("comment_stripping/bytes_saved", len(body) - len(stripped))
+
+        if self.stats is not None:
+            self.stats.inc_value("comment_stripping/responses")
+            self.stats.inc_value("comment_stripping/time", perf_counter() - started)
+
+        return response
+
     def process_exception(self, request, exception, spider):
         # Called when a download handler or a process_request()
         # (from other downloader middleware) raises an exception.
@@ -116,7 +213,135 @@ class GumtreeScraperDownloaderMiddleware:
         # - return a Response object: stops process_exception() chain
         # - return a Request object: stops process_exception() chain
         # pass
-        return scrapy.http.Response(request.url)
+        if isinstance(exception, IgnoreRequest):
+            # Dropped on purpose, e.g. by IncrementalRecrawlMiddleware
+            return None
+        # Flagged so that it isn't taken for a page the site sent
+        return scrapy.http.Response(request.url, flags=["download-failed"])
 
     def spider_opened(self, spider):
         spider.logger.info("Spider opened: %s" % spider.name)
+
+
+class IncrementalRecrawlMiddleware:
+    """
+    Skips ad pages that were downloaded recently. Keeps a persistent SQLite
+    index of ad url -> last seen timestamp and content hash, and records
+    whether each scraped ad changed since the previous crawl.
+
+    The hash is the items.content_hash() of the item the spider scraped
+    from the page, the one PostgresWriter stores, not of the page around
+    it, which carries tokens, adverts and timestamps that change on every
+    fetch. The index is committed after every write; in WAL mode without a
+    sync that's cheap and a crash loses nothing.
+    """
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool("RECRAWL_ENABLED"):
+            raise NotConfigured
+
+        # The index lives in its own folder under .scrapy, like HTTPCACHE_DIR
+        path = os.path.join(data_path(settings.get("RECRAWL_DIR", "recrawl"), createdir=True), "index.sqlite")
+        max_age = settings.getfloat("RECRAWL_MAX_AGE", 24 * 3600)
+        url_pattern = settings.get("RECRAWL_URL_PATTERN", r"gumtree\.com/p/")
+
+        s = cls(path, max_age, url_pattern, crawler.stats)
+        crawler.signals.connect(s.item_scraped, signal=signals.item_scraped)
+        crawler.signals.connect(s.spider_closed, signal=signals.spider_closed)
+        return s
+
+    def __init__(self, path, max_age, url_pattern, stats):
+        self.max_age = max_age
+        self.url_pattern = re.compile(url_pattern)
+        self.stats = stats
+
+        # Workers share the index: they read while another writes, and wait
+        # their turn to write
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("PRAGMA busy_timeout=30000")
+        self.db.execute(
+            """CREATE TABLE IF NOT EXISTS pages (
+            url TEXT PRIMARY KEY,
+            last_seen REAL NOT NULL,
+            content_hash TEXT NOT NULL,
+            changed INTEGER NOT NULL
+            ) WITHOUT ROWID"""
+        )
+        self.db.commit()
+
+    def process_request(self, request, spider):
+        # Only ad detail pages are tracked
+        if not self.url_pattern.search(request.url):
+            return None
+
+        row = self.db.execute("SELECT last_seen FROM pages WHERE url = ?", (request.url,)).fetchone()
+        if row is not None and time() - row[0] < self.max_age:
+            self.stats.inc_value("recrawl/hit")
+            raise IgnoreRequest("Ad seen recently: %s" % request.url)
+
+        self.stats.inc_value("recrawl/miss")
+        return None
+
+    def item_scraped(self, item, response, spider):
+        """Records the ad, once the spider has parsed it"""
+        if response is None or not self.url_pattern.search(response.url):
+            return
+
+        item_hash = content_hash(item)
+        row = self.db.execute("SELECT content_hash FROM pages WHERE url = ?", (response.url,)).fetchone()
+        if row is None:
+            changed = True
+            self.stats.inc_value("recrawl/new")
+        else:
+            changed = row[0] != item_hash
+            self.stats.inc_value("recrawl/changed" if changed else "recrawl/unchanged")
+
+        self.db.execute(
+            "INSERT OR REPLACE INTO pages (url, last_seen, content_hash, changed) VALUES (?, ?, ?, ?)",
+            (response.url, time(), item_hash, int(changed)),
+        )
+        self.db.commit()
+
+    def spider_closed(self, spider):
+        self.db.commit()
+        self.db.close()
+
+
+class ResponseRecorderMiddleware:
+    """
+    Appends every downloaded response, as it comes off the network, to the
+    RECORD_ARCHIVE archive so that the crawl can be replayed with
+    gumtree_scraper.archive.ReplayDownloadHandler. Downloads that failed
+    aren't recorded, so they are tried again when replayed.
+    """
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        path = crawler.settings.get("RECORD_ARCHIVE")
+        if not path:
+            raise NotConfigured
+
+        s = cls(ResponseArchiveWriter(path), crawler.request_fingerprinter, crawler.stats)
+        crawler.signals.connect(s.spider_closed, signal=signals.spider_closed)
+        return s
+
+    def __init__(self, writer, fingerprinter, stats):
+        self.writer = writer
+        self.fingerprinter = fingerprinter
+        self.stats = stats
+
+    def process_response(self, request, response, spider):
+        # Made up by GumtreeScraperDownloaderMiddleware for a failed download
+        if "download-failed" in response.flags:
+            self.stats.inc_value("record/skipped")
+            return response
+        self.writer.append(self.fingerprinter.fingerprint(request), response)
+        self.stats.inc_value("record/responses")
+        return response
+
+    def spider_closed(self, spider):
+        self.writer.close()
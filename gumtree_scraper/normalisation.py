@@ -0,0 +1,126 @@
+"""
+Normalisation of the free text prices and attributes of ads into values
+PostgreSQL can index and compare: rents in pence per month, bedroom counts
+and ISO dates.
+"""
+
+import re
+from datetime import date
+
+# Rent periods, and how many of each there are in a month
+PERIOD_DAY = "pd"
+PERIOD_WEEK = "pw"
+PERIOD_MONTH = "pcm"
+PERIOD_YEAR = "pa"
+PERIODS_PER_MONTH = {
+    PERIOD_DAY: 365 / 12.0,
+    PERIOD_WEEK: 52 / 12.0,
+    PERIOD_MONTH: 1.0,
+    PERIOD_YEAR: 1 / 12.0,
+}
+
+# The ways ads spell each period, lower case without spaces, dots or slashes
+PERIOD_NAMES = {
+    PERIOD_DAY: ("pd", "pn", "perday", "pernight", "aday", "anight", "day", "night", "daily", "nightly"),
+    PERIOD_WEEK: ("pw", "pwk", "perweek", "perwk", "aweek", "awk", "weekly", "pppw", "week", "wk"),
+    PERIOD_MONTH: ("pcm", "pm", "permonth", "percalendarmonth", "amonth", "acalendarmonth", "monthly", "month", "mo"),
+    PERIOD_YEAR: ("pa", "perannum", "peryear", "ayear", "annum", "annually", "yearly", "year"),
+}
+PERIOD_SPELLINGS = {name: period for period, names in PERIOD_NAMES.items() for name in names}
+NOT_PERIOD_RE = re.compile(r"[\s/.]+")
+
+PRICE_RE = re.compile(
+    r"£\s*(?P<amount>\d[\d,]*(?:\.\d{1,2})?)\s*(?P<thousands>k\b)?\s*"
+    # "per week", "a week", "/week", "pcm", "p.c.m.", "p/w", "weekly"...
+    r"(?P<period>(?:per|an?|/)\s*(?:calendar\s+)?[a-z]+\b|p(?:\s*[./]?\s*[a-z]){1,3}\b\.?|[a-z]+ly\b|week\b|month\b|year\b|mo\b|wk\b)?",
+    re.IGNORECASE,
+)
+
+BEDROOMS_RE = re.compile(r"(\d+)|(studio)", re.IGNORECASE)
+
+MONTHS = {name: number for number, name in enumerate(("jan", "feb", "mar", "apr", "may", "jun", "jul", "aug", "sep", "oct", "nov", "dec"), 1)}
+DAY_MONTH_YEAR_RE = re.compile(r"(\d{1,2})(?:st|nd|rd|th)?\s+([a-z]{3})[a-z]*\.?,?\s+(\d{4})", re.IGNORECASE)
+NUMERIC_DATE_RE = re.compile(r"(\d{4})-(\d{1,2})-(\d{1,2})|(\d{1,2})/(\d{1,2})/(\d{4})")
+NOW_RE = re.compile(r"\b(?:now|immediate|asap|today)", re.IGNORECASE)
+
+
+def normalise_price(text):
+    """
+    (pence per month, period) of a price like "£1,950pw" or "£8,000 pcm",
+    (None, None) when there's no price or it doesn't say per what.
+    """
+    if not text:
+        return None, None
+    match = PRICE_RE.search(text)
+    if match is None:
+        return None, None
+
+    amount, thousands, period = match.groups()
+    pence = float(amount.replace(",", "")) * 100
+    if thousands:
+        pence *= 1000
+
+    if period is not None:
+        period = PERIOD_SPELLINGS.get(NOT_PERIOD_RE.sub("", period.lower()))
+    if period is None:
+        return None, None
+    return int(round(pence * PERIODS_PER_MONTH[period])), period
+
+
+def normalise_prices(texts, known=None):
+    """
+    normalise_price() of many prices at once. Ads repeat a handful of
+    prices, so each distinct one is worked out only once, or never again
+    when it's in the ```known``` results of earlier calls, which it adds to.
+    """
+    if known is None:
+        known = {}
+    results = []
+    append = results.append
+    for text in texts:
+        result = known.get(text)
+        if result is None:
+            result = known[text] = normalise_price(text)
+        append(result)
+    return results
+
+
+def normalise_bedrooms(text):
+    """Number of bedrooms in "2", "5+" or "2 bedrooms", 0 for studios"""
+    if not text:
+        return None
+    match = BEDROOMS_RE.search(text)
+    if match is None:
+        return None
+    number, studio = match.groups()
+    return 0 if studio else int(number)
+
+
+def normalise_date(text, today=None):
+    """
+    ISO date of "14 Jun 2024", "1st July 2024", "14/06/2024" or
+    "2024-06-14". "Now" and the like are ```today```.
+    """
+    if not text:
+        return None
+    try:
+        match = DAY_MONTH_YEAR_RE.search(text)
+        if match is not None:
+            month = MONTHS.get(match.group(2).lower())
+            if month is not None:
+                return date(int(match.group(3)), month, int(match.group(1))).isoformat()
+
+        match = NUMERIC_DATE_RE.search(text)
+        if match is not None:
+            if match.group(1):
+                year, month, day = match.group(1, 2, 3)
+            else:
+                day, month, year = match.group(4, 5, 6)
+            return date(int(year), int(month), int(day)).isoformat()
+    except ValueError:
+        # 31 Feb and the like
+        return None
+
+    if today is not None and NOW_RE.search(text):
+        return today.isoformat()
+    return None
@@ -0,0 +1,93 @@
+"""Extraction of ad pages in a pool of worker processes."""
+
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from lxml import etree
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from twisted.internet import defer
+from twisted.python.failure import Failure
+
+from gumtree_scraper.extractors import AdExtractor
+
+# Built once per worker process, on its first job
+_extractor = None
+
+
+def extract_ad(body, encoding, url):
+    """
+    Runs in a worker process. Parses an ad page the way Scrapy's selectors
+    do and returns its fields and attributes as plain dicts.
+    """
+    global _extractor
+    if _extractor is None:
+        _extractor = AdExtractor()
+
+    parser = etree.HTMLParser(recover=True, encoding=encoding)
+    root = etree.fromstring(body.strip() or b"<html/>", parser=parser, base_url=url)
+    fields, attributes = _extractor.extract(root)
+    return fields, attributes.as_dict()
+
+
+class ParsePool(object):
+    """
+    Sends ad pages to PARSE_WORKERS worker processes so lxml parsing and
+    extraction use every core instead of the reactor thread. At most
+    PARSE_MAX_IN_FLIGHT pages are handed to the workers at a time, the
+    others wait here, so the pickled bodies queued for the workers stay
+    bounded.
+    """
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        workers = crawler.settings.getint("PARSE_WORKERS", 0)
+        if workers <= 0:
+            raise NotConfigured("ParsePool needs PARSE_WORKERS")
+
+        # Spiders build the pool before the crawler has its stats
+        pool = cls(workers, crawler.settings.getint("PARSE_MAX_IN_FLIGHT", 0) or 2 * workers)
+        pool.crawler = crawler
+        crawler.signals.connect(pool.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(pool.close, signal=signals.spider_closed)
+        return pool
+
+    def __init__(self, workers, max_in_flight, stats=None):
+        # Forking a process that runs the reactor and its thread pool isn't
+        # safe, workers start from a fresh interpreter instead
+        self.executor = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"))
+        self.semaphore = defer.DeferredSemaphore(max_in_flight)
+        self.stats = stats
+
+    def spider_opened(self, spider):
+        self.stats = self.crawler.stats
+
+    def extract(self, response):
+        """Deferred (fields, attributes dict) of the ad page in ```response```"""
+        return self.semaphore.run(self._submit, response.body, response.encoding, response.url)
+
+    def _submit(self, body, encoding, url):
+        # The spiders import this module before Scrapy installs its reactor
+        from twisted.internet import reactor
+
+        if self.stats is not None:
+            self.stats.inc_value("parse_pool/jobs")
+            self.stats.max_value("parse_pool/max_waiting", len(self.semaphore.waiting))
+
+        d = defer.Deferred()
+        future = self.executor.submit(extract_ad, body, encoding, url)
+        # Done callbacks run in the executor's thread
+        future.add_done_callback(lambda future: reactor.callFromThread(self._done, d, future))
+        return d
+
+    def _done(self, d, future):
+        error = future.exception()
+        if error is not None:
+            if self.stats is not None:
+                self.stats.inc_value("parse_pool/errors")
+            d.errback(Failure(error))
+        else:
+            d.callback(future.result())
+
+    def close(self, spider=None):
+        self.executor.shutdown(wait=False, cancel_futures=True)
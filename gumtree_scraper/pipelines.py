@@ -6,9 +6,16 @@
 # Modifying or storing Items—domain-specific, may be
 # reused across projects.
 # Write an Item Pipeline.
+import csv
+import hashlib
+import io
 import json
+import os
+import sqlite3
 import traceback
-from datetime import datetime
+from collections import OrderedDict, deque
+from datetime import date, datetime
+from time import perf_counter, time
 
 import dj_database_url
 import dj_redis_url
@@ -20,10 +27,25 @@ import txredisapi
 # useful for handling different item types with a single interface
 from itemadapter import ItemAdapter
 from scrapy import signals
-from scrapy.exceptions import NotConfigured
+from scrapy.exceptions import DontCloseSpider, NotConfigured
+from scrapy.pipelines.files import FileException
 from scrapy.pipelines.images import ImagesPipeline
+from scrapy.settings import Settings
+from scrapy.utils.misc import md5sum
+from scrapy.utils.project import data_path
 from twisted.enterprise import adbapi
-from twisted.internet import defer, reactor, task
+from twisted.internet import defer, reactor, task, threads
+from twisted.python.failure import Failure
+from twisted.python.threadpool import ThreadPool
+
+from gumtree_scraper.gazetteer import Gazetteer
+from gumtree_scraper.instrumentation import stage_timed
+from gumtree_scraper.items import content_hash
+from gumtree_scraper.normalisation import normalise_bedrooms, normalise_date, normalise_prices
+
+# Sent with item=<item> when the images of an item that already went
+# through the pipelines have been downloaded, see IMAGES_DEFERRED
+images_completed = object()
 
 
 class PostProcessItems(object):
@@ -37,11 +59,175 @@ class GumtreeScraperPipeline:
         return item
 
 
+class NormalisePipeline(object):
+    """
+    Fills the typed fields of an item from its free text, see
+    gumtree_scraper.normalisation: monthly_price_pence and price_period
+    from the price, bedrooms and date_available from the attributes.
+
+    With NORMALISE_BATCH_SIZE, items wait up to NORMALISE_BATCH_WINDOW
+    seconds to be normalised together, that many at a time.
+    """
+
+    # Distinct prices remembered, see normalise_prices()
+    max_known_prices = 10000
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        return cls(
+            crawler.stats,
+            batch_size=settings.getint("NORMALISE_BATCH_SIZE", 0),
+            batch_window=settings.getfloat("NORMALISE_BATCH_WINDOW", 0.05),
+        )
+
+    def __init__(self, stats, batch_size=0, batch_window=0.05, clock=None):
+        self.stats = stats
+        self.batch_size = batch_size
+        self.batch_window = batch_window
+        self.clock = clock if clock is not None else reactor
+
+        # (item, deferred) waiting for the next batch
+        self.pending = []
+        self.call = None
+        self.known_prices = {}
+
+    def close_spider(self, spider):
+        self.flush()
+
+    def process_item(self, item, spider):
+        if self.batch_size <= 0:
+            self.normalise([item])
+            return item
+
+        d = defer.Deferred()
+        self.pending.append((item, d))
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+        elif self.call is None:
+            self.call = self.clock.callLater(self.batch_window, self.flush)
+        return d
+
+    def flush(self):
+        """Normalises the items waiting and lets them go on"""
+        if self.call is not None and self.call.active():
+            self.call.cancel()
+        self.call = None
+
+        pending, self.pending = self.pending, []
+        if not pending:
+            return
+        try:
+            self.normalise([item for item, _ in pending])
+        except Exception:
+            # Find the items at fault, the others go on
+            for item, d in pending:
+                defer.maybeDeferred(self.normalise, [item]).addCallback(lambda _, item=item: item).chainDeferred(d)
+            return
+        for item, d in pending:
+            d.callback(item)
+
+    def normalise(self, items):
+        if len(self.known_prices) > self.max_known_prices:
+            self.known_prices = {}
+        prices = normalise_prices([item.get("price") for item in items], self.known_prices)
+        unpriced = 0
+        for item, (pence, period) in zip(items, prices):
+            item["monthly_price_pence"] = pence
+            item["price_period"] = period
+            if pence is None:
+                unpriced += 1
+
+            attributes = item.get("attributes")
+            if attributes is not None:
+                # "Now" is the day the ad was scraped
+                try:
+                    today = date.fromisoformat(item.get("date", "")[:10])
+                except (TypeError, ValueError):
+                    today = date.today()
+                item["bedrooms"] = normalise_bedrooms(attributes.get("number_of_bedrooms"))
+                item["date_available"] = normalise_date(attributes.get("date_available"), today)
+
+        self.stats.inc_value("normalise/items", len(items))
+        if unpriced:
+            self.stats.inc_value("normalise/unpriced", unpriced)
+
+
 class PostgresWriter(object):
     """
     A spider that writes to PostgreSQL databases
     """
 
+    # Item fields stored in columns of their own. The dynamic <dl> attributes
+    # go into the attributes column
+    item_columns = (
+        "url",
+        "title",
+        "price",
+        "monthly_price_pence",
+        "price_period",
+        "bedrooms",
+        "date_available",
+        "location",
+        "description",
+        "seller",
+        "posted",
+        "image_urls",
+        "images",
+        "geo",
+        "project",
+        "spider",
+        "server",
+        "date",
+    )
+
+    # Columns written for every item, in COPY/INSERT order
+    columns = item_columns + ("attributes", "content_hash")
+
+    # Columns that take a JSON document
+    json_columns = ("image_urls", "images", "geo", "attributes")
+
+    # Columns worked out from the rest of the row, which content_hash()
+    # leaves out. Rows are still updated when they change, e.g. when the
+    # normaliser learns to read more prices or an ad is first geocoded
+    derived_columns = ("monthly_price_pence", "price_period", "bedrooms", "date_available", "geo")
+
+    # Columns that may be written after the rest of the row, see
+    # images_completed. A NULL doesn't overwrite what they hold
+    deferred_columns = ("images",)
+
+    schema = """CREATE TABLE IF NOT EXISTS gumtree_properties (
+        url text PRIMARY KEY,
+        title text,
+        price text,
+        location text
+    )"""
+
+    column_types = {
+        "monthly_price_pence": "integer",
+        "price_period": "text",
+        "bedrooms": "smallint",
+        "date_available": "date",
+        "description": "text",
+        "seller": "text",
+        "posted": "text",
+        "image_urls": "jsonb",
+        "images": "jsonb",
+        "geo": "jsonb",
+        "project": "text",
+        "spider": "text",
+        "server": "text",
+        "date": "timestamp",
+        "attributes": "jsonb",
+        "content_hash": "text",
+    }
+
+    # Columns with an index, for range queries
+    indexed_columns = ("monthly_price_pence", "bedrooms", "date_available")
+
+    # Advisory lock key held while the schema is created or updated
+    schema_lock = 0x67756D74
+
     @classmethod
     def from_crawler(cls, crawler):
         """Retrieves scrapy crawler and accesses pipeline's settings"""
@@ -53,10 +239,16 @@ class PostgresWriter(object):
         if not postgres_url:
             raise NotConfigured
 
+        # Batch size of 0 keeps the one-transaction-per-item behaviour
+        batch_size = crawler.settings.getint("POSTGRES_PIPELINE_BATCH_SIZE", 0)
+        flush_interval = crawler.settings.getfloat("POSTGRES_PIPELINE_FLUSH_INTERVAL", 5.0)
+
         # Create the class
-        return cls(postgres_url)
+        pipe = cls(postgres_url, crawler.stats, batch_size, flush_interval)
+        crawler.signals.connect(pipe.images_completed, signal=images_completed)
+        return pipe
 
-    def __init__(self, postgres_url):
+    def __init__(self, postgres_url, stats=None, batch_size=0, flush_interval=5.0):
         """Opens a PostgreSQL connection pool"""
 
         # Store the url for future reference
@@ -64,47 +256,285 @@ class PostgresWriter(object):
         # Report connection error only once
         self.report_connection_error = True
 
+        self.stats = stats
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        # Rows waiting for the next COPY, keyed by url so that the same ad
+        # seen twice in one batch doesn't break ON CONFLICT
+        self.batch = {}
+        self.flush_task = None
+
         # Parse PostgreSQL URL and try to initialize a connection
         conn_kwargs = PostgresWriter.parse_postgres_url(postgres_url)
         self.dbpool = adbapi.ConnectionPool("psycopg2", connect_timeout=5, **conn_kwargs)
 
+    @defer.inlineCallbacks
+    def open_spider(self, spider):
+        """Make sure the table has every column and start the periodic flush"""
+        try:
+            yield self.dbpool.runInteraction(self.do_create_schema)
+        except psycopg2.OperationalError:
+            self.report_error(spider)
+        except:
+            spider.logger.exception("Database Error: ")
+
+        if self.batch_size > 0 and self.flush_interval > 0:
+            self.flush_task = task.LoopingCall(self.flush, spider)
+            self.flush_task.start(self.flush_interval, now=False)
+
+    @defer.inlineCallbacks
     def close_spider(self, spider):
-        """Discard the database pool on spider close"""
+        """Flush what is left and discard the database pool on spider close"""
+        if self.flush_task is not None and self.flush_task.running:
+            self.flush_task.stop()
+
+        yield self.flush(spider)
         self.dbpool.close()
 
     @defer.inlineCallbacks
     def process_item(self, item, spider):
         """Processes the item. Does insert into PostgreSQL"""
 
-        logger = spider.logger
+        if self.batch_size > 0:
+            # Buffer the row; the item waits only for the flush it triggers
+            row = self.item_to_row(item)
+            self.batch[row[0]] = row
+            if len(self.batch) >= self.batch_size:
+                yield self.flush(spider)
+            defer.returnValue(item)
+            return
 
+        self.track_pending(1)
         try:
-            yield self.dbpool.runInteraction(self.do_replace, item)
+            written = yield self.dbpool.runInteraction(self.do_replace, item)
+            if self.stats is not None and not written:
+                self.stats.inc_value("postgres_writer/unchanged")
         except psycopg2.OperationalError:
-            if self.report_connection_error:
-                logger.error("Can't connect to PostgreSQL: %s" % self.postgres_url)
-                self.report_connection_error = False
+            self.report_error(spider)
+            self.rows_dropped(1)
         except:
-            logger.exception("Database Error: ")
+            spider.logger.exception("Database Error: ")
+            self.rows_dropped(1)
             # print(traceback.format_exc())
+        finally:
+            self.track_pending(-1)
 
         # Return the item for the next stage
         defer.returnValue(item)
 
-    @staticmethod
-    def do_replace(tx, item):
-        """Does the actual INSERT INTO"""
+    @defer.inlineCallbacks
+    def flush(self, spider):
+        """Writes the buffered rows with a single COPY and upsert"""
+
+        if not self.batch:
+            return
+
+        rows = list(self.batch.values())
+        self.batch = {}
+
+        started = time()
+        dropped = 0
+        self.track_pending(1)
+        try:
+            written = yield self.dbpool.runInteraction(self.do_copy, rows)
+        except psycopg2.OperationalError:
+            self.report_error(spider)
+            written, dropped = 0, len(rows)
+        except:
+            spider.logger.exception("Database Error: ")
+            # One bad row fails the whole batch, the others go on their own
+            written, dropped = yield self.write_rows(rows, spider)
+        finally:
+            self.track_pending(-1)
+
+        self.rows_dropped(dropped)
+        if dropped == len(rows):
+            return
+
+        elapsed = time() - started
+        if self.stats is not None:
+            self.stats.inc_value("postgres_writer/batches")
+            self.stats.inc_value("postgres_writer/rows", len(rows) - dropped)
+            self.stats.inc_value("postgres_writer/unchanged", len(rows) - dropped - max(written, 0))
+            self.stats.set_value("postgres_writer/batch_latency", elapsed)
+            self.stats.max_value("postgres_writer/max_batch_latency", elapsed)
+            if elapsed > 0:
+                self.stats.set_value("postgres_writer/rows_per_second", len(rows) / elapsed)
+
+    @defer.inlineCallbacks
+    def write_rows(self, rows, spider):
+        """
+        Upserts ```rows``` one transaction each, after their batch failed.
+        Returns the number of rows written and the number that failed
+        """
+        written, dropped = 0, 0
+        for row in rows:
+            try:
+                written += yield self.dbpool.runInteraction(self.do_upsert, row)
+            except psycopg2.OperationalError:
+                self.report_error(spider)
+                dropped += 1
+            except:
+                spider.logger.exception("Database Error: %s" % row[0])
+                dropped += 1
+        defer.returnValue((written, dropped))
+
+    def rows_dropped(self, count):
+        """Counts rows that couldn't be written"""
+        if self.stats is not None and count:
+            self.stats.inc_value("postgres_writer/rows_dropped", count)
+
+    def images_completed(self, item, spider):
+        """Signal handler, see CustomImagePipeline"""
+        return self.write_images(item, spider)
+
+    @defer.inlineCallbacks
+    def write_images(self, item, spider):
+        """Writes the images of an item that was written before they were downloaded"""
+        images = json.dumps(item.get("images"), ensure_ascii=False, default=str)
+
+        # Still waiting for its COPY, write them with the rest of the row
+        row = self.batch.get(item["url"])
+        if row is not None:
+            index = self.columns.index("images")
+            self.batch[item["url"]] = row[:index] + (images,) + row[index + 1 :]
+            return
 
-        sql = """INSERT INTO gumtree_properties (url, title, price, location)
-        VALUES (%s,%s,%s,%s)
+        self.track_pending(1)
+        try:
+            yield self.dbpool.runInteraction(self.do_update_images, item["url"], images)
+            if self.stats is not None:
+                self.stats.inc_value("postgres_writer/images_updated")
+        except psycopg2.OperationalError:
+            self.report_error(spider)
+        except:
+            spider.logger.exception("Database Error: ")
+        finally:
+            self.track_pending(-1)
+
+    def track_pending(self, delta):
+        """Keeps count of the interactions queued or running in the pool"""
+        if self.stats is not None:
+            self.stats.inc_value("postgres_writer/pending", delta)
+
+    def report_error(self, spider):
+        """Logs connection errors, only the first time they happen"""
+        if self.report_connection_error:
+            spider.logger.error("Can't connect to PostgreSQL: %s" % self.postgres_url)
+            self.report_connection_error = False
+
+    @classmethod
+    def item_to_row(cls, item):
+        """Returns the tuple of values written for an item"""
+
+        values = {column: item.get(column) for column in cls.item_columns}
+        attributes = item.get("attributes")
+        values["attributes"] = attributes.as_dict() if attributes is not None else None
+        # Hash what the ad says, not when or where we scraped it
+        values["content_hash"] = content_hash(item)
+
+        for column in cls.json_columns:
+            if values[column] is not None:
+                values[column] = json.dumps(values[column], ensure_ascii=False, default=str)
+
+        return tuple(values[column] for column in cls.columns)
+
+    @classmethod
+    def upsert_sql(cls, source):
+        """
+        INSERT ... ON CONFLICT statement reading from ```source```. Rows whose
+        content hash and derived columns didn't change are left alone.
+        """
+        columns = ", ".join(cls.columns)
+        updates = ",\n        ".join(
+            "%s = COALESCE(EXCLUDED.%s, gumtree_properties.%s)" % (column, column, column)
+            if column in cls.deferred_columns
+            else "%s = EXCLUDED.%s" % (column, column)
+            for column in cls.columns
+            if column != "url"
+        )
+
+        derived = ", ".join("gumtree_properties.%s" % column for column in cls.derived_columns)
+        excluded = ", ".join("EXCLUDED.%s" % column for column in cls.derived_columns)
+
+        return """INSERT INTO gumtree_properties (%s)
+        %s
         ON CONFLICT (url) DO UPDATE SET
-        title = EXCLUDED.title,
-        price = EXCLUDED.price,
-        location = EXCLUDED.location"""
+        %s
+        WHERE gumtree_properties.content_hash IS DISTINCT FROM EXCLUDED.content_hash
+        OR (%s) IS DISTINCT FROM (%s)""" % (
+            columns,
+            source,
+            updates,
+            derived,
+            excluded,
+        )
+
+    @classmethod
+    def do_create_schema(cls, tx):
+        """Creates the table and adds the columns it doesn't have yet"""
 
-        args = (item["url"], item["title"], item["price"], item["location"])
+        # Crawl workers starting together would race on CREATE TABLE
+        tx.execute("SELECT pg_advisory_xact_lock(%s)", (cls.schema_lock,))
+        tx.execute(cls.schema)
+        for column, column_type in cls.column_types.items():
+            tx.execute("ALTER TABLE gumtree_properties ADD COLUMN IF NOT EXISTS %s %s" % (column, column_type))
+        for column in cls.indexed_columns:
+            tx.execute("CREATE INDEX IF NOT EXISTS gumtree_properties_%s_idx ON gumtree_properties (%s)" % (column, column))
+
+    @classmethod
+    def do_replace(cls, tx, item):
+        """Does the actual INSERT INTO. Returns the number of rows written"""
+        return cls.do_upsert(tx, cls.item_to_row(item))
+
+    @classmethod
+    def do_upsert(cls, tx, row):
+        """Upserts one row from item_to_row(). Returns the number of rows written"""
+
+        placeholders = ",".join(["%s"] * len(cls.columns))
+        sql = cls.upsert_sql("VALUES (%s)" % placeholders)
+
+        tx.execute(sql, row)
+        return tx.rowcount
+
+    @staticmethod
+    def do_update_images(tx, url, images):
+        """
+        Sets the images column of an ad. Creates the row if the ad hasn't
+        been written yet, the upsert of the ad fills in the rest
+        """
+
+        tx.execute(
+            """INSERT INTO gumtree_properties (url, images) VALUES (%s, %s)
+            ON CONFLICT (url) DO UPDATE SET images = EXCLUDED.images""",
+            (url, images),
+        )
+
+    @classmethod
+    def do_copy(cls, tx, rows):
+        """
+        COPYs rows into a staging table and upserts them in one statement.
+        Returns the number of rows written
+        """
 
-        tx.execute(sql, args)
+        # The temporary table lives as long as the pooled connection and is
+        # emptied at the end of every transaction
+        tx.execute(
+            """CREATE TEMP TABLE IF NOT EXISTS gumtree_properties_staging
+            (LIKE gumtree_properties INCLUDING DEFAULTS)
+            ON COMMIT DELETE ROWS"""
+        )
+
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        buffer.seek(0)
+        tx.copy_expert(
+            "COPY gumtree_properties_staging (%s) FROM STDIN WITH (FORMAT csv)" % ", ".join(cls.columns),
+            buffer,
+        )
+
+        tx.execute(cls.upsert_sql("SELECT %s FROM gumtree_properties_staging" % ", ".join(cls.columns)))
+        return tx.rowcount
 
     @staticmethod
     def parse_postgres_url(postgres_url):
@@ -128,67 +558,263 @@ class PostgresWriter(object):
         return conn_kwargs
 
 
+def geocoding_target(item):
+    """
+    (address, field) for the geocoding of ```item```: its address goes to
+    location or, for items without an address like Gumtree's, its location
+    string goes to geo. None when there's nothing to geocode.
+    """
+    if item.get("address"):
+        return item["address"][0], "location"
+    if item.get("location"):
+        return item["location"], "geo"
+    return None
+
+
+class RedisBatchClient(object):
+    """
+    Combines the GETs issued within ```window``` seconds of each other into
+    one MGET, and the SETs into one pipelined MSET, followed by an EXPIRE of
+    every key when ```ttl``` is set. Up to ```max_size``` keys go in each.
+    With no window, the commands issued in the same reactor iteration are
+    combined.
+    """
+
+    def __init__(self, connection, stats, window=0, max_size=100, ttl=0, clock=None):
+        self.connection = connection
+        self.stats = stats
+        self.window = window
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clock = clock if clock is not None else reactor
+
+        # key -> waiting deferreds, and key -> [value, waiting deferreds]
+        self.reads = OrderedDict()
+        self.writes = OrderedDict()
+        self.writing = set()
+        self.call = None
+
+    def stop(self):
+        if self.call is not None and self.call.active():
+            self.call.cancel()
+        self.call = None
+
+    def get(self, key):
+        """Deferred value of ```key```, None if Redis doesn't have it"""
+        d = defer.Deferred()
+        waiting = self.reads.get(key)
+        if waiting is not None:
+            waiting.append(d)
+        else:
+            self.reads[key] = [d]
+            self._schedule(len(self.reads))
+        return d
+
+    def set(self, key, value):
+        """Deferred that fires once ```value``` is stored, the last one of a batch wins"""
+        d = defer.Deferred()
+        entry = self.writes.get(key)
+        if entry is not None:
+            entry[0] = value
+            entry[1].append(d)
+        else:
+            self.writes[key] = [value, [d]]
+            self._schedule(len(self.writes))
+        return d
+
+    def _schedule(self, size):
+        if size >= self.max_size:
+            self.stop()
+            self.flush()
+        elif self.call is None:
+            self.call = self.clock.callLater(self.window, self.flush)
+
+    def flush(self):
+        """Sends a batch of each, and schedules the next if more are waiting"""
+        self.call = None
+        reads = self._take(self.reads)
+        writes = self._take(self.writes)
+        if reads:
+            self._mget(reads)
+        if writes:
+            d = self._mset(writes)
+            self.writing.add(d)
+            d.addBoth(self._written, d)
+        if (self.reads or self.writes) and self.call is None:
+            self.call = self.clock.callLater(0, self.flush)
+
+    def _written(self, result, d):
+        self.writing.discard(d)
+        return result
+
+    def close(self):
+        """Sends what's waiting, returns a deferred that fires once it's written"""
+        while self.reads or self.writes:
+            self.flush()
+            self.stop()
+        return defer.DeferredList(list(self.writing))
+
+    def _take(self, pending):
+        batch = OrderedDict()
+        while pending and len(batch) < self.max_size:
+            key, entry = pending.popitem(last=False)
+            batch[key] = entry
+        return batch
+
+    @defer.inlineCallbacks
+    def _mget(self, batch):
+        self.stats.inc_value("redis_cache/mgets")
+        self.stats.inc_value("redis_cache/mget_keys", len(batch))
+        try:
+            values = yield self.connection.mget(list(batch))
+        except Exception:
+            failure = Failure()
+            for waiters in batch.values():
+                for d in waiters:
+                    d.errback(failure)
+            return
+
+        for waiters, value in zip(batch.values(), values):
+            for d in waiters:
+                d.callback(value)
+
+    @defer.inlineCallbacks
+    def _mset(self, batch):
+        self.stats.inc_value("redis_cache/msets")
+        self.stats.inc_value("redis_cache/mset_keys", len(batch))
+        mapping = {key: value for key, (value, _) in batch.items()}
+        try:
+            if self.ttl > 0:
+                pipeline = yield self.connection.pipeline()
+                pipeline.mset(mapping)
+                for key in mapping:
+                    pipeline.expire(key, self.ttl)
+                yield pipeline.execute_pipeline()
+            else:
+                yield self.connection.mset(mapping)
+        except Exception:
+            failure = Failure()
+            for _, waiters in batch.values():
+                for d in waiters:
+                    d.errback(failure)
+            return
+
+        for _, waiters in batch.values():
+            for d in waiters:
+                d.callback(None)
+
+
+class NotCached(Exception):
+    """The key isn't in Redis"""
+
+
 class RedisCache(object):
-    """A pipeline that uses a Redis server to cache values"""
+    """
+    A pipeline that uses a Redis server to cache values, with the most
+    recently used ones kept in process too.
+
+    Lookups go to the in-process cache (L1) first, then to Redis (L2), the
+    ones made at the same time in one MGET. Values of items that went
+    through every pipeline stage are written back to both, in batches,
+    unless they came from there in the first place.
+
+    Pass any object with txredisapi's ```mget```, ```mset``` and
+    ```pipeline``` as ```connection``` to run it against something other
+    than Redis.
+    """
 
     @classmethod
     def from_crawler(cls, crawler):
         """Create a new instance and pass it Redis' url and namespace"""
+        settings = crawler.settings
 
         # Get redis URL
-        redis_url = crawler.settings.get("REDIS_PIPELINE_URL", None)
+        redis_url = settings.get("REDIS_PIPELINE_URL", None)
 
         # If doesn't exist, disable
         if not redis_url:
             raise NotConfigured
 
-        redis_nm = crawler.settings.get("REDIS_PIPELINE_NS", "ADDRESS_CACHE")
-
-        return cls(crawler, redis_url, redis_nm)
-
-    def __init__(self, crawler, redis_url, redis_nm):
-        """Store configuration, open connection and register callback"""
+        # Parse redis URL and try to initialize a connection
+        args = RedisCache.parse_redis_url(redis_url)
+        connection = txredisapi.lazyConnectionPool(connectTimeout=5, replyTimeout=5, **args)
+
+        return cls(
+            crawler,
+            connection,
+            redis_url=redis_url,
+            redis_nm=settings.get("REDIS_PIPELINE_NS", "ADDRESS_CACHE"),
+            max_entries=settings.getint("REDIS_PIPELINE_L1_ENTRIES", 10000),
+            ttl=settings.getint("REDIS_PIPELINE_TTL", 0),
+            batch_window=settings.getfloat("REDIS_PIPELINE_BATCH_WINDOW", 0),
+            batch_size=settings.getint("REDIS_PIPELINE_BATCH_SIZE", 100),
+        )
+
+    def __init__(self, crawler, connection, redis_url="", redis_nm="ADDRESS_CACHE", max_entries=10000, ttl=0, batch_window=0, batch_size=100):
+        """Store configuration, set the caches up and register callback"""
 
         # Store the url and the namespace for future reference
         self.redis_url = redis_url
         self.redis_nm = redis_nm
+        self.stats = crawler.stats
 
         # Report connection error only once
         self.report_connection_error = True
 
-        # Parse redis URL and try to initialize a connection
-        args = RedisCache.parse_redis_url(redis_url)
-        self.connection = txredisapi.lazyConnectionPool(connectTimeout=5, replyTimeout=5, **args)
+        self.connection = connection
+        self.client = RedisBatchClient(connection, self.stats, batch_window, batch_size, ttl)
+        # Errors and misses (NotCached) aren't kept, the next lookup tries
+        # Redis again
+        self.cache = DeferredCache(self.key_not_found_callback, max_entries=max_entries, negative_ttl=0, stats=self.stats, stats_prefix="redis_cache/l1")
 
         # Connect the item_scraped signal
         crawler.signals.connect(self.item_scraped, signal=signals.item_scraped)
 
+    def close_spider(self, spider):
+        """Waits for the values still being written"""
+        return self.client.close()
+
+    @defer.inlineCallbacks
+    def key_not_found_callback(self, key):
+        """Looks ```key``` up in Redis, raises NotCached if it isn't there"""
+        value = yield self.client.get(key)
+        self.stats.inc_value("redis_cache/l2/hits" if value else "redis_cache/l2/misses")
+        hits = self.stats.get_value("redis_cache/l2/hits", 0)
+        self.stats.set_value("redis_cache/l2_hit_rate", round(hits / (hits + self.stats.get_value("redis_cache/l2/misses", 0)), 4))
+        if not value:
+            raise NotCached(key)
+        defer.returnValue(json.loads(value))
+
     @defer.inlineCallbacks
     def process_item(self, item, spider):
-        """Looks up address in redis"""
+        """Looks address up in the caches"""
 
         logger = spider.logger
 
-        if "location" in item:
-            # Set by previous step (spider or pipeline). Don't do anything
+        target = geocoding_target(item)
+        if target is None or target[1] in item:
+            # Nothing to look up, or set by previous step (spider or
+            # pipeline). Don't do anything
             defer.returnValue(item)
             return
 
-        # The item has to have the address field set
-        assert ("address" in item) and (len(item["address"]) > 0)
+        address, field = target
+        key = self.redis_nm + ":" + address
 
-        # Extract the address from the item.
-        address = item["address"][0]
+        self.stats.inc_value("redis_cache/lookups")
+        d = self.cache.find(key)
+        hits = self.stats.get_value("redis_cache/l1/hits", 0)
+        self.stats.set_value("redis_cache/l1_hit_rate", round(hits / self.stats.get_value("redis_cache/lookups"), 4))
 
         try:
-            # Check Redis
-            key = self.redis_nm + ":" + address
-
-            value = yield self.connection.get(key)
+            value = yield d
 
             if value:
                 # Set the value for this item
-                item["location"] = json.loads(value)
+                item[field] = value
+
+        except NotCached:
+            pass
 
         except txredisapi.ConnectionError:
             if self.report_connection_error:
@@ -202,22 +828,35 @@ class RedisCache(object):
         This function inspects the item after it has gone through every
         pipeline stage and if there is some cache value to add it does so.
         """
-        # Capture and encode the location and the address
-        try:
-            location = item["location"]
-            value = json.dumps(location, ensure_ascii=False)
-        except KeyError:
+        target = geocoding_target(item)
+        if target is None or target[1] not in item:
             return
 
-        # Extract the address from the item.
-        address = item["address"][0]
-
+        # Capture and encode the location and the address
+        address, field = target
+        location = item[field]
         key = self.redis_nm + ":" + address
 
-        quiet = lambda failure: failure.trap(txredisapi.ConnectionError)
+        if self.cache.peek(key) == location:
+            # It came from the caches, or was stored already
+            self.stats.inc_value("redis_cache/writes_skipped")
+            return
+        self.cache.set(key, location)
+
+        value = json.dumps(location, ensure_ascii=False)
+
+        # Store it in Redis asynchronously, along with others. The item
+        # doesn't wait for it, close_spider() does
+        self.client.set(key, value).addErrback(self._write_failed, key, spider)
 
-        # Store it in Redis asynchronously
-        return self.connection.set(key, value).addErrback(quiet)
+    def _write_failed(self, failure, key, spider):
+        self.stats.inc_value("redis_cache/write_errors")
+        if failure.check(txredisapi.ConnectionError):
+            if self.report_connection_error:
+                spider.logger.error("Can't connect to Redis: %s" % self.redis_url)
+                self.report_connection_error = False
+        else:
+            spider.logger.error("Can't write %s to Redis: %s" % (key, failure.getErrorMessage()))
 
     @staticmethod
     def parse_redis_url(redis_url):
@@ -241,32 +880,398 @@ class RedisCache(object):
 
 
 class CustomImagePipeline(ImagesPipeline):
+    """
+    ImagesPipeline reading image_urls as a list or a comma separated string.
+
+    With IMAGES_DEFERRED the item goes on to the next pipelines right away
+    and its images are downloaded in the background, at most
+    IMAGES_DEFERRED_CONCURRENCY items at a time, so slow image hosts don't
+    hold up the text of the ads. images_completed is sent once an item's
+    images are stored, for PostgresWriter to fill in the images column.
+
+    With IMAGES_THREADS, images are converted and thumbnailed in a pool of
+    that many threads instead of the reactor thread; Pillow releases the
+    GIL while it decodes and resizes. At most IMAGES_THREADS_QUEUE images
+    are handed to the pool at a time. IMAGES_DRAFT decodes JPEGs straight
+    at the smallest scale that still covers each thumbnail.
+    """
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        pipe = super().from_crawler(crawler)
+        if pipe.deferred:
+            crawler.signals.connect(pipe.spider_idle, signal=signals.spider_idle)
+        return pipe
+
+    def __init__(self, store_uri, download_func=None, settings=None):
+        super().__init__(store_uri, download_func=download_func, settings=settings)
+        if isinstance(settings, dict) or settings is None:
+            settings = Settings(settings)
+
+        self.deferred = settings.getbool("IMAGES_DEFERRED", False)
+        self.deferred_semaphore = defer.DeferredSemaphore(settings.getint("IMAGES_DEFERRED_CONCURRENCY", 4))
+        # Items whose images are queued or downloading
+        self.deferred_pending = 0
+
+        self.threads = settings.getint("IMAGES_THREADS", 0)
+        self.threads_semaphore = defer.DeferredSemaphore(settings.getint("IMAGES_THREADS_QUEUE", 0) or 2 * max(self.threads, 1))
+        self.thread_pool = None
+        self.draft = settings.getbool("IMAGES_DRAFT", False)
+
+    def open_spider(self, spider):
+        super().open_spider(spider)
+        if self.threads > 0:
+            self.thread_pool = ThreadPool(self.threads, self.threads, name="images")
+            self.thread_pool.start()
+
+    def close_spider(self, spider):
+        if self.thread_pool is not None:
+            self.thread_pool.stop()
+
+    def process_item(self, item, spider):
+        if not self.deferred:
+            return super().process_item(item, spider)
+
+        if ItemAdapter(item).get(self.images_urls_field):
+            self.deferred_pending += 1
+            self.crawler.stats.inc_value("images_deferred/items")
+            self.crawler.stats.max_value("images_deferred/max_pending", self.deferred_pending)
+
+            # The background copy gets the images field, not the item moving on
+            d = self.deferred_semaphore.run(super().process_item, item.copy(), spider)
+            d.addCallback(self._images_done, spider)
+            d.addErrback(self._images_failed, spider)
+            d.addBoth(self._deferred_done)
+        return item
+
+    def _images_done(self, item, spider):
+        self.crawler.stats.inc_value("images_deferred/completed")
+        return self.crawler.signals.send_catch_log_deferred(signal=images_completed, item=item, spider=spider)
+
+    def _images_failed(self, failure, spider):
+        self.crawler.stats.inc_value("images_deferred/failed")
+        spider.logger.error("Deferred image download failed: %s", failure.getErrorMessage())
+
+    def _deferred_done(self, _):
+        self.deferred_pending -= 1
+
+    def spider_idle(self, spider):
+        """Keeps the spider open until the background downloads are done"""
+        if self.deferred_pending:
+            raise DontCloseSpider
+
+    def media_downloaded(self, response, request, info, *, item=None):
+        """Converts and thumbnails the image in the thread pool, if there's one"""
+        if self.thread_pool is None or response.status != 200 or not response.body:
+            return super().media_downloaded(response, request, info, item=item)
+
+        self.crawler.stats.max_value("images_threads/max_waiting", len(self.threads_semaphore.waiting))
+        d = self.threads_semaphore.run(
+            threads.deferToThreadPool, reactor, self.thread_pool, self.convert_images, response, request, info, item
+        )
+        d.addCallbacks(self._images_converted, self._images_not_converted, (response, request, info), errbackArgs=(request,))
+        return d
+
+    def convert_images(self, response, request, info, item):
+        """Runs in the thread pool: the (path, image, buffer) of the image and its thumbnails"""
+        started = perf_counter()
+        images = list(self.get_images(response, request, info, item=item))
+        return images, perf_counter() - started
+
+    def _images_converted(self, result, response, request, info):
+        images, seconds = result
+        self.crawler.stats.inc_value("images_threads/images")
+        self.crawler.signals.send_catch_log(signal=stage_timed, stage="images/convert", seconds=seconds)
+
+        status = "cached" if "cached" in response.flags else "downloaded"
+        self.inc_stats(info.spider, status)
+
+        # Stores may use the reactor, so images are persisted from here
+        checksum = None
+        for path, image, buf in images:
+            if checksum is None:
+                buf.seek(0)
+                checksum = md5sum(buf)
+            width, height = image.size
+            self.store.persist_file(path, buf, info, meta={"width": width, "height": height}, headers={"Content-Type": "image/jpeg"})
+
+        return {"url": request.url, "path": images[0][0], "checksum": checksum, "status": status}
+
+    def _images_not_converted(self, failure, request):
+        if failure.check(FileException):
+            return failure
+        raise FileException("Can't convert image %s: %s" % (request.url, failure.getErrorMessage()))
+
+    def convert_image(self, image, size=None, response_body=None):
+        if size and self.draft and image.format == "JPEG" and response_body is not None:
+            # A fresh copy of the JPEG, decoded at 1/2, 1/4 or 1/8 scale
+            image = self._Image.open(io.BytesIO(response_body.getvalue()))
+            image.draft("RGB", size)
+        return super().convert_image(image, size, response_body)
+
     def get_media_requests(self, item, info):
         image_urls_field = ItemAdapter(item).get("image_urls", None)
         if image_urls_field:
-            image_urls = str(image_urls_field).split(",")
+            # The spiders give a list, older items a comma separated string
+            if isinstance(image_urls_field, str):
+                image_urls = image_urls_field.split(",")
+            else:
+                image_urls = image_urls_field
             for url in image_urls:
                 yield scrapy.Request(url)
 
 
+class ImageDedupPipeline(CustomImagePipeline):
+    """
+    Images pipeline that only downloads and stores what it doesn't have yet.
+    A persistent SQLite index maps every image url to the stored image it
+    turned out to be, and keeps a perceptual hash (dHash) of every stored
+    image:
+
+    - urls in the index aren't downloaded again until IMAGES_EXPIRES
+    - downloaded images identical to, or at most IMAGE_DEDUP_MAX_DISTANCE
+      bits away from, a stored image point to that image instead of being
+      stored again
+
+    Near-duplicates are looked up by splitting the 64 bit hash in 4 bands of
+    16 bits, a stored image within 3 bits shares at least one band with it.
+
+    The index is queried, and images hashed, in a thread of its own so that
+    the reactor doesn't wait on SQLite.
+    """
+
+    # Commit the index every so many writes
+    commit_every = 100
+
+    # dHash compares the neighbouring pixels of a hash_size x hash_size
+    # grayscale thumbnail
+    hash_size = 8
+    bands = 4
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        max_distance = crawler.settings.getint("IMAGE_DEDUP_MAX_DISTANCE", cls.bands - 1)
+        if not 0 <= max_distance < cls.bands:
+            # Images further apart may not share a band, they wouldn't be found
+            raise NotConfigured("IMAGE_DEDUP_MAX_DISTANCE must be between 0 and %d" % (cls.bands - 1))
+        return super().from_crawler(crawler)
+
+    def __init__(self, store_uri, download_func=None, settings=None):
+        super().__init__(store_uri, download_func=download_func, settings=settings)
+        if isinstance(settings, dict) or settings is None:
+            settings = Settings(settings)
+
+        # The index lives in its own folder under .scrapy, like RECRAWL_DIR
+        self.index_path = os.path.join(data_path(settings.get("IMAGE_DEDUP_DIR", "image_dedup"), createdir=True), "index.sqlite")
+        self.max_distance = settings.getint("IMAGE_DEDUP_MAX_DISTANCE", self.bands - 1)
+        self.db = None
+        self.pending_writes = 0
+        # One thread, so the queries run in order on the one connection
+        self.db_pool = None
+
+    def open_spider(self, spider):
+        super().open_spider(spider)
+        self.stats = self.crawler.stats
+
+        self.db_pool = ThreadPool(1, 1, name="image-dedup")
+        self.db_pool.start()
+
+        band_columns = "".join(", band%d INTEGER" % band for band in range(self.bands))
+        # Shared by the workers of a crawl, like the recrawl index
+        self.db = sqlite3.connect(self.index_path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("PRAGMA busy_timeout=30000")
+        self.db.execute(
+            """CREATE TABLE IF NOT EXISTS images (
+            checksum TEXT PRIMARY KEY,
+            path TEXT NOT NULL,
+            body_md5 TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            dhash TEXT%s
+            )"""
+            % band_columns
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS images_body_md5 ON images (body_md5)")
+        for band in range(self.bands):
+            self.db.execute("CREATE INDEX IF NOT EXISTS images_band%d ON images (band%d)" % (band, band))
+        self.db.execute(
+            """CREATE TABLE IF NOT EXISTS urls (
+            url TEXT PRIMARY KEY,
+            checksum TEXT NOT NULL,
+            last_seen REAL NOT NULL
+            ) WITHOUT ROWID"""
+        )
+        self.db.commit()
+
+    def close_spider(self, spider):
+        super().close_spider(spider)
+        d = self._in_db_thread(self._close_db)
+        d.addBoth(self._db_closed)
+        return d
+
+    def _close_db(self):
+        self.db.commit()
+        self.db.close()
+
+    def _db_closed(self, result):
+        self.db_pool.stop()
+        return result
+
+    def _in_db_thread(self, f, *args):
+        return threads.deferToThreadPool(reactor, self.db_pool, f, *args)
+
+    def media_to_download(self, request, info, *, item=None):
+        """Answers from the index for urls downloaded before"""
+        d = self._in_db_thread(self._stored_image, request.url)
+        d.addCallback(self._uptodate, request, info, item)
+        return d
+
+    def _stored_image(self, url):
+        """Runs in the index thread: (checksum, path, size, last_seen) of url, or None"""
+        return self.db.execute(
+            "SELECT images.checksum, images.path, images.size, urls.last_seen FROM urls JOIN images USING (checksum) WHERE url = ?",
+            (url,),
+        ).fetchone()
+
+    def _uptodate(self, row, request, info, item):
+        if row is None or time() - row[3] > self.expires * 24 * 3600:
+            return super().media_to_download(request, info, item=item)
+
+        checksum, path, size, _ = row
+        self.stats.inc_value("image_dedup/downloads_saved")
+        self.stats.inc_value("image_dedup/download_bytes_saved", size)
+        self.inc_stats(info.spider, "uptodate")
+        return {"url": request.url, "path": path, "checksum": checksum, "status": "uptodate"}
+
+    def media_downloaded(self, response, request, info, *, item=None):
+        """Stores the image unless it's a duplicate of a stored one"""
+        if response.status != 200 or not response.body:
+            return super().media_downloaded(response, request, info, item=item)
+
+        d = self._in_db_thread(self._find_duplicate, response.body)
+        d.addCallback(self._deduplicated, response, request, info, item)
+        return d
+
+    def _find_duplicate(self, body):
+        """
+        Runs in the index thread: (duplicate, how, body md5, dHash), where
+        duplicate is the (checksum, path) of the stored image ```body```
+        is an "exact" or "near" duplicate of, or None
+        """
+        body_md5 = hashlib.md5(body).hexdigest()
+        duplicate = self.db.execute("SELECT checksum, path FROM images WHERE body_md5 = ?", (body_md5,)).fetchone()
+        if duplicate is not None:
+            return duplicate, "exact", body_md5, None
+
+        dhash = self.dhash(body)
+        if dhash is not None:
+            duplicate = self.find_similar(dhash)
+        return duplicate, "near", body_md5, dhash
+
+    def _deduplicated(self, result, response, request, info, item):
+        duplicate, how, body_md5, dhash = result
+        if duplicate is not None:
+            checksum, path = duplicate
+            self.stats.inc_value("image_dedup/%s_duplicates" % how)
+            self.stats.inc_value("image_dedup/stored_bytes_saved", len(response.body))
+            self.inc_stats(info.spider, "duplicate")
+            d = self._in_db_thread(self.remember_url, request.url, checksum)
+            d.addCallback(lambda _: {"url": request.url, "path": path, "checksum": checksum, "status": "duplicate"})
+            return d
+
+        # Stored from the thread pool with IMAGES_THREADS
+        d = defer.maybeDeferred(super().media_downloaded, response, request, info, item=item)
+        d.addCallback(self._stored, request.url, body_md5, len(response.body), dhash)
+        return d
+
+    def _stored(self, result, url, body_md5, size, dhash):
+        d = self._in_db_thread(self._index_image, result, url, body_md5, size, dhash)
+        d.addCallback(lambda _: result)
+        return d
+
+    def _index_image(self, result, url, body_md5, size, dhash):
+        """Runs in the index thread"""
+        bands = self.split_bands(dhash) if dhash is not None else [None] * self.bands
+        self.db.execute(
+            "INSERT OR IGNORE INTO images VALUES (?, ?, ?, ?, ?%s)" % (", ?" * self.bands),
+            [result["checksum"], result["path"], body_md5, size, None if dhash is None else "%016x" % dhash] + bands,
+        )
+        self.remember_url(url, result["checksum"])
+
+    def remember_url(self, url, checksum):
+        """Runs in the index thread"""
+        self.db.execute("INSERT OR REPLACE INTO urls (url, checksum, last_seen) VALUES (?, ?, ?)", (url, checksum, time()))
+        self.pending_writes += 1
+        if self.pending_writes >= self.commit_every:
+            self.db.commit()
+            self.pending_writes = 0
+
+    def dhash(self, body):
+        """64 bit difference hash of the image in ```body```, None if it can't be decoded"""
+        try:
+            image = self._Image.open(io.BytesIO(body))
+            # JPEGs can be decoded at a fraction of their size
+            image.draft("L", (self.hash_size * 8, self.hash_size * 8))
+            image = image.convert("L").resize((self.hash_size + 1, self.hash_size), self._Image.Resampling.BILINEAR)
+        except (OSError, ValueError, self._Image.DecompressionBombError):
+            return None
+
+        pixels = list(image.getdata())
+        value = 0
+        for row in range(self.hash_size):
+            for col in range(self.hash_size):
+                left = pixels[row * (self.hash_size + 1) + col]
+                value = value << 1 | (left > pixels[row * (self.hash_size + 1) + col + 1])
+        return value
+
+    def split_bands(self, dhash):
+        bits = self.hash_size * self.hash_size // self.bands
+        return [(dhash >> (band * bits)) & ((1 << bits) - 1) for band in range(self.bands)]
+
+    def find_similar(self, dhash):
+        """(checksum, path) of a stored image within max_distance bits of ```dhash```"""
+        where = " OR ".join("band%d = ?" % band for band in range(self.bands))
+        for checksum, path, other in self.db.execute("SELECT checksum, path, dhash FROM images WHERE " + where, self.split_bands(dhash)):
+            if bin(dhash ^ int(other, 16)).count("1") <= self.max_distance:
+                return checksum, path
+        return None
+
+
 # custom image pipeline;-
 # https://gist.github.com/farhadmpr/12ba6a3aa058138ec5c026a1a0f8eebd
 # https://docs.scrapy.org/en/latest/topics/media-pipeline.html?highlight=image#:~:text=file%20is%20expired.-,Thumbnail%20generation%20for%20images,the%20values%20are%20their%20dimensions.
 class Throttler(object):
     """
-    A simple throttler helps you limit the number of requests you make
-    to a limited resource
+    A token bucket throttler that helps you limit the number of requests
+    you make to a limited resource. After a quiet period up to ```burst```
+    waiters go through at once, then ```rate``` per second. No timer runs
+    while nobody is waiting.
+
+    penalize() halves the rate, down to ```min_rate```, when the resource
+    says we're going too fast, and recover() adds back ```recovery``` of
+    the configured rate after every call that went through.
     """
 
-    def __init__(self, rate):
+    def __init__(self, rate, burst=1, min_rate=None, recovery=0.05, clock=None):
         """It will callback at most ```rate``` enqueued things per second"""
-        self.queue = []
-        self.looping_call = task.LoopingCall(self._allow_one)
-        self.looping_call.start(1.0 / float(rate))
+        self.max_rate = float(rate)
+        self.rate = self.max_rate
+        self.min_rate = float(min_rate) if min_rate else self.max_rate / 16
+        self.recovery = recovery
+        self.burst = burst
+        self.clock = clock if clock is not None else reactor
+
+        self.queue = deque()
+        self.tokens = float(burst)
+        self.updated = self.clock.seconds()
+        self.call = None
 
     def stop(self):
         """Stop the throttler"""
-        self.looping_call.stop()
+        if self.call is not None and self.call.active():
+            self.call.cancel()
+        self.call = None
 
     def throttle(self):
         """
@@ -274,91 +1279,381 @@ class Throttler(object):
         in some point in the future in accordance with the throttling rate
         """
         d = defer.Deferred()
+        if not self.queue:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                d.callback(None)
+                return d
+
         self.queue.append(d)
+        self._schedule()
         return d
 
-    def _allow_one(self):
-        """Makes deferred callbacks periodically"""
+    def penalize(self):
+        """Halves the rate, the resource is telling us to slow down"""
+        self.rate = max(self.rate / 2, self.min_rate)
+
+    def recover(self):
+        """Raises the rate a bit, up to the configured rate"""
+        if self.rate < self.max_rate:
+            self.rate = min(self.rate + self.max_rate * self.recovery, self.max_rate)
+
+    def _refill(self):
+        now = self.clock.seconds()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        # Don't let float rounding leave us a hair short of a token and
+        # wake up again right away
+        if self.tokens > 1 - 1e-9:
+            self.tokens = max(self.tokens, 1.0)
+        self.updated = now
+
+    def _schedule(self):
+        """Wakes up when the next token is due"""
+        if self.call is None:
+            self.call = self.clock.callLater(max((1 - self.tokens) / self.rate, 0), self._release)
+
+    def _release(self):
+        """Makes as many deferred callbacks as there are tokens"""
+        self.call = None
+        self._refill()
+        while self.queue and self.tokens >= 1:
+            d = self.queue.popleft()
+            # Cancelled waiters don't use up a token
+            if not d.called:
+                self.tokens -= 1
+                d.callback(None)
         if self.queue:
-            self.queue.pop(0).callback(None)
+            self._schedule()
 
 
 class DeferredCache(object):
     """
-    A cache that always returns a value, an error or a deferred
+    A cache that always returns a value, an error or a deferred. Lookups of
+    a key that is being evaluated wait for that evaluation instead of
+    starting another one.
+
+    At most ```max_entries``` keys are kept, the least recently used are
+    evicted first. Values expire after ```ttl``` seconds (0 keeps them) and
+    errors after ```negative_ttl``` seconds (0 doesn't keep them). With a
+    ```snapshot_path```, values are loaded from that file when the cache is
+    created and written back to it by save().
     """
 
-    def __init__(self, key_not_found_callback):
-        """Takes as an argument"""
-        self.records = {}
+    def __init__(self, key_not_found_callback, max_entries=10000, ttl=0, negative_ttl=60.0, snapshot_path=None, stats=None, stats_prefix="deferred_cache"):
+        """Takes the function that evaluates missing keys, returning a deferred or a value"""
+        # key -> (expiry time or None, succeeded, value or failure), oldest first
+        self.records = OrderedDict()
         self.deferreds_waiting = {}
         self.key_not_found_callback = key_not_found_callback
 
-    @defer.inlineCallbacks
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.snapshot_path = snapshot_path
+        self.stats = stats
+        self.stats_prefix = stats_prefix
+
+        if snapshot_path and os.path.exists(snapshot_path):
+            self.load()
+
     def find(self, key):
         """
-        This function either returns something directly from the cache or it
-        calls ```key_not_found_callback``` to evaluate a value and return it.
-        Uses deferreds to do this is a non-blocking manner.
+        Returns a deferred that fires with the value for ```key```, from the
+        cache or from ```key_not_found_callback```, or with its error
         """
-        # This is the deferred for this call
+        record = self.records.get(key)
+        if record is not None:
+            expires, succeeded, value = record
+            if expires is None or expires > time():
+                self.records.move_to_end(key)
+                self._inc("hits")
+                return defer.succeed(value) if succeeded else defer.fail(value)
+            del self.records[key]
+            self._inc("expired")
+
         rv = defer.Deferred()
+        waiting = self.deferreds_waiting.get(key)
+        if waiting is not None:
+            # Someone is evaluating this key already
+            waiting.append(rv)
+            self._inc("coalesced")
+            return rv
+
+        self._inc("misses")
+        self.deferreds_waiting[key] = [rv]
+        d = defer.maybeDeferred(self.key_not_found_callback, key)
+        d.addCallbacks(self._found, self._failed, callbackArgs=(key,), errbackArgs=(key,))
+        return rv
+
+    def peek(self, key):
+        """The value cached for ```key```, or None, without counting a lookup"""
+        record = self.records.get(key)
+        if record is None:
+            return None
+        expires, succeeded, value = record
+        if succeeded and (expires is None or expires > time()):
+            return value
+        return None
+
+    def set(self, key, value):
+        """Caches ```value``` for ```key```, as if it was just evaluated"""
+        self._store(key, (time() + self.ttl if self.ttl > 0 else None, True, value))
+
+    def _found(self, value, key):
+        self._store(key, (time() + self.ttl if self.ttl > 0 else None, True, value))
+        for d in self.deferreds_waiting.pop(key):
+            d.callback(value)
+
+    def _failed(self, failure, key):
+        if self.negative_ttl > 0:
+            self._store(key, (time() + self.negative_ttl, False, failure))
+        for d in self.deferreds_waiting.pop(key):
+            d.errback(failure)
+
+    def _store(self, key, record):
+        self.records[key] = record
+        self.records.move_to_end(key)
+        while len(self.records) > self.max_entries:
+            self.records.popitem(last=False)
+            self._inc("evictions")
+        if self.stats is not None:
+            self.stats.set_value("%s/size" % self.stats_prefix, len(self.records))
+
+    def _inc(self, name):
+        if self.stats is not None:
+            self.stats.inc_value("%s/%s" % (self.stats_prefix, name))
+
+    def load(self):
+        """Reads the values saved in the snapshot, skipping the expired ones"""
+        with open(self.snapshot_path, encoding="utf-8") as f:
+            records = json.load(f)
+
+        now = time()
+        for key, expires, value in records:
+            if expires is None or expires > now:
+                self.records[key] = (expires, True, value)
+        while len(self.records) > self.max_entries:
+            self.records.popitem(last=False)
+
+    def save(self):
+        """Writes the values, not the errors, to the snapshot, least recently used first"""
+        if not self.snapshot_path:
+            return
 
-        if key in self.deferreds_waiting:
-            # We have other instances waiting for this key. Queue
-            self.deferreds_waiting[key].append(rv)
-        else:
-            # We are the only guy waiting for this key right now.
-            self.deferreds_waiting[key] = [rv]
+        records = [[key, expires, value] for key, (expires, succeeded, value) in self.records.items() if succeeded]
+        directory = os.path.dirname(self.snapshot_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Replace the old snapshot only once the new one is complete
+        with open(self.snapshot_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(records, f, ensure_ascii=False)
+        os.replace(self.snapshot_path + ".tmp", self.snapshot_path)
 
-            if not key in self.records:
-                # If we don't have a value for this key we will evaluate it
-                # using key_not_found_callback.
-                try:
-                    value = yield self.key_not_found_callback(key)
 
-                    # If the evaluation succeeds then the action for this key
-                    # is to call deferred's callback with value as an argument
-                    # (using Python closures)
-                    self.records[key] = lambda d: d.callback(value)
-                except Exception as e:
-                    # If the evaluation fails with an exception then the
-                    # action for this key is to call deferred's errback with
-                    # the exception as an argument (Python closures again)
-                    self.records[key] = lambda d: d.errback(e)
+class BatchGeocoder(object):
+    """
+    Geocodes addresses in batches. Addresses looked up within ```window```
+    seconds of each other go to the geocoder at ```endpoint``` in one call,
+    up to ```max_size``` at a time, and every address gets its own result.
+    The geocoder takes {"addresses": [...]} and answers {"results": [...]},
+    one {"status", "location": {"lat", "lng"}} per address, in order.
+
+    Addresses the geocoder turned down with OVER_QUERY_LIMIT, or that were
+    in a batch that failed altogether, are retried in a later batch, up to
+    ```max_retries``` times each. Batches go out at the pace of
+    ```throttler```.
+    """
+
+    def __init__(self, endpoint, throttler, stats, window=0.05, max_size=50, max_retries=3, clock=None):
+        self.endpoint = endpoint
+        self.throttler = throttler
+        self.stats = stats
+        self.window = window
+        self.max_size = max_size
+        self.max_retries = max_retries
+        self.clock = clock if clock is not None else reactor
+
+        # address -> [waiting deferreds, attempts so far], in arrival order
+        self.pending = OrderedDict()
+        self.call = None
+
+    def stop(self):
+        if self.call is not None and self.call.active():
+            self.call.cancel()
+        self.call = None
+
+    def lookup(self, address):
+        """Deferred {"lat", "lon"} of ```address```"""
+        d = defer.Deferred()
+        self._enqueue(address, [d], 0)
+        return d
+
+    def _enqueue(self, address, waiters, attempts):
+        entry = self.pending.get(address)
+        if entry is not None:
+            entry[0].extend(waiters)
+            return
+        self.pending[address] = [waiters, attempts]
+
+        if len(self.pending) >= self.max_size:
+            self.stop()
+            self._flush()
+        elif self.call is None:
+            self.call = self.clock.callLater(self.window, self._flush)
+
+    def _flush(self):
+        """Sends a batch, and schedules the next one if more are waiting"""
+        self.call = None
+        batch = OrderedDict()
+        while self.pending and len(batch) < self.max_size:
+            address, entry = self.pending.popitem(last=False)
+            batch[address] = entry
+
+        if batch:
+            self._send(batch)
+        if self.pending and self.call is None:
+            self.call = self.clock.callLater(0, self._flush)
+
+    @defer.inlineCallbacks
+    def _send(self, batch):
+        yield self.throttler.throttle()
+        self.stats.inc_value("geo_pipeline/batches")
+        self.stats.inc_value("geo_pipeline/batched_addresses", len(batch))
 
-            # At this point we have an action for this key in self.records
-            action = self.records[key]
+        try:
+            response = yield treq.post(self.endpoint, json={"addresses": list(batch)}, timeout=30)
+            content = yield response.json()
+            results = content["results"]
+            if not isinstance(results, list) or len(results) != len(batch):
+                raise ValueError("Got %d results for %d addresses" % (len(results), len(batch)))
+        except Exception as e:
+            for address, entry in batch.items():
+                self._retry(address, entry, e)
+            return
 
-            # Note that due to ```yield key_not_found_callback```, many
-            # deferreds might have been added in deferreds_waiting[key] in
-            # the meanwhile
-            # For each of the deferreds waiting for this key....
-            for d in self.deferreds_waiting.pop(key):
-                # ...perform the action later from the reactor thread
-                reactor.callFromThread(action, d)
+        over_limit = False
+        for (address, (waiters, attempts)), result in zip(batch.items(), results):
+            status = result.get("status") if isinstance(result, dict) else None
+            if status == "OK":
+                # One bad result doesn't take the rest of the batch down
+                try:
+                    location = result["location"]
+                    location = {"lat": location["lat"], "lon": location["lng"]}
+                except (KeyError, TypeError):
+                    self._fail(waiters, ValueError('Bad result %r for address="%s"' % (result, address)))
+                else:
+                    self._fire(waiters, location)
+            elif status == "OVER_QUERY_LIMIT":
+                over_limit = True
+                self._retry(address, [waiters, attempts], Exception('Unexpected status="%s" for address="%s"' % (status, address)))
+            elif isinstance(result, dict):
+                self._fail(waiters, Exception('Unexpected status="%s" for address="%s"' % (status, address)))
+            else:
+                self._fail(waiters, ValueError('Bad result %r for address="%s"' % (result, address)))
+
+        # Once per batch, however many of its addresses were turned down
+        if over_limit:
+            self.throttler.penalize()
+            self.stats.set_value("geo_pipeline/rate", self.throttler.rate)
+        else:
+            self.throttler.recover()
 
-        value = yield rv
-        defer.returnValue(value)
+    def _retry(self, address, entry, error):
+        waiters, attempts = entry
+        if attempts >= self.max_retries:
+            self._fail(waiters, error)
+            return
+        self.stats.inc_value("geo_pipeline/retries")
+        self._enqueue(address, waiters, attempts + 1)
+
+    @staticmethod
+    def _fire(waiters, value):
+        for d in waiters:
+            d.callback(value)
+
+    @staticmethod
+    def _fail(waiters, error):
+        for d in waiters:
+            d.errback(error)
 
 
 class GeoPipeline(object):
-    """A pipeline that geocodes addresses using Google's API"""
+    """
+    A pipeline that geocodes addresses using Google's API, or in batches
+    with GEO_PIPELINE_BATCH_ENDPOINT, see BatchGeocoder. With
+    GEO_LOCAL_INDEX, addresses are looked up in an offline gazetteer first
+    and only the ones it doesn't know go to the geocoder.
+
+    The ```address``` of an item is geocoded into its ```location```.
+    Items without an address, like Gumtree's, have their location string
+    geocoded into ```geo``` instead.
+    """
+
+    # The url for this API
+    # endpoint = 'https://maps.googleapis.com/maps/api/geocode/json'
+    endpoint = "http://web:9312/maps/api/geocode/json"
 
     @classmethod
     def from_crawler(cls, crawler):
         """Create a new instance and pass it crawler's stats object"""
-        return cls(crawler.stats)
-
-    def __init__(self, stats):
+        settings = crawler.settings
+        return cls(
+            crawler.stats,
+            rate=settings.getfloat("GEO_PIPELINE_RATE", 5.0),
+            burst=settings.getint("GEO_PIPELINE_BURST", 1),
+            max_entries=settings.getint("GEO_CACHE_MAX_ENTRIES", 10000),
+            ttl=settings.getfloat("GEO_CACHE_TTL", 0),
+            negative_ttl=settings.getfloat("GEO_CACHE_NEGATIVE_TTL", 300),
+            snapshot_path=settings.get("GEO_CACHE_SNAPSHOT"),
+            batch_endpoint=settings.get("GEO_PIPELINE_BATCH_ENDPOINT"),
+            batch_window=settings.getfloat("GEO_PIPELINE_BATCH_WINDOW", 0.05),
+            batch_size=settings.getint("GEO_PIPELINE_BATCH_SIZE", 50),
+            max_retries=settings.getint("GEO_PIPELINE_MAX_RETRIES", 3),
+            local_index=settings.get("GEO_LOCAL_INDEX"),
+        )
+
+    def __init__(
+        self,
+        stats,
+        rate=5.0,
+        burst=1,
+        max_entries=10000,
+        ttl=0,
+        negative_ttl=300,
+        snapshot_path=None,
+        batch_endpoint=None,
+        batch_window=0.05,
+        batch_size=50,
+        max_retries=3,
+        local_index=None,
+    ):
         """Initialize empty cache and stats object"""
         self.stats = stats
-        self.cache = DeferredCache(self.cache_key_not_found_callback)
-        self.throttler = Throttler(5)  # 5 Requests per second
+        self.gazetteer = Gazetteer(local_index) if local_index else None
+        self.throttler = Throttler(rate, burst)  # 5 Requests per second by default
+        self.batch_geocoder = None
+        if batch_endpoint:
+            self.batch_geocoder = BatchGeocoder(batch_endpoint, self.throttler, stats, batch_window, batch_size, max_retries)
+
+        self.cache = DeferredCache(
+            self.cache_key_not_found_callback,
+            max_entries=max_entries,
+            ttl=ttl,
+            negative_ttl=negative_ttl,
+            snapshot_path=snapshot_path,
+            stats=stats,
+            stats_prefix="geo_pipeline/cache",
+        )
 
     def close_spider(self, spider):
-        """Stop the throttler"""
+        """Stop the throttler and save the cache"""
         self.throttler.stop()
+        if self.batch_geocoder is not None:
+            self.batch_geocoder.stop()
+        self.cache.save()
+        if self.gazetteer is not None:
+            self.gazetteer.close()
 
     @defer.inlineCallbacks
     def geocode(self, address):
@@ -367,13 +1662,9 @@ class GeoPipeline(object):
         call this more than 5 times per second
         """
 
-        # The url for this API
-        # endpoint = 'https://maps.googleapis.com/maps/api/geocode/json'
-        endpoint = "http://web:9312/maps/api/geocode/json"
-
         # Do the call
         parms = [("address", address), ("sensor", "false")]
-        response = yield treq.get(endpoint, params=parms)
+        response = yield treq.get(self.endpoint, params=parms)
 
         # Decode the response as json
         content = yield response.json()
@@ -396,6 +1687,12 @@ class GeoPipeline(object):
         """
         self.stats.inc_value("geo_pipeline/misses")
 
+        if self.batch_geocoder is not None:
+            # Throttling and retries are done per batch and per address
+            value = yield self.batch_geocoder.lookup(address)
+            defer.returnValue(value)
+            return
+
         while True:
             # Wait enough to adhere to throttling policies
             yield self.throttler.throttle()
@@ -403,14 +1700,17 @@ class GeoPipeline(object):
             # Do the API call
             try:
                 value = yield self.geocode(address)
+                self.throttler.recover()
                 defer.returnValue(value)
 
                 # Success
                 break
             except Exception as e:
                 if 'status="OVER_QUERY_LIMIT"' in str(e):
-                    # Retry in this case
+                    # Slow down and retry in this case
+                    self.throttler.penalize()
                     self.stats.inc_value("geo_pipeline/retries")
+                    self.stats.set_value("geo_pipeline/rate", self.throttler.rate)
                     continue
                 # Propagate the rest
                 raise
@@ -422,19 +1722,35 @@ class GeoPipeline(object):
         asynchronous REST requests
         """
 
-        if "location" in item:
+        target = geocoding_target(item)
+        if target is None:
+            self.stats.inc_value("geo_pipeline/no_address")
+            defer.returnValue(item)
+            return
+
+        address, field = target
+
+        if field in item:
             # Set by previous step (spider or pipeline). Don't do anything
             # apart from increasing stats
             self.stats.inc_value("geo_pipeline/already_set")
             defer.returnValue(item)
             return
 
-        # The item has to have the address field set
-        assert ("address" in item) and (len(item["address"]) > 0)
+        self.stats.inc_value("geo_pipeline/lookups")
+        if self.gazetteer is not None:
+            # Offline first, the geocoder only gets what it doesn't know
+            value = self.gazetteer.lookup(address)
+            self.stats.inc_value("geo_pipeline/local_hits" if value is not None else "geo_pipeline/local_misses")
+            hits = self.stats.get_value("geo_pipeline/local_hits", 0)
+            self.stats.set_value("geo_pipeline/local_hit_rate", round(hits / self.stats.get_value("geo_pipeline/lookups"), 4))
+            if value is not None:
+                item[field] = value
+                defer.returnValue(item)
+                return
 
-        # Extract the address from the item.
         try:
-            item["location"] = yield self.cache.find(item["address"][0])
+            item[field] = yield self.cache.find(address)
         except:
             self.stats.inc_value("geo_pipeline/errors")
             # print (traceback.format_exc())
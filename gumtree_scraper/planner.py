@@ -0,0 +1,110 @@
+"""Plans the listing pages crawled for a set of (category, location) seeds."""
+
+import re
+
+
+class CrawlPlanner(object):
+    """
+    Generates the listing pages of every (category, location) seed lazily,
+    one page of each seed in turn so that a big region can't starve the
+    others, and remembers the ads already followed so that an ad listed in
+    overlapping regions is only fetched once.
+    """
+
+    url_template = "https://www.gumtree.com/{category}/uk/{location}"
+
+    # Gumtree ad urls end with the ad's numeric id
+    ad_id_re = re.compile(r"/(\d+)/?(?:[?#].*)?$")
+
+    @classmethod
+    def from_settings(cls, settings):
+        """
+        Seeds come from CRAWL_SEEDS_FILE if set, CRAWL_SEEDS otherwise. Given
+        as a string on the command line, CRAWL_SEEDS is a comma separated
+        list of "category/location" seeds.
+        """
+        seeds_file = settings.get("CRAWL_SEEDS_FILE")
+        if seeds_file:
+            with open(seeds_file, encoding="utf-8") as f:
+                seeds = cls.parse_seeds(f)
+        else:
+            seeds = cls.parse_seeds(settings.getlist("CRAWL_SEEDS") or [("flats-houses", "london")])
+
+        return cls(seeds, settings.getint("CRAWL_MAX_PAGES", 50), cls.parse_shard(settings.get("CRAWL_SHARD")))
+
+    @staticmethod
+    def parse_seeds(lines):
+        """
+        Reads seeds given as (category, location) pairs or as strings like
+        "flats-houses/london" or "flats-houses,london". Blank lines and
+        lines starting with # are skipped.
+        """
+        seeds = []
+        for line in lines:
+            if isinstance(line, str):
+                line = line.strip()
+                if not line or line.startswith("#"):
+                    continue
+                line = re.split(r"\s*[,/]\s*|\s+", line, maxsplit=1)
+            category, location = line
+            seeds.append((category, location))
+        return seeds
+
+    @staticmethod
+    def parse_shard(shard):
+        """(index, count) from a pair or a string like "2/4", (0, 1) if unset"""
+        if not shard:
+            return 0, 1
+        if isinstance(shard, str):
+            shard = shard.split("/")
+        index, count = (int(value) for value in shard)
+        if not 0 <= index < count:
+            raise ValueError("Bad CRAWL_SHARD %r" % (shard,))
+        return index, count
+
+    def __init__(self, seeds, max_pages=50, shard=(0, 1)):
+        self.seeds = list(seeds)
+        self.max_pages = max_pages
+        # This planner only generates the pages of shard index out of count
+        self.shard_index, self.shard_count = shard
+        # Seeds whose listing ran out of ads
+        self.exhausted = set()
+        # Numeric ids of the ads followed so far
+        self.seen_ads = set()
+
+    def page_url(self, seed, page):
+        category, location = self.seeds[seed]
+        url = self.url_template.format(category=category, location=location)
+        return url + (f"/page{page}" if page > 1 else "")
+
+    def listing_pages(self):
+        """
+        Yields (seed, page, url) of this planner's shard, round robin over
+        the seeds. Scrapy's default queues are LIFO, which would undo the
+        round robin, so requests should take priority() of their page.
+        """
+        for page in range(1, self.max_pages + 1):
+            for seed in range(len(self.seeds)):
+                if seed in self.exhausted:
+                    continue
+                # Deal the pages out to the shards in the order they'd be crawled
+                if ((page - 1) * len(self.seeds) + seed) % self.shard_count == self.shard_index:
+                    yield seed, page, self.page_url(seed, page)
+
+    @staticmethod
+    def priority(page):
+        """Request priority of listing page number page: every seed's page N goes before page N + 1"""
+        return -page
+
+    def seed_exhausted(self, seed):
+        """No more listing pages are generated for seed"""
+        self.exhausted.add(seed)
+
+    def is_new_ad(self, url):
+        """True the first time an ad url is seen, in any seed"""
+        match = self.ad_id_re.search(url)
+        key = int(match.group(1)) if match else url
+        if key in self.seen_ads:
+            return False
+        self.seen_ads.add(key)
+        return True
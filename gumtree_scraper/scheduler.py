@@ -0,0 +1,256 @@
+"""Scheduler that shares its request queue and dupefilter through Redis."""
+
+import base64
+import logging
+import pickle
+from collections import deque
+from datetime import datetime
+from time import time
+
+import txredisapi
+from scrapy import signals
+from scrapy.core.scheduler import BaseScheduler
+from scrapy.exceptions import DontCloseSpider, NotConfigured
+from scrapy.utils.log import failure_to_exc_info
+from scrapy.utils.request import request_from_dict
+from twisted.internet import defer, task
+from twisted.python.failure import Failure
+
+from gumtree_scraper.pipelines import RedisCache
+
+logger = logging.getLogger(__name__)
+
+# Adds the request to the queue unless its fingerprint was seen before.
+# Members start with a sequence number, so requests of the same priority
+# (score) come out in the order they went in.
+# Every key expires ARGV[5] seconds after the last push, so the keys of
+# finished crawls don't stay around.
+# KEYS: seen set, queue, sequence. ARGV: fingerprint, score, request,
+# dont_filter, ttl
+PUSH_SCRIPT = """
+if ARGV[4] == "0" and redis.call("SADD", KEYS[1], ARGV[1]) == 0 then
+    return 0
+end
+local sequence = redis.call("INCR", KEYS[3])
+redis.call("ZADD", KEYS[2], ARGV[2], string.format("%016d:%s", sequence, ARGV[3]))
+for _, key in ipairs(KEYS) do
+    redis.call("EXPIRE", key, ARGV[5])
+end
+return 1
+"""
+
+# Pops up to ARGV[1] requests. Returns the queue's remaining size followed
+# by the requests. KEYS: queue
+POP_SCRIPT = """
+local requests = redis.call("ZRANGE", KEYS[1], 0, tonumber(ARGV[1]) - 1)
+if #requests > 0 then
+    redis.call("ZREMRANGEBYRANK", KEYS[1], 0, #requests - 1)
+end
+table.insert(requests, 1, redis.call("ZCARD", KEYS[1]))
+return requests
+"""
+
+
+class RedisScheduler(BaseScheduler):
+    """
+    A scheduler for crawling with several workers. Every worker pushes the
+    requests it finds to one Redis sorted set, ordered by priority, and
+    pulls its next requests from it, so listing pages and ads go to
+    whichever worker is free. Fingerprints are kept in one Redis set shared
+    by all the workers, which makes it the dupefilter for the whole crawl.
+
+    Requests come out by priority, and in the order they were queued
+    within a priority.
+
+    The keys belong to one crawl, SCHEDULER_REDIS_JOB, so a new crawl
+    doesn't find every request already seen. It defaults to the time the
+    crawl started; workers of one crawl must be given the same job, which
+    python main.py --workers does, and a crawl is resumed by starting it
+    again with its job. The keys expire SCHEDULER_REDIS_TTL seconds after
+    the last request was queued.
+
+    Pass any object with txredisapi's ```eval``` and ```delete``` as
+    ```connection``` to run it against something other than Redis.
+    """
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+
+        redis_url = settings.get("SCHEDULER_REDIS_URL", None)
+        if not redis_url:
+            raise NotConfigured("RedisScheduler needs SCHEDULER_REDIS_URL")
+
+        # Same connection settings as RedisCache
+        args = RedisCache.parse_redis_url(redis_url)
+        connection = txredisapi.lazyConnectionPool(connectTimeout=5, replyTimeout=5, **args)
+
+        return cls(
+            crawler,
+            connection,
+            namespace=settings.get("SCHEDULER_REDIS_NS", "SCHEDULER"),
+            job=settings.get("SCHEDULER_REDIS_JOB") or datetime.now().strftime("%Y%m%dT%H%M%S"),
+            ttl=settings.getint("SCHEDULER_REDIS_TTL", 7 * 24 * 3600),
+            prefetch=settings.getint("SCHEDULER_REDIS_PREFETCH", 16),
+            idle_timeout=settings.getfloat("SCHEDULER_REDIS_IDLE_TIMEOUT", 30.0),
+            flush_on_start=settings.getbool("SCHEDULER_REDIS_FLUSH_ON_START", False),
+        )
+
+    def __init__(self, crawler, connection, namespace="SCHEDULER", job="default", ttl=7 * 24 * 3600, prefetch=16, idle_timeout=30.0, flush_on_start=False):
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.connection = connection
+        self.namespace = namespace
+        self.job = job
+        self.ttl = ttl
+        self.prefetch = prefetch
+        self.idle_timeout = idle_timeout
+        self.flush_on_start = flush_on_start
+
+        # Requests popped from Redis that this worker hasn't started yet
+        self.local = deque()
+        self.pending_pushes = 0
+        self.fetching = False
+        # Size of the shared queue the last time we looked, and when it
+        # last had something in it
+        self.remote_size = 0
+        self.last_busy = time()
+
+        self.spider = None
+        self.poll = None
+
+    @defer.inlineCallbacks
+    def open(self, spider):
+        self.spider = spider
+        prefix = "%s:%s:%s" % (self.namespace, spider.name, self.job)
+        self.queue_key = prefix + ":requests"
+        self.seen_key = prefix + ":seen"
+        self.sequence_key = prefix + ":sequence"
+
+        if self.flush_on_start:
+            yield self.connection.delete(self.queue_key, self.seen_key, self.sequence_key)
+
+        self.crawler.signals.connect(self._spider_idle, signal=signals.spider_idle)
+
+        # Keep an eye on the shared queue while this worker is idle
+        self.poll = task.LoopingCall(self._fetch)
+        self.poll.start(1.0)
+
+    def close(self, reason):
+        if self.poll is not None and self.poll.running:
+            self.poll.stop()
+
+        # Give what we prefetched back to the other workers
+        requests, self.local = self.local, deque()
+        return defer.DeferredList([self._push(request, dont_filter=True) for request in requests])
+
+    def has_pending_requests(self):
+        return bool(self.local) or self.pending_pushes > 0 or self.remote_size > 0
+
+    def enqueue_request(self, request):
+        """
+        Queues the request in Redis, where duplicates are dropped. Returns
+        the script's answer when it comes back right away. Otherwise the
+        request counts as queued, and a duplicate found afterwards is
+        reported with request_dropped, as the engine does for False.
+        """
+        answer = []
+        d = self._push(request, dont_filter=request.dont_filter)
+        d.addCallback(self._enqueued, request, answer)
+        if answer:
+            return answer[0]
+        answer.append(True)
+        return True
+
+    def _enqueued(self, added, request, answer):
+        if not answer:
+            answer.append(added)
+        elif not added:
+            # Too late to tell the engine
+            self.crawler.signals.send_catch_log(signals.request_dropped, request=request, spider=self.spider)
+
+    def next_request(self):
+        if len(self.local) < self.prefetch // 2 + 1:
+            self._fetch()
+
+        if not self.local:
+            return None
+
+        self.stats.inc_value("scheduler/dequeued/redis", spider=self.spider)
+        return self.local.popleft()
+
+    def _serialize(self, request):
+        data = pickle.dumps(request.to_dict(spider=self.spider), protocol=4)
+        return base64.b64encode(data).decode("ascii")
+
+    def _deserialize(self, data):
+        return request_from_dict(pickle.loads(base64.b64decode(data)), spider=self.spider)
+
+    def _push(self, request, dont_filter):
+        fingerprint = self.crawler.request_fingerprinter.fingerprint(request).hex()
+        args = [fingerprint, -request.priority, self._serialize(request), "1" if dont_filter else "0", self.ttl]
+
+        self.pending_pushes += 1
+        d = self.connection.eval(PUSH_SCRIPT, keys=[self.seen_key, self.queue_key, self.sequence_key], args=args)
+        d.addCallback(self._pushed)
+        d.addErrback(self._redis_error, "push")
+        d.addBoth(self._push_done)
+        return d
+
+    def _pushed(self, added):
+        if added:
+            self.remote_size += 1
+            self.stats.inc_value("scheduler/enqueued/redis", spider=self.spider)
+        else:
+            self.stats.inc_value("dupefilter/filtered", spider=self.spider)
+        return bool(added)
+
+    def _push_done(self, added):
+        self.pending_pushes -= 1
+        if isinstance(added, Failure):
+            logger.error("Redis push failed", exc_info=failure_to_exc_info(added), extra={"spider": self.spider})
+            self.stats.inc_value("scheduler/redis_errors", spider=self.spider)
+        # Requests that couldn't be pushed are lost, not duplicates
+        return added is not False
+
+    def _fetch(self):
+        """Tops the local buffer up from the shared queue"""
+        if self.fetching or self.spider is None:
+            return
+
+        # The buffer is full, leave the rest to the other workers
+        count = self.prefetch - len(self.local)
+        if count <= 0:
+            return
+
+        self.fetching = True
+        d = self.connection.eval(POP_SCRIPT, keys=[self.queue_key], args=[count])
+        d.addCallback(self._fetched)
+        d.addErrback(self._redis_error, "pop")
+        d.addBoth(self._fetch_done)
+
+    def _fetched(self, result):
+        self.remote_size = int(result[0])
+        for data in result[1:]:
+            # Without the sequence number
+            self.local.append(self._deserialize(data.split(":", 1)[1]))
+
+        if self.local or self.remote_size:
+            self.last_busy = time()
+
+        # Let the engine know there is work without waiting for its heartbeat
+        if result[1:] and self.crawler.engine is not None and self.crawler.engine.slot is not None:
+            self.crawler.engine.slot.nextcall.schedule()
+
+    def _fetch_done(self, _):
+        self.fetching = False
+
+    def _redis_error(self, failure, operation):
+        failure.trap(txredisapi.ConnectionError, txredisapi.ResponseError)
+        logger.error("Redis %s failed: %s", operation, failure.getErrorMessage())
+        self.stats.inc_value("scheduler/redis_errors", spider=self.spider)
+
+    def _spider_idle(self, spider):
+        """Other workers may still add requests, wait for them for a while"""
+        if self.has_pending_requests() or time() - self.last_busy < self.idle_timeout:
+            raise DontCloseSpider
@@ -28,6 +28,21 @@ LOG_ENABLED = True
 LOG_FILE = "{0}/{1}_{2}.log".format(LOGS_FOLDER_NAME, BOT_NAME, datetime.datetime.today().strftime("%Y-%m-%dT%H:%M:%S"))
 LOG_LEVEL = "DEBUG"
 
+# Listing pages crawled by the properties spider: (category, location)
+# seeds, or a file with one "category/location" per line
+CRAWL_SEEDS = [("flats-houses", "london")]
+# CRAWL_SEEDS_FILE = "seeds.txt"
+CRAWL_MAX_PAGES = 50
+# Only crawl the listing pages of shard index out of count ("0/4"), set per
+# worker by python main.py --workers N
+# CRAWL_SHARD = "0/1"
+
+# Extract ads in this many worker processes instead of the reactor thread,
+# 0 to extract them in the crawl process. At most PARSE_MAX_IN_FLIGHT ad
+# pages (default 2 per worker) are handed to the workers at a time
+PARSE_WORKERS = 0
+# PARSE_MAX_IN_FLIGHT = 16
+
 # Crawl responsibly by identifying yourself (and your website) on the user-agent
 # USER_AGENT = "gumtree_scraper (+http://www.yourdomain.com)"
 
@@ -59,37 +74,79 @@ ROBOTSTXT_OBEY = False
 
 # Enable or disable spider middlewares
 # See https://docs.scrapy.org/en/latest/topics/spider-middleware.html
-# SPIDER_MIDDLEWARES = {
-#    "gumtree_scraper.middlewares.GumtreeScraperSpiderMiddleware": 543,
-# }
+SPIDER_MIDDLEWARES = {
+    # "gumtree_scraper.middlewares.GumtreeScraperSpiderMiddleware": 543,
+    "gumtree_scraper.middlewares.ParseTimingMiddleware": 950,
+}
 
 # Enable or disable downloader middlewares
 # See https://docs.scrapy.org/en/latest/topics/downloader-middleware.html
 DOWNLOADER_MIDDLEWARES = {
+    "gumtree_scraper.middlewares.IncrementalRecrawlMiddleware": 540,
     "gumtree_scraper.middlewares.GumtreeScraperDownloaderMiddleware": 543,
+    # Sees responses before HttpCompressionMiddleware (590), as they were sent
+    "gumtree_scraper.middlewares.ResponseRecorderMiddleware": 950,
 }
 
+# Record every response to an archive (python main.py --record PATH), or
+# serve them back from one (python main.py --replay PATH)
+# RECORD_ARCHIVE = "archives/crawl"
+# REPLAY_ARCHIVE = "archives/crawl"
+
+# Skip ad pages downloaded less than RECRAWL_MAX_AGE seconds ago
+RECRAWL_ENABLED = False
+# RECRAWL_DIR = "recrawl"
+# RECRAWL_MAX_AGE = 86400
+
 # Enable or disable extensions
 # See https://docs.scrapy.org/en/latest/topics/extensions.html
 EXTENSIONS = {
     "scrapy.extensions.telnet.TelnetConsole": None,
     "gumtree_scraper.extensions.SetLoggingFileTerminal": 100,
     "gumtree_scraper.extensions.Latencies": 200,
+    "gumtree_scraper.extensions.AdaptiveConcurrency": 210,
+    "gumtree_scraper.extensions.MetricsExporter": 220,
     # "gumtree_scraper.extensions.TrackItemsScraped": 300,
 }
 
 TRACKITEMSCRAPED_ENABLED = True
 TRACKITEMSCRAPED_ITEMCOUNT = 10
 LATENCIES_INTERVAL = 5.0
+LATENCIES_METRICS_FILE = "{0}/metrics_{1}.jsonl".format(LOGS_FOLDER_NAME, datetime.datetime.today().strftime("%Y-%m-%dT%H:%M:%S"))
+
+# Tune per-domain concurrency and delay from Latencies' measurements.
+# Keep AUTOTHROTTLE_ENABLED off when this is on
+ADAPTIVE_CONCURRENCY_ENABLED = False
+# ADAPTIVE_CONCURRENCY_TARGET_LATENCY = 10.0
+# ADAPTIVE_CONCURRENCY_TARGET_ERROR_RATE = 0.05
+# ADAPTIVE_CONCURRENCY_MIN_CONCURRENCY = 1
+# ADAPTIVE_CONCURRENCY_MAX_CONCURRENCY = 16  # at most CONCURRENT_REQUESTS
+# ADAPTIVE_CONCURRENCY_MAX_DELAY = 10.0
+# ADAPTIVE_CONCURRENCY_MAX_PENDING_ITEMS = 100
+
+# Serve Prometheus metrics on http://METRICS_EXPORTER_HOST:METRICS_EXPORTER_PORT/metrics
+METRICS_EXPORTER_ENABLED = False
+# METRICS_EXPORTER_HOST = "127.0.0.1"
+# METRICS_EXPORTER_PORT = 9410
 
 # Configure item pipelines
 # See https://docs.scrapy.org/en/latest/topics/item-pipeline.html
+# Time every pipeline stage for the Latencies histograms
+ITEM_PROCESSOR = "gumtree_scraper.instrumentation.TimedItemPipelineManager"
 ITEM_PIPELINES = {
-    "scrapy.pipelines.images.ImagesPipeline": 1,
+    # "scrapy.pipelines.images.ImagesPipeline": 1,
+    "gumtree_scraper.pipelines.ImageDedupPipeline": 1,
+    "gumtree_scraper.pipelines.NormalisePipeline": 200,
     "gumtree_scraper.pipelines.PostgresWriter": 300,
-    # "gumtree_scraper.pipelines.GeoPipeline": 400,
+    # Before PostgresWriter, so that items are written with their geo point
+    # "gumtree_scraper.pipelines.GeoPipeline": 250,
 }
 
+# Normalise items in batches of NORMALISE_BATCH_SIZE (0 = one at a time),
+# each waiting at most NORMALISE_BATCH_WINDOW seconds for the rest
+# NORMALISE_BATCH_SIZE = 100
+# NORMALISE_BATCH_WINDOW = 0.05
+
 # postgres db settings, default port 5432
 DB_HOSTNAME = os.getenv("DB_HOSTNAME")
 DB_USERNAME = os.getenv("DB_USERNAME")
@@ -97,6 +154,9 @@ DB_PASSWORD = os.getenv("DB_PASSWORD")  # your password
 DB_NAME = os.getenv("DB_NAME")
 # connection url
 POSTGRES_PIPELINE_URL = f"postgresql://{DB_USERNAME}:{DB_PASSWORD}@{DB_HOSTNAME}:5432/{DB_NAME}"
+# Buffer items and write them with COPY in batches (0 = one transaction per item)
+# POSTGRES_PIPELINE_BATCH_SIZE = 500
+# POSTGRES_PIPELINE_FLUSH_INTERVAL = 5.0
 # connection json
 POSTGRES_CONNECTION_SETTINGS = {
     "host": DB_HOSTNAME,
@@ -106,10 +166,78 @@ POSTGRES_CONNECTION_SETTINGS = {
 }
 
 # REDIS_PIPELINE_URL = "redis://redis:6379"
+# RedisCache keeps the most recently used addresses in process too, and
+# combines the lookups and writes made within REDIS_PIPELINE_BATCH_WINDOW
+# seconds (0 = in the same reactor iteration) into MGETs and MSETs of up to
+# REDIS_PIPELINE_BATCH_SIZE keys. Keys expire after REDIS_PIPELINE_TTL
+# seconds (0 = never)
+# REDIS_PIPELINE_L1_ENTRIES = 10000
+# REDIS_PIPELINE_BATCH_WINDOW = 0
+# REDIS_PIPELINE_BATCH_SIZE = 100
+# REDIS_PIPELINE_TTL = 2592000
+
+# Geocoding calls per second, and how many may go out at once after a
+# quiet period. The rate is halved every time the geocoder answers
+# OVER_QUERY_LIMIT and recovers with every successful call
+# GEO_PIPELINE_RATE = 5.0
+# GEO_PIPELINE_BURST = 1
+# Geocode addresses in batches: the ones looked up within
+# GEO_PIPELINE_BATCH_WINDOW seconds go to this endpoint together, up to
+# GEO_PIPELINE_BATCH_SIZE at a time, each retried up to
+# GEO_PIPELINE_MAX_RETRIES times
+# GEO_PIPELINE_BATCH_ENDPOINT = "http://web:9312/maps/api/geocode/batch"
+# GEO_PIPELINE_BATCH_WINDOW = 0.05
+# GEO_PIPELINE_BATCH_SIZE = 50
+# GEO_PIPELINE_MAX_RETRIES = 3
+
+# GeoPipeline's in-memory cache of geocoded addresses: how many it keeps,
+# for how long (0 = for the whole crawl), how long failed lookups are
+# remembered, and where it's saved between crawls
+# GEO_CACHE_MAX_ENTRIES = 10000
+# GEO_CACHE_TTL = 0
+# GEO_CACHE_NEGATIVE_TTL = 300
+# GEO_CACHE_SNAPSHOT = "geo_cache.json"
+
+# Geocode offline first: an index of UK postcodes, postcode districts and
+# place names built with `python -m gumtree_scraper.gazetteer places.csv
+# gazetteer.idx`. Only the locations it doesn't know go to the geocoder
+# GEO_LOCAL_INDEX = "gazetteer.idx"
+
+# Share the request queue and dupefilter with other workers through Redis
+# SCHEDULER = "gumtree_scraper.scheduler.RedisScheduler"
+# SCHEDULER_REDIS_URL = "redis://redis:6379"
+# SCHEDULER_REDIS_PREFETCH = 16
+# SCHEDULER_REDIS_IDLE_TIMEOUT = 30.0
+# Requests belong to one crawl: a new crawl starts a new job, workers of
+# one crawl (python main.py --workers) share it, and an old job is resumed
+# by setting it again. The job's keys expire a week after its last request
+# SCHEDULER_REDIS_JOB = None
+# SCHEDULER_REDIS_TTL = 7 * 24 * 3600
+# SCHEDULER_REDIS_FLUSH_ON_START = False
 
 IMAGES_STORE = "images"
 IMAGES_THUMBS = {"small": (30, 30)}
 
+# Write items without waiting for their images, which are downloaded in
+# the background, at most IMAGES_DEFERRED_CONCURRENCY items at a time, and
+# added to the items' rows when they're done
+IMAGES_DEFERRED = False
+# IMAGES_DEFERRED_CONCURRENCY = 4
+
+# Convert and thumbnail images in this many threads, 0 to do it in the
+# reactor thread, with at most IMAGES_THREADS_QUEUE images (default 2 per
+# thread) handed to them at a time. IMAGES_DRAFT decodes JPEGs at reduced
+# size for their thumbnails
+IMAGES_THREADS = 0
+# IMAGES_THREADS_QUEUE = 8
+# IMAGES_DRAFT = True
+
+# Index of the images ImageDedupPipeline already stored, under .scrapy, and
+# how many bits of their 64 bit perceptual hashes two images may differ by
+# and still be stored once
+# IMAGE_DEDUP_DIR = "image_dedup"
+# IMAGE_DEDUP_MAX_DISTANCE = 3  # at most 3
+
 # Enable and configure the AutoThrottle extension (disabled by default)
 # See https://docs.scrapy.org/en/latest/topics/autothrottle.html
 # AUTOTHROTTLE_ENABLED = True
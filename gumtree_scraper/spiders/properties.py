@@ -3,15 +3,15 @@
 import socket
 from datetime import datetime
 
-from itemloaders.processors import MapCompose, TakeFirst
-from lxml import html
-from scrapy.item import Field
+from scrapy import Request
 from scrapy.linkextractors import LinkExtractor
-from scrapy.loader import ItemLoader
 from scrapy.spiders import CrawlSpider, Rule
-from w3lib.html import remove_tags
+from scrapy.utils.defer import maybe_deferred_to_future
 
-from gumtree_scraper.items import GumtreePropertiesItem
+from gumtree_scraper.extractors import AdExtractor
+from gumtree_scraper.items import GumtreePropertiesItem, PropertyAttributes
+from gumtree_scraper.parsing import ParsePool
+from gumtree_scraper.planner import CrawlPlanner
 
 
 class PropertiesSpider(CrawlSpider):
@@ -19,7 +19,7 @@ class PropertiesSpider(CrawlSpider):
 
     name = "properties"
     allowed_domains = ["gumtree.com"]
-    start_urls = ["https://www.gumtree.com/flats-houses/uk/london" + (f"/page{i}" if i > 1 else "") for i in range(1, 51)]
+    # Listing pages come from the crawl planner, see CRAWL_SEEDS
 
     # rules = (Rule(LinkExtractor(allow=r"Items/"), callback="parse_item", follow=True),)
     rules = (
@@ -27,64 +27,71 @@ class PropertiesSpider(CrawlSpider):
         #     LinkExtractor(restrict_xpaths='//a[@data-q="pagination-forward-page"]')
         # ),  # //a[@data-q="pagination-forward-page"]/@href
         Rule(
-            LinkExtractor(restrict_xpaths='//article[@data-q="search-result"]//a'), callback="parse_item"
+            LinkExtractor(restrict_xpaths='//article[@data-q="search-result"]//a'), callback="parse_item", process_links="new_ads"
         ),  # //a[@data-q="search-result-anchor"]/@href
     )
 
+    # Worker processes extracting the ads, see PARSE_WORKERS
+    parse_pool = None
+
+    def __init__(self, *args, **kwargs):
+        """Compile the ad selectors once for the whole crawl."""
+        super().__init__(*args, **kwargs)
+        self.extractor = AdExtractor()
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        """Build the crawl planner from the CRAWL_* settings."""
+        spider = super().from_crawler(crawler, *args, **kwargs)
+        spider.planner = CrawlPlanner.from_settings(crawler.settings)
+        if crawler.settings.getint("PARSE_WORKERS", 0) > 0:
+            spider.parse_pool = ParsePool.from_crawler(crawler)
+        return spider
+
+    def start_requests(self):
+        """Listing pages of every seed, generated as the scheduler asks for them."""
+        for seed, page, url in self.planner.listing_pages():
+            yield Request(url, priority=self.planner.priority(page), meta={"seed": seed, "page": page})
+
+    def parse_start_url(self, response):
+        """Stop generating pages for a seed once its listing has no ads."""
+        if "seed" in response.meta and not response.xpath('//article[@data-q="search-result"]'):
+            self.planner.seed_exhausted(response.meta["seed"])
+        return []
+
+    def new_ads(self, links):
+        """Drop ads already followed from this or another seed."""
+        return [link for link in links if self.planner.is_new_ad(link.url)]
+
     def parse_item(self, response):
         """Extract a single property ad (title, price, location, description, attributes) into an item."""
+        if self.parse_pool is not None:
+            return self.parse_item_in_pool(response)
 
-        item_loader = ItemLoader(item=GumtreePropertiesItem(), response=response)
-        # item_loader.default_output_processor = TakeFirst()
-
-        item_loader.add_xpath("title", "//h1[1]/text()", MapCompose(str.strip, str.title))
-        item_loader.add_xpath("location", '//h4[@data-q="ad-location"]/text()', MapCompose(str.strip))
-        item_loader.add_xpath("price", '//h3[@data-q="ad-price"]/text()', MapCompose(str.strip))
-        item_loader.add_xpath("image_urls", '//li[contains(@class,"carousel-item")]/img/@src')
-        item_loader.add_xpath("description", '//p[@itemprop="description"]', MapCompose(remove_tags, self.format_paragraph))
-        item_loader.add_xpath("seller", '//h2[@class="truncate-line seller-rating-block-name"]/text()', MapCompose(str.strip, str.title))
+        fields, attributes = self.extractor.extract(response.selector.root)
+        return self.build_item(response, fields, attributes)
 
-        attributes_container = response.xpath('//div[@data-q="attribute-container"]//dl').getall()
-        for each_attribute in attributes_container:
-            html_selector = html.fromstring(each_attribute)
-            attribute_field = html_selector.xpath("//dt/text()")[0]
-            attribute_value = html_selector.xpath("//dd/text()")[0]
+    async def parse_item_in_pool(self, response):
+        """Same as parse_item, with the extraction done by a worker process."""
+        fields, attributes = await maybe_deferred_to_future(self.parse_pool.extract(response))
+        return self.build_item(response, fields, PropertyAttributes(**attributes))
 
-            item_key = self.process_attr_str(attribute_field)
-            GumtreePropertiesItem.fields[item_key] = Field(output_processor=TakeFirst())
-            item_loader.add_value(item_key, attribute_value)
+    def build_item(self, response, fields, attributes):
+        """The item for the extracted fields, plus the housekeeping fields."""
+        item = GumtreePropertiesItem(fields, attributes=attributes)
 
         # Housekeeping fields
-        item_loader.add_value("url", response.url)
-        item_loader.add_value("project", self.settings.get("BOT_NAME"))
-        item_loader.add_value("spider", self.name)
-        item_loader.add_value("server", socket.gethostname())
-        item_loader.add_value("date", datetime.now().isoformat())
-        # item_loader.add_value("date", datetime.now())
-        # item_loader.add_value("date", datetime.now(timezone.utc)) timezone time
+        item["url"] = response.url
+        item["project"] = self.settings.get("BOT_NAME")
+        item["spider"] = self.name
+        item["server"] = socket.gethostname()
+        item["date"] = datetime.now().isoformat()
+        # item["date"] = datetime.now(timezone.utc).isoformat() timezone time
 
-        return item_loader.load_item()
+        return item
 
     def process_images_container(self, images_container):
         """Wrap a single images value in a list for the loader."""
         container = []
         container.append(images_container)
         return container
-
-    def format_paragraph(self, job_description):
-        """Normalize whitespace: collapse spaces and newlines to single spaces."""
-        job_description = " ".join(job_description.split())
-
-        # Replace newline characters with space
-        job_description = job_description.replace("\n", " ")
-        return job_description
-
-    def process_attr_str(self, input_string):
-        """Normalize attribute name to a lowercase, underscore-separated key."""
-        input_string = input_string.strip()
-
-        # Convert to lower case
-        input_string = input_string.lower()
-
-        input_string = "_".join(input_string.split())
-        return input_string
@@ -5,16 +5,14 @@ import socket
 from datetime import datetime
 from urllib.parse import urlparse, urlunparse
 
-from itemloaders.processors import MapCompose, TakeFirst
-from lxml import html
 from scrapy import Request
-from scrapy.item import Field
 from scrapy.linkextractors import LinkExtractor
-from scrapy.loader import ItemLoader
 from scrapy.spiders import CrawlSpider
-from w3lib.html import remove_tags
+from scrapy.utils.defer import maybe_deferred_to_future
 
-from gumtree_scraper.items import GumtreePropertiesItem
+from gumtree_scraper.extractors import AdExtractor
+from gumtree_scraper.items import GumtreePropertiesItem, PropertyAttributes
+from gumtree_scraper.parsing import ParsePool
 
 
 class PropertiesSpider(CrawlSpider):
@@ -28,20 +26,81 @@ class PropertiesSpider(CrawlSpider):
 
     max_page = 50  # Stop after this page to avoid unbounded crawl
 
+    # "fanout" schedules every listing page as soon as the first one tells us
+    # how many there are, "chain" follows them one after the other
+    pagination = "fanout"
+
     item_link_extractor = LinkExtractor(restrict_xpaths='//article[@data-q="search-result"]//a')
+    pagination_links = '//*[contains(@data-q,"pagination")]//@href | //a[contains(@data-q,"pagination")]/@href'
+
+    # Worker processes extracting the ads, see PARSE_WORKERS
+    parse_pool = None
+
+    def __init__(self, *args, **kwargs):
+        """Compile the ad selectors once for the whole crawl."""
+        super().__init__(*args, **kwargs)
+        self.extractor = AdExtractor()
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        """Start the parse workers if PARSE_WORKERS is set."""
+        spider = super().from_crawler(crawler, *args, **kwargs)
+        if crawler.settings.getint("PARSE_WORKERS", 0) > 0:
+            spider.parse_pool = ParsePool.from_crawler(crawler)
+        return spider
 
     def start_requests(self):
         """Send start URLs to parse_listing so we never override CrawlSpider.parse."""
         for url in self.start_urls:
-            yield Request(url, callback=self.parse_listing)
+            yield Request(url, callback=self.parse_listing, meta={"fanout": self.pagination == "fanout"})
 
     def parse_listing(self, response):
-        """Handle a listing page: yield item requests and the next page request."""
+        """Handle a listing page: yield item requests and the next page request(s)."""
+        page = self.page_number(response.url)
+
+        # Ads of page N go ahead of listing page N + 1, so the downloader
+        # always has ads to fetch while the listing pages come in
         for link in self.item_link_extractor.extract_links(response):
-            yield Request(link.url, callback=self.parse_item)
+            yield Request(link.url, callback=self.parse_item, priority=-2 * page - 1)
+
+        if response.meta.get("fanout"):
+            last_page = self.last_page_number(response)
+            if last_page is not None:
+                # The pagination only links a few pages ahead, so the
+                # highest one fans out again from what it links to
+                for next_page in range(page + 1, last_page + 1):
+                    url = self.page_url(response.url, next_page)
+                    meta = {"fanout": True} if next_page == last_page else {"fanned_out": True}
+                    yield Request(url, callback=self.parse_listing, priority=-2 * next_page, meta=meta)
+                return
+
+        # Already scheduled by the first page
+        if response.meta.get("fanned_out"):
+            return
+
         next_url = self.next_page_url(response.url)
         if next_url is not None:
-            yield Request(next_url, callback=self.parse_listing)
+            yield Request(next_url, callback=self.parse_listing, priority=-2 * (page + 1))
+
+    def page_number(self, url):
+        """Listing page number of url (.../london is page 1)."""
+        match = re.search(r"/page(\d+)/?$", urlparse(url).path)
+        return int(match.group(1)) if match else 1
+
+    def last_page_number(self, response):
+        """Highest page the pagination links point to, at least this one, capped at max_page. None if there are none."""
+        pages = [self.page_number(href) for href in response.xpath(self.pagination_links).getall()]
+        if not pages:
+            return None
+        return min(max(pages + [self.page_number(response.url)]), self.max_page)
+
+    def page_url(self, url, page):
+        """URL of listing page number page, on the same search as url."""
+        parsed = urlparse(url)
+        path = re.sub(r"/page\d+$", "", parsed.path.rstrip("/"))
+        if page > 1:
+            path += f"/page{page}"
+        return urlunparse((parsed.scheme, parsed.netloc, path, "", parsed.query or "", parsed.fragment))
 
     def next_page_url(self, url):
         """Build next listing page URL (e.g. .../london -> .../london/page2). Returns None if past max_page."""
@@ -59,57 +118,33 @@ class PropertiesSpider(CrawlSpider):
 
     def parse_item(self, response):
         """Extract a single property ad (title, price, location, description, attributes) into an item."""
-        item_loader = ItemLoader(item=GumtreePropertiesItem(), response=response)
-        # item_loader.default_output_processor = TakeFirst()
-
-        item_loader.add_xpath("title", "//h1[1]/text()", MapCompose(str.strip, str.title))
-        item_loader.add_xpath("location", '//h4[@data-q="ad-location"]/text()', MapCompose(str.strip))
-        item_loader.add_xpath("price", '//h3[@data-q="ad-price"]/text()', MapCompose(str.strip))
-        item_loader.add_xpath("image_urls", '//li[contains(@class,"carousel-item")]/img/@src')
-        item_loader.add_xpath("description", '//p[@itemprop="description"]', MapCompose(remove_tags, self.format_paragraph))
-        item_loader.add_xpath("seller", '//h2[@class="truncate-line seller-rating-block-name"]/text()', MapCompose(str.strip, str.title))
-
-        attributes_container = response.xpath('//div[@data-q="attribute-container"]//dl').getall()
-        for each_attribute in attributes_container:
-            html_selector = html.fromstring(each_attribute)
-            attribute_field = html_selector.xpath("//dt/text()")[0]
-            attribute_value = html_selector.xpath("//dd/text()")[0]
-
-            item_key = self.process_attr_str(attribute_field)
-            GumtreePropertiesItem.fields[item_key] = Field(output_processor=TakeFirst())
-            item_loader.add_value(item_key, attribute_value)
+        if self.parse_pool is not None:
+            return self.parse_item_in_pool(response)
+
+        fields, attributes = self.extractor.extract(response.selector.root)
+        return self.build_item(response, fields, attributes)
+
+    async def parse_item_in_pool(self, response):
+        """Same as parse_item, with the extraction done by a worker process."""
+        fields, attributes = await maybe_deferred_to_future(self.parse_pool.extract(response))
+        return self.build_item(response, fields, PropertyAttributes(**attributes))
+
+    def build_item(self, response, fields, attributes):
+        """The item for the extracted fields, plus the housekeeping fields."""
+        item = GumtreePropertiesItem(fields, attributes=attributes)
 
         # Housekeeping fields
-        item_loader.add_value("url", response.url)
-        item_loader.add_value("project", self.settings.get("BOT_NAME"))
-        item_loader.add_value("spider", self.name)
-        item_loader.add_value("server", socket.gethostname())
-        item_loader.add_value("date", datetime.now().isoformat())
-        # item_loader.add_value("date", datetime.now())
-        # item_loader.add_value("date", datetime.now(timezone.utc)) timezone time
+        item["url"] = response.url
+        item["project"] = self.settings.get("BOT_NAME")
+        item["spider"] = self.name
+        item["server"] = socket.gethostname()
+        item["date"] = datetime.now().isoformat()
+        # item["date"] = datetime.now(timezone.utc).isoformat() timezone time
 
-        return item_loader.load_item()
+        return item
 
     def process_images_container(self, images_container):
         """Wrap a single images value in a list for the loader."""
         container = []
         container.append(images_container)
         return container
-
-    def format_paragraph(self, job_description):
-        """Normalize whitespace: collapse spaces and newlines to single spaces."""
-        job_description = " ".join(job_description.split())
-
-        # Replace newline characters with space
-        job_description = job_description.replace("\n", " ")
-        return job_description
-
-    def process_attr_str(self, input_string):
-        """Normalize attribute name to a lowercase, underscore-separated key."""
-        input_string = input_string.strip()
-
-        # Convert to lower case
-        input_string = input_string.lower()
-
-        input_string = "_".join(input_string.split())
-        return input_string
@@ -1,15 +1,204 @@
 """Main module for running the Gumtree scrapers."""
 
+import argparse
+import datetime
+import logging
+import multiprocessing
+import os
+import pprint
+import queue
+
 from scrapy.crawler import CrawlerProcess
+from scrapy.utils.log import configure_logging
 from scrapy.utils.project import get_project_settings
 
+from gumtree_scraper.extensions import Latencies
+from gumtree_scraper.instrumentation import Histogram
 from gumtree_scraper.spiders.properties import PropertiesSpider
 
+logger = logging.getLogger(__name__)
 
-def main():
-    """Main function"""
+# Stats that are merged with max() or min() rather than summed across workers.
+# Percentiles and means are only the worst worker's until merge_stats()
+# replaces them with those of the merged histograms
+MAX_STATS = ("max", "p50", "p95", "p99", "mean", "elapsed_time_seconds")
+MIN_STATS = ("time_to_first_item", "start_time")
+# Gauges, averaged over the workers: anything ending in one of these
+MEAN_STATS = ("_rate", "latency", "per_second", "/delay")
+# Hit rates, worked out again from the merged counters: the hits, and what
+# they are out of
+RATE_STATS = {
+    "redis_cache/l1_hit_rate": ("redis_cache/l1/hits", ("redis_cache/lookups",)),
+    "redis_cache/l2_hit_rate": ("redis_cache/l2/hits", ("redis_cache/l2/hits", "redis_cache/l2/misses")),
+    "geo_pipeline/local_hit_rate": ("geo_pipeline/local_hits", ("geo_pipeline/lookups",)),
+}
+
+
+def parse_args():
+    """Command line options"""
+    parser = argparse.ArgumentParser(description="Run the Gumtree properties spider.")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--record", metavar="PATH", help="store every downloaded response in an archive at PATH")
+    mode.add_argument("--replay", metavar="PATH", help="serve every request from the archive at PATH, offline")
+    parser.add_argument("--workers", type=int, default=1, help="crawl in N processes, each with a shard of the listing pages")
+    return parser.parse_args()
+
+
+def crawl_settings(args):
+    """Project settings for the command line options"""
     settings = get_project_settings()
+
+    if args.record:
+        settings.set("RECORD_ARCHIVE", args.record)
+    if args.replay:
+        settings.set("REPLAY_ARCHIVE", args.replay)
+        settings.set(
+            "DOWNLOAD_HANDLERS",
+            {
+                "http": "gumtree_scraper.archive.ReplayDownloadHandler",
+                "https": "gumtree_scraper.archive.ReplayDownloadHandler",
+            },
+        )
+        # Nothing to be polite to
+        settings.set("DOWNLOAD_DELAY", 0)
+        settings.set("AUTOTHROTTLE_ENABLED", False)
+
+    return settings
+
+
+def worker_path(path, index):
+    """```path``` with the worker index before its extension"""
+    root, ext = os.path.splitext(path)
+    return "%s_worker%d%s" % (root, index, ext)
+
+
+def worker_settings(settings, index, workers):
+    """Settings worker ```index``` overrides so that workers don't share files or ports"""
+    overrides = {"CRAWL_SHARD": (index, workers), "SCHEDULER_REDIS_JOB": settings.get("SCHEDULER_REDIS_JOB")}
+    for name in ("LOG_FILE", "LATENCIES_METRICS_FILE", "RECORD_ARCHIVE"):
+        if settings.get(name):
+            overrides[name] = worker_path(settings.get(name), index)
+    if settings.getbool("METRICS_EXPORTER_ENABLED"):
+        overrides["METRICS_EXPORTER_PORT"] = settings.getint("METRICS_EXPORTER_PORT", 9410) + index
+    return overrides
+
+
+def run_worker(args, overrides, results):
+    """Runs one crawl with its own reactor and sends its stats to the parent"""
+    settings = crawl_settings(args)
+    settings.setdict(overrides, priority="cmdline")
+
     process = CrawlerProcess(settings)
+    crawler = process.create_crawler(PropertiesSpider)
+    process.crawl(crawler)
+    process.start()
+
+    index, _ = overrides["CRAWL_SHARD"]
+    results.put((index, crawler.stats.get_stats(), latency_histograms(crawler)))
+
+
+def latency_histograms(crawler):
+    """The histograms of the Latencies extension, if it is enabled"""
+    for extension in getattr(crawler.extensions, "middlewares", ()):
+        if isinstance(extension, Latencies):
+            return extension.histograms
+    return {}
+
+
+def merge_stats(all_stats, all_histograms=()):
+    """
+    One stats dict for the crawl from the stats of every worker. The
+    latencies/<stage>/ percentiles and mean can't be merged, they come from
+    the merged ```all_histograms``` of the workers instead.
+    """
+    merged = {}
+    gauges = {}
+    for stats in all_stats:
+        for key, value in stats.items():
+            name = key.rsplit("/", 1)[-1]
+            if key.endswith(MEAN_STATS) and not name.startswith("max") and isinstance(value, (int, float)):
+                gauges.setdefault(key, []).append(value)
+            elif key not in merged:
+                merged[key] = value
+            elif isinstance(value, (int, float, datetime.datetime)) and not isinstance(value, bool):
+                if name in MIN_STATS:
+                    merged[key] = min(merged[key], value)
+                elif name in MAX_STATS or name.startswith("max") or isinstance(value, datetime.datetime):
+                    merged[key] = max(merged[key], value)
+                else:
+                    merged[key] += value
+            elif merged[key] != value:
+                merged[key] = "%s, %s" % (merged[key], value)
+
+    for key, values in gauges.items():
+        merged[key] = sum(values) / len(values)
+    for key, (hits, totals) in RATE_STATS.items():
+        total = sum(merged.get(name, 0) for name in totals)
+        if key in merged and total:
+            merged[key] = round(merged.get(hits, 0) / total, 4)
+
+    stages = {}
+    for histograms in all_histograms:
+        for stage, histogram in histograms.items():
+            stages.setdefault(stage, Histogram()).merge(histogram)
+    for stage, histogram in stages.items():
+        for key, value in histogram.summary().items():
+            merged["latencies/%s/%s" % (stage, key)] = value
+    return merged
+
+
+def run_workers(args):
+    """Starts a crawl process per shard and logs their merged stats"""
+    settings = crawl_settings(args)
+    configure_logging(settings)
+    # One scheduler job for all the workers, or they'd each crawl alone
+    if not settings.get("SCHEDULER_REDIS_JOB"):
+        settings.set("SCHEDULER_REDIS_JOB", datetime.datetime.now().strftime("%Y%m%dT%H%M%S"), priority="cmdline")
+
+    # Spawned, not forked: each worker installs its own reactor
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    processes = [
+        context.Process(target=run_worker, args=(args, worker_settings(settings, index, args.workers), results), name="crawl-worker-%d" % index)
+        for index in range(args.workers)
+    ]
+    for process in processes:
+        process.start()
+
+    worker_stats = {}
+    worker_histograms = {}
+    while len(worker_stats) < len(processes):
+        try:
+            index, stats, histograms = results.get(timeout=1)
+        except queue.Empty:
+            # A worker that died doesn't send its stats
+            if not any(process.is_alive() for process in processes) and results.empty():
+                break
+            continue
+        worker_stats[index] = stats
+        worker_histograms[index] = histograms
+
+    for process in processes:
+        process.join()
+
+    failed = [process.name for process in processes if process.exitcode != 0]
+    if failed:
+        logger.error("Workers failed: %s", ", ".join(failed))
+
+    stats = merge_stats([stats for _, stats in sorted(worker_stats.items())], worker_histograms.values())
+    stats["workers"] = len(worker_stats)
+    logger.info("Crawl stats of %d workers:\n%s", len(worker_stats), pprint.pformat(stats))
+
+
+def main():
+    """Main function"""
+    args = parse_args()
+
+    if args.workers > 1:
+        run_workers(args)
+        return
+
+    process = CrawlerProcess(crawl_settings(args))
     process.crawl(PropertiesSpider)
     process.start()
 
@@ -0,0 +1,65 @@
+"""Crawls of the fake Gumtree, for tests that need the whole of Scrapy."""
+
+import shutil
+import tempfile
+
+from scrapy.crawler import CrawlerRunner
+from scrapy.utils.project import get_project_settings
+from twisted.internet import defer, reactor
+from twisted.trial import unittest
+from twisted.web import server
+
+from gumtree_scraper.spiders.properties import PropertiesSpider
+from tests.fakes import FakeGumtree
+
+
+class CrawlTestCase(unittest.TestCase):
+    """
+    Serves a fake Gumtree of ```pages``` listing pages for the test to
+    crawl. Files the crawls keep go to ```self.directory```
+    """
+
+    pages = 2
+    ads_per_page = 3
+
+    def setUp(self):
+        site = server.Site(FakeGumtree(self.pages, self.ads_per_page, images_per_ad=1))
+        self.port = reactor.listenTCP(0, site, interface="127.0.0.1")
+        self.server_url = "http://127.0.0.1:%d" % self.port.getHost().port
+        self.directory = tempfile.mkdtemp(prefix="gumtree-test-")
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def tearDown(self):
+        return self.port.stopListening()
+
+    def settings(self, **overrides):
+        """The project's settings, offline and without the external services"""
+        settings = get_project_settings()
+        settings.setdict(
+            {
+                "TWISTED_REACTOR": None,
+                "LOG_FILE": None,
+                "LOG_LEVEL": "INFO",
+                "LATENCIES_METRICS_FILE": None,
+                "EXTENSIONS": {"scrapy.extensions.telnet.TelnetConsole": None},
+                "DOWNLOAD_HANDLERS": {
+                    "http": "tests.fakes.LocalDownloadHandler",
+                    "https": "tests.fakes.LocalDownloadHandler",
+                },
+                "BENCHMARK_SERVER": self.server_url,
+                "CRAWL_SEEDS": [("flats-houses", "london")],
+                "CRAWL_MAX_PAGES": self.pages + 1,
+                "ITEM_PIPELINES": {"gumtree_scraper.pipelines.NormalisePipeline": 200},
+            },
+            priority="cmdline",
+        )
+        settings.setdict(overrides, priority="cmdline")
+        return settings
+
+    @defer.inlineCallbacks
+    def crawl(self, spider=PropertiesSpider, **overrides):
+        """Runs a crawl, returns its stats"""
+        runner = CrawlerRunner(self.settings(**overrides))
+        crawler = runner.create_crawler(spider)
+        yield runner.crawl(crawler)
+        return crawler.stats.get_stats()
@@ -0,0 +1,215 @@
+"""Fakes of the services the tests, and the benchmarks, run against."""
+
+import io
+import random
+from urllib.parse import urlparse
+
+from PIL import Image
+from scrapy.core.downloader.handlers.http11 import HTTP11DownloadHandler
+from twisted.internet import defer, reactor, task
+from twisted.web import resource, server
+
+
+class FakeRedis(object):
+    """
+    An in-memory Redis with txredisapi's string commands. Every command, or
+    pipeline of commands, answers after ```round_trip``` seconds
+    """
+
+    def __init__(self, round_trip=0.0005, clock=None):
+        self.round_trip = round_trip
+        self.clock = clock if clock is not None else reactor
+        self.values = {}
+        self.expiries = {}
+        self.round_trips = 0
+
+    def _reply(self, value):
+        self.round_trips += 1
+        return task.deferLater(self.clock, self.round_trip, lambda: value)
+
+    def get(self, key):
+        return self._reply(self.values.get(key))
+
+    def set(self, key, value):
+        self.values[key] = value
+        return self._reply("OK")
+
+    def mget(self, keys):
+        return self._reply([self.values.get(key) for key in keys])
+
+    def mset(self, mapping):
+        self.values.update(mapping)
+        return self._reply("OK")
+
+    def expire(self, key, seconds):
+        self.expiries[key] = seconds
+        return self._reply(1)
+
+    def pipeline(self):
+        return defer.succeed(FakeRedisPipeline(self))
+
+
+class FakeRedisPipeline(object):
+    """Commands buffered and sent to a FakeRedis in one round trip"""
+
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+
+    def mset(self, mapping):
+        self.commands.append(lambda: self.redis.values.update(mapping) or "OK")
+
+    def expire(self, key, seconds):
+        self.commands.append(lambda: self.redis.expiries.__setitem__(key, seconds) or 1)
+
+    def execute_pipeline(self):
+        return self.redis._reply([command() for command in self.commands])
+
+
+LISTING_PAGE = """<!DOCTYPE html>
+<html lang="en-GB"><head><meta charset="utf-8"><title>Flats &amp; Houses in London | Gumtree</title></head>
+<body>
+<!-- listing {page} -->
+<main><div class="search-results">
+{articles}
+</div>
+<nav data-q="pagination"><ul>
+{pagination}
+</ul></nav></main>
+</body></html>
+"""
+
+ARTICLE = """<article class="listing-maxi" data-q="search-result">
+<a class="listing-link" href="https://www.gumtree.com/p/property-to-rent/flat-{ad_id}/{ad_id}" data-q="search-result-anchor">
+<h2 class="listing-title">{title}</h2><span class="listing-price">{price}</span></a>
+</article>"""
+
+AD_PAGE = """<!DOCTYPE html>
+<html lang="en-GB"><head><meta charset="utf-8"><title>{title} | Gumtree</title></head>
+<body class="page-vip">
+<!-- ad {ad_id} -->
+<main id="content" class="vip">
+<h1 class="h1-responsive" data-q="vip-title">{title}</h1>
+<h4 class="h4-responsive" data-q="ad-location">
+ {location}
+</h4>
+<h3 class="h3-responsive" data-q="ad-price">{price}</h3>
+<section class="carousel"><ul class="carousel-items">
+{images}
+</ul></section>
+<div data-q="attribute-container" class="attributes-container">
+{attributes}
+</div>
+<p itemprop="description" class="ad-description">{description}</p>
+<h2 class="truncate-line seller-rating-block-name">{seller}</h2>
+</main>
+</body></html>
+"""
+
+LOCATIONS = ["Camden, London", "Stratford, London", "Brixton, London", "Hackney, London", "Ealing, London", "Croydon, London"]
+PROPERTY_TYPES = ["Flat", "House", "Studio", "House share"]
+PRICES = ["£{0:,}pcm", "£{0:,}pw"]
+
+
+class FakeGumtree(resource.Resource):
+    """Serves /flats-houses/uk/london[/pageN], /p/.../<id> and /images/<name>.jpg"""
+
+    isLeaf = True
+
+    def __init__(self, pages=10, ads_per_page=25, images_per_ad=3, delay=0.0):
+        super().__init__()
+        self.pages = pages
+        self.ads_per_page = ads_per_page
+        self.images_per_ad = images_per_ad
+        self.delay = delay
+
+        buffer = io.BytesIO()
+        Image.new("RGB", (640, 480), (120, 160, 200)).save(buffer, "JPEG")
+        self.image = buffer.getvalue()
+
+    def render_GET(self, request):
+        path = request.path.decode("utf-8")
+        if path.startswith("/images/"):
+            content_type, body = b"image/jpeg", self.image
+        elif path.startswith("/p/"):
+            content_type, body = b"text/html; charset=utf-8", self.ad_page(int(path.rstrip("/").rsplit("/", 1)[1]))
+        else:
+            page = int(path.rsplit("/page", 1)[1]) if "/page" in path else 1
+            if page > self.pages:
+                request.setResponseCode(404)
+                return b""
+            content_type, body = b"text/html; charset=utf-8", self.listing_page(page)
+
+        request.setHeader(b"Content-Type", content_type)
+        if not self.delay:
+            return body
+
+        # Pretend to be a remote server
+        def respond():
+            request.write(body)
+            request.finish()
+
+        reactor.callLater(self.delay, respond)
+        return server.NOT_DONE_YET
+
+    def listing_page(self, page):
+        first = page * 1000
+        articles = "\n".join(
+            ARTICLE.format(ad_id=ad_id, title="Flat %d" % ad_id, price="£%d pcm" % (1000 + ad_id % 2000))
+            for ad_id in range(first, first + self.ads_per_page)
+        )
+        pagination = "\n".join(
+            '<li><a data-q="pagination-page" href="/flats-houses/uk/london/page%d">%d</a></li>' % (n, n)
+            for n in range(max(2, page - 2), min(self.pages, page + 3) + 1)
+        )
+        if self.pages > 1:
+            pagination += '\n<li><a data-q="pagination-last" href="/flats-houses/uk/london/page%d">Last</a></li>' % self.pages
+        return LISTING_PAGE.format(page=page, articles=articles, pagination=pagination).encode("utf-8")
+
+    def ad_page(self, ad_id):
+        rnd = random.Random(ad_id)
+        images = "\n".join(
+            '<li class="carousel-item"><img src="https://i.ebayimg.com/images/%d-%d.jpg"></li>' % (ad_id, n)
+            for n in range(self.images_per_ad)
+        )
+        attributes = {
+            "Seller type": rnd.choice(["Agency", "Private"]),
+            "Property type": rnd.choice(PROPERTY_TYPES),
+            "Number of bedrooms": str(rnd.randint(1, 5)),
+            "Date available": "%02d Jul 2024" % rnd.randint(1, 28),
+        }
+        attributes = "\n".join("<dl><dt>%s</dt><dd>%s</dd></dl>" % item for item in attributes.items())
+        return AD_PAGE.format(
+            ad_id=ad_id,
+            title="%d bedroom flat to rent" % rnd.randint(1, 5),
+            location=rnd.choice(LOCATIONS),
+            price=rnd.choice(PRICES).format(rnd.randint(200, 4000)),
+            images=images,
+            attributes=attributes,
+            description="A lovely flat<br>close to the station &amp; shops. " * rnd.randint(2, 10),
+            seller="Agent %d" % rnd.randint(1, 50),
+        ).encode("utf-8")
+
+
+class LocalDownloadHandler(HTTP11DownloadHandler):
+    """
+    Sends every request to the fake server at BENCHMARK_SERVER, keeping the
+    path, and hands the response back under the original url
+    """
+
+    def __init__(self, settings, crawler=None):
+        super().__init__(settings, crawler)
+        self.server_url = settings.get("BENCHMARK_SERVER").rstrip("/")
+
+    def download_request(self, request, spider):
+        parsed = urlparse(request.url)
+        local_url = self.server_url + parsed.path + ("?" + parsed.query if parsed.query else "")
+        local_request = request.replace(url=local_url)
+        d = super().download_request(local_request, spider)
+        d.addCallback(self._restore, request, local_request)
+        return d
+
+    @staticmethod
+    def _restore(response, request, local_request):
+        request.meta["download_latency"] = local_request.meta.get("download_latency")
+        return response.replace(url=request.url, request=request)
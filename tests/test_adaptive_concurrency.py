@@ -0,0 +1,50 @@
+from types import SimpleNamespace
+
+from scrapy import Request, Spider
+from scrapy.core.downloader import Slot
+from scrapy.http import Response
+from scrapy.utils.test import get_crawler
+from twisted.trial import unittest
+
+from gumtree_scraper.extensions import AdaptiveConcurrency
+
+
+class AdaptiveConcurrencyTest(unittest.TestCase):
+    def setUp(self):
+        self.crawler = get_crawler(Spider, {"ADAPTIVE_CONCURRENCY_ENABLED": True, "LATENCIES_INTERVAL": 5.0, "CONCURRENT_REQUESTS": 8})
+        self.crawler.stats.open_spider(None)
+        self.spider = Spider(name="test")
+        self.slot = Slot(concurrency=2, delay=0.0, randomize_delay=False)
+        self.crawler.engine = SimpleNamespace(
+            downloader=SimpleNamespace(slots={"example.com": self.slot}),
+            scraper=SimpleNamespace(slot=SimpleNamespace(itemproc_size=0)),
+        )
+        self.controller = AdaptiveConcurrency.from_crawler(self.crawler)
+
+    def measured(self, rate):
+        self.controller._latencies_measured(self.spider, items=0, rate=rate, latency=1.0, proc_latency=0.0)
+
+    def downloaded(self, slot, status=200):
+        request = Request("https://%s/" % slot, meta={"download_slot": slot})
+        self.controller._response_downloaded(Response(request.url, status=status), request, self.spider)
+
+    def test_throughput_holding_up_raises_concurrency(self):
+        self.measured(rate=10.0)
+        self.measured(rate=10.0)
+        self.assertEqual(self.slot.concurrency, 4)
+
+    def test_no_throughput_leaves_concurrency_alone(self):
+        self.measured(rate=0.0)
+        self.measured(rate=0.0)
+        self.assertEqual(self.slot.concurrency, 2)
+
+    def test_throttling_halves_concurrency(self):
+        self.downloaded("example.com", status=429)
+        self.measured(rate=10.0)
+        self.assertEqual(self.slot.concurrency, 1)
+        self.assertEqual(self.slot.delay, 0.25)
+
+    def test_closed_slots_are_forgotten(self):
+        self.downloaded("gone.example.com")
+        self.measured(rate=10.0)
+        self.assertEqual(self.controller.responses, {})
@@ -0,0 +1,32 @@
+import os
+
+from twisted.internet import defer
+
+from tests.crawling import CrawlTestCase
+
+REPLAY_HANDLERS = {
+    "http": "gumtree_scraper.archive.ReplayDownloadHandler",
+    "https": "gumtree_scraper.archive.ReplayDownloadHandler",
+}
+
+
+class RecordReplayTest(CrawlTestCase):
+    @defer.inlineCallbacks
+    def test_replay_serves_the_recorded_crawl(self):
+        archive = os.path.join(self.directory, "crawl")
+        recorded = yield self.crawl(RECORD_ARCHIVE=archive)
+        self.assertEqual(recorded["record/responses"], recorded["downloader/response_count"])
+
+        # Offline from here
+        yield self.port.stopListening()
+        replayed = yield self.crawl(REPLAY_ARCHIVE=archive, DOWNLOAD_HANDLERS=REPLAY_HANDLERS)
+        self.assertEqual(replayed["replay/hits"], recorded["record/responses"])
+        self.assertNotIn("replay/misses", replayed)
+        self.assertEqual(replayed["item_scraped_count"], recorded["item_scraped_count"])
+
+    @defer.inlineCallbacks
+    def test_failed_downloads_are_not_recorded(self):
+        yield self.port.stopListening()
+        stats = yield self.crawl(RECORD_ARCHIVE=os.path.join(self.directory, "crawl"), RETRY_ENABLED=False)
+        self.assertGreater(stats["record/skipped"], 0)
+        self.assertNotIn("record/responses", stats)
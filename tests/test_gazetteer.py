@@ -0,0 +1,56 @@
+import os
+import shutil
+import tempfile
+
+from twisted.trial import unittest
+
+from gumtree_scraper.gazetteer import Gazetteer, build, normalise
+
+ROWS = [
+    ("Camden", 51.5390, -0.1426),
+    ("Camden Town", 51.5392, -0.1426),
+    ("Hackney", 51.5450, -0.0553),
+    ("NW1", 51.5320, -0.1430),
+    ("NW1 8", 51.5400, -0.1450),
+    ("NW1 8NH", 51.5410, -0.1460),
+    ("St. John's Wood", 51.5340, -0.1740),
+    # The first row of a name wins
+    ("Hackney", 0.0, 0.0),
+]
+
+
+class GazetteerTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp(prefix="gumtree-test-")
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, "gazetteer.idx")
+        self.assertEqual(build(ROWS, path), 7)
+        self.gazetteer = Gazetteer(path)
+        self.addCleanup(self.gazetteer.close)
+
+    def assertLocation(self, location, lat, lon):
+        found = self.gazetteer.lookup(location)
+        self.assertIsNotNone(found, location)
+        # Stored as 32 bit floats
+        self.assertAlmostEqual(found["lat"], lat, places=4, msg=location)
+        self.assertAlmostEqual(found["lon"], lon, places=4, msg=location)
+
+    def test_normalise(self):
+        self.assertEqual(normalise("  St. John's  Wood, London "), "st john s wood london")
+
+    def test_postcodes(self):
+        self.assertLocation("Camden, London NW1 8NH", 51.5410, -0.1460)
+        self.assertLocation("nw1 8ab", 51.5400, -0.1450)
+        self.assertLocation("London NW1", 51.5320, -0.1430)
+
+    def test_places(self):
+        self.assertLocation("Hackney, London", 51.5450, -0.0553)
+        self.assertLocation("Camden Town Station, London", 51.5392, -0.1426)
+        self.assertLocation("St John's Wood", 51.5340, -0.1740)
+
+    def test_prefix(self):
+        self.assertLocation("Camd", 51.5390, -0.1426)
+
+    def test_unknown(self):
+        self.assertIsNone(self.gazetteer.lookup("Somewhere 12"))
+        self.assertIsNone(self.gazetteer.lookup(""))
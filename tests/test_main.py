@@ -0,0 +1,34 @@
+from twisted.trial import unittest
+
+from main import merge_stats
+
+
+class MergeStatsTest(unittest.TestCase):
+    def test_counters_are_summed(self):
+        merged = merge_stats(
+            [
+                {"item_scraped_count": 3, "postgres_writer/max_batch_latency": 1.0},
+                {"item_scraped_count": 4, "postgres_writer/max_batch_latency": 3.0},
+            ]
+        )
+        self.assertEqual(merged["item_scraped_count"], 7)
+        self.assertEqual(merged["postgres_writer/max_batch_latency"], 3.0)
+
+    def test_gauges_are_averaged(self):
+        merged = merge_stats(
+            [
+                {"postgres_writer/rows_per_second": 100.0, "adaptive_concurrency/example.com/delay": 0.5},
+                {"postgres_writer/rows_per_second": 300.0, "adaptive_concurrency/example.com/delay": 1.5},
+            ]
+        )
+        self.assertEqual(merged["postgres_writer/rows_per_second"], 200.0)
+        self.assertEqual(merged["adaptive_concurrency/example.com/delay"], 1.0)
+
+    def test_hit_rates_come_from_the_counters(self):
+        merged = merge_stats(
+            [
+                {"redis_cache/lookups": 10, "redis_cache/l1/hits": 9, "redis_cache/l1_hit_rate": 0.9},
+                {"redis_cache/lookups": 30, "redis_cache/l1/hits": 3, "redis_cache/l1_hit_rate": 0.1},
+            ]
+        )
+        self.assertEqual(merged["redis_cache/l1_hit_rate"], 0.3)
@@ -0,0 +1,89 @@
+import re
+
+import treq
+from scrapy import Spider
+from scrapy.utils.test import get_crawler
+from twisted.internet import defer, reactor
+from twisted.trial import unittest
+from twisted.web.client import HTTPConnectionPool
+
+from gumtree_scraper.extensions import MetricsExporter
+from gumtree_scraper.instrumentation import Histogram
+
+SAMPLE_RE = re.compile(r'^[a-zA-Z_:][a-zA-Z0-9_:]*(\{[a-zA-Z_][a-zA-Z0-9_]*="(?:[^"\\]|\\.)*"(,[a-zA-Z_][a-zA-Z0-9_]*="(?:[^"\\]|\\.)*")*\})? -?[0-9.e+-]+$|^[a-z_]+(\{.*\})? \+?Inf$')
+BUCKET_RE = re.compile(r'^gumtree_stage_seconds_bucket\{stage="(?P<stage>[^"]+)",le="(?P<le>[^"]+)"\} (?P<count>\d+)$')
+
+
+class MetricsExporterTest(unittest.TestCase):
+    def setUp(self):
+        self.crawler = get_crawler(Spider, {"METRICS_EXPORTER_ENABLED": True})
+        self.crawler.stats.open_spider(None)
+        self.crawler.stats.set_value("item_scraped_count", 7)
+        self.crawler.stats.set_value("downloader/response_count", 9)
+
+        # Values on both sides of the exported bounds
+        self.values = [0.0009, 0.00099, 0.001, 0.00101, 0.00104, 0.0011, 0.0049, 0.0051, 0.0052, 0.02, 0.3, 45.0, 4000.0]
+        histogram = Histogram()
+        for value in self.values:
+            histogram.record(value)
+
+        self.exporter = MetricsExporter(self.crawler, "127.0.0.1", 0)
+        self.exporter._histograms = lambda: {"download": histogram}
+        self.exporter._spider_opened(None)
+        self.url = "http://127.0.0.1:%d/metrics" % self.exporter.listening_port.getHost().port
+        self.pool = HTTPConnectionPool(reactor, persistent=False)
+
+    @defer.inlineCallbacks
+    def tearDown(self):
+        yield self.pool.closeCachedConnections()
+        yield self.exporter._spider_closed(None, "finished")
+
+    @defer.inlineCallbacks
+    def scrape(self):
+        response = yield treq.get(self.url, pool=self.pool)
+        self.assertEqual(response.code, 200)
+        self.assertEqual(response.headers.getRawHeaders(b"Content-Type"), [b"text/plain; version=0.0.4; charset=utf-8"])
+        body = yield response.text()
+        defer.returnValue(body)
+
+    @defer.inlineCallbacks
+    def test_exposition_format(self):
+        body = yield self.scrape()
+        self.assertTrue(body.endswith("\n"))
+
+        types = {}
+        for line in body.splitlines():
+            if line.startswith("# TYPE "):
+                _, _, name, kind = line.split(" ")
+                self.assertIn(kind, ("counter", "gauge", "histogram"))
+                self.assertNotIn(name, types)
+                types[name] = kind
+            elif not line.startswith("# HELP "):
+                self.assertRegex(line, SAMPLE_RE)
+                name = re.match(r"[a-zA-Z_:]+", line).group(0)
+                base = re.sub(r"_(bucket|sum|count)$", "", name)
+                # Every sample belongs to a declared metric
+                self.assertTrue(name in types or types.get(base) == "histogram", line)
+
+        self.assertIn("gumtree_items_scraped_total 7", body.splitlines())
+        self.assertIn("gumtree_responses_total 9", body.splitlines())
+
+    @defer.inlineCallbacks
+    def test_histogram_buckets_are_exact(self):
+        body = yield self.scrape()
+
+        buckets = [match.groupdict() for match in map(BUCKET_RE.match, body.splitlines()) if match]
+        self.assertEqual(len(buckets), len(MetricsExporter.buckets) + 1)
+        self.assertEqual(buckets[-1]["le"], "+Inf")
+        self.assertEqual(int(buckets[-1]["count"]), len(self.values))
+
+        previous_le, previous_count = 0.0, 0
+        for bucket, bound in zip(buckets, MetricsExporter.buckets):
+            le, count = float(bucket["le"]), int(bucket["count"])
+            self.assertLessEqual(le, bound)
+            self.assertGreater(le, previous_le)
+            self.assertGreaterEqual(count, previous_count)
+            self.assertEqual(count, sum(1 for value in self.values if value <= le), bucket)
+            previous_le, previous_count = le, count
+
+        self.assertIn('gumtree_stage_seconds_count{stage="download"} %d' % len(self.values), body)
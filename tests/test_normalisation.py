@@ -0,0 +1,60 @@
+from datetime import date
+
+from twisted.trial import unittest
+
+from gumtree_scraper.normalisation import normalise_bedrooms, normalise_date, normalise_price, normalise_prices
+
+
+class NormalisePriceTest(unittest.TestCase):
+    def assertPrice(self, text, pence, period):
+        self.assertEqual(normalise_price(text), (pence, period), text)
+
+    def test_months(self):
+        for text in ("£2,000pcm", "£2,000 pcm", "£2,000 PCM", "£2,000 p.c.m.", "£2000 pm", "£2,000/month", "£2,000 / month",
+                     "£2,000 per month", "£2,000 per calendar month", "£2,000 a month", "£2,000 monthly", "£2k pcm"):
+            self.assertPrice(text, 200000, "pcm")
+
+    def test_weeks(self):
+        for text in ("£300pw", "£300 pw", "£300 p.w.", "£300 p/w", "£300/week", "£300 /wk", "£300 per week", "£300 a week",
+                     "£300 weekly", "£300 pppw"):
+            self.assertPrice(text, 130000, "pw")
+
+    def test_days_and_years(self):
+        self.assertPrice("£95 per night", 288958, "pd")
+        self.assertPrice("£12,000 pa", 100000, "pa")
+        self.assertPrice("£12,000 p.a.", 100000, "pa")
+        self.assertPrice("£12,000 per annum", 100000, "pa")
+
+    def test_first_price_wins(self):
+        self.assertPrice("£300pw (£1,300pcm)", 130000, "pw")
+
+    def test_no_period(self):
+        for text in ("£1,500", "POA", "Price on application", "", None, "£300 pool table", "£1,000 available now"):
+            self.assertPrice(text, None, None)
+
+    def test_batches(self):
+        known = {}
+        texts = ["£300pw", "£2,000 pcm", "£300pw", "POA"]
+        self.assertEqual(normalise_prices(texts, known), [normalise_price(text) for text in texts])
+        self.assertEqual(len(known), 3)
+
+
+class NormaliseAttributesTest(unittest.TestCase):
+    def test_bedrooms(self):
+        self.assertEqual(normalise_bedrooms("2"), 2)
+        self.assertEqual(normalise_bedrooms("5+"), 5)
+        self.assertEqual(normalise_bedrooms("3 bedrooms"), 3)
+        self.assertEqual(normalise_bedrooms("Studio"), 0)
+        self.assertIsNone(normalise_bedrooms(""))
+        self.assertIsNone(normalise_bedrooms("Ask"))
+
+    def test_dates(self):
+        today = date(2024, 6, 1)
+        self.assertEqual(normalise_date("14 Jun 2024"), "2024-06-14")
+        self.assertEqual(normalise_date("1st July 2024"), "2024-07-01")
+        self.assertEqual(normalise_date("14/06/2024"), "2024-06-14")
+        self.assertEqual(normalise_date("2024-06-14"), "2024-06-14")
+        self.assertEqual(normalise_date("Now", today), "2024-06-01")
+        self.assertIsNone(normalise_date("Now"))
+        self.assertIsNone(normalise_date("31 Feb 2024"))
+        self.assertIsNone(normalise_date("Soon"))
@@ -0,0 +1,16 @@
+from twisted.internet import defer
+
+from tests.crawling import CrawlTestCase
+
+
+class ParsePoolTest(CrawlTestCase):
+    # Starting the worker processes takes a while
+    timeout = 120
+
+    @defer.inlineCallbacks
+    def test_stats(self):
+        stats = yield self.crawl(PARSE_WORKERS=2)
+        ads = self.pages * self.ads_per_page
+        self.assertEqual(stats["item_scraped_count"], ads)
+        self.assertEqual(stats["parse_pool/jobs"], ads)
+        self.assertNotIn("parse_pool/errors", stats)
@@ -0,0 +1,28 @@
+import os
+
+from twisted.internet import defer
+
+from tests.crawling import CrawlTestCase
+
+
+class IncrementalRecrawlTest(CrawlTestCase):
+    @defer.inlineCallbacks
+    def test_second_crawl_skips_ads(self):
+        directory = os.path.join(self.directory, "recrawl")
+        first = yield self.crawl(RECRAWL_ENABLED=True, RECRAWL_DIR=directory)
+        self.assertEqual(first["item_scraped_count"], self.pages * self.ads_per_page)
+        self.assertEqual(first["recrawl/new"], self.pages * self.ads_per_page)
+
+        second = yield self.crawl(RECRAWL_ENABLED=True, RECRAWL_DIR=directory)
+        self.assertEqual(second["recrawl/hit"], self.pages * self.ads_per_page)
+        self.assertNotIn("item_scraped_count", second)
+        self.assertFalse([key for key in second if key.startswith("spider_exceptions/")])
+        self.assertNotIn("log_count/ERROR", second)
+
+    @defer.inlineCallbacks
+    def test_unchanged_ads_are_recorded(self):
+        directory = os.path.join(self.directory, "recrawl")
+        yield self.crawl(RECRAWL_ENABLED=True, RECRAWL_DIR=directory)
+        # Every ad is due again
+        stats = yield self.crawl(RECRAWL_ENABLED=True, RECRAWL_DIR=directory, RECRAWL_MAX_AGE=0)
+        self.assertEqual(stats["recrawl/unchanged"], self.pages * self.ads_per_page)
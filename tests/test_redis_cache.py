@@ -0,0 +1,76 @@
+import json
+
+from scrapy import Spider
+from scrapy.utils.test import get_crawler
+from twisted.internet import defer
+from twisted.trial import unittest
+
+from gumtree_scraper.pipelines import RedisCache
+from tests.fakes import FakeRedis
+
+
+class RedisCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.crawler = get_crawler(Spider)
+        self.crawler.stats.open_spider(None)
+        self.spider = Spider(name="test")
+        self.redis = FakeRedis(round_trip=0)
+        self.redis.values["ADDRESS_CACHE:Camden, London"] = json.dumps({"lat": 51.54, "lon": -0.14})
+        self.cache = RedisCache(self.crawler, self.redis, max_entries=100, ttl=60)
+
+    def tearDown(self):
+        return self.cache.close_spider(self.spider)
+
+    def lookup(self, location):
+        return self.cache.process_item({"location": location}, self.spider)
+
+    @defer.inlineCallbacks
+    def test_lookups_are_batched(self):
+        locations = ["Camden, London", "Hackney, London", "Brixton, London", "Camden, London"]
+        items = yield defer.gatherResults([self.lookup(location) for location in locations])
+
+        self.assertEqual(items[0]["geo"], {"lat": 51.54, "lon": -0.14})
+        self.assertEqual(items[3]["geo"], {"lat": 51.54, "lon": -0.14})
+        self.assertNotIn("geo", items[1])
+        self.assertNotIn("geo", items[2])
+
+        stats = self.crawler.stats
+        self.assertEqual(self.redis.round_trips, 1)
+        self.assertEqual(stats.get_value("redis_cache/mgets"), 1)
+        self.assertEqual(stats.get_value("redis_cache/mget_keys"), 3)
+        self.assertEqual(stats.get_value("redis_cache/l2/hits"), 1)
+        self.assertEqual(stats.get_value("redis_cache/l2/misses"), 2)
+
+    @defer.inlineCallbacks
+    def test_hits_come_from_process(self):
+        yield self.lookup("Camden, London")
+        round_trips = self.redis.round_trips
+
+        item = yield self.lookup("Camden, London")
+        self.assertEqual(item["geo"], {"lat": 51.54, "lon": -0.14})
+        self.assertEqual(self.redis.round_trips, round_trips)
+        self.assertEqual(self.crawler.stats.get_value("redis_cache/l1/hits"), 1)
+
+    @defer.inlineCallbacks
+    def test_misses_are_not_kept(self):
+        yield self.lookup("Hackney, London")
+        self.redis.values["ADDRESS_CACHE:Hackney, London"] = json.dumps({"lat": 51.55, "lon": -0.06})
+
+        item = yield self.lookup("Hackney, London")
+        self.assertEqual(item["geo"], {"lat": 51.55, "lon": -0.06})
+        self.assertIsNone(self.crawler.stats.get_value("redis_cache/l1/hits"))
+
+    @defer.inlineCallbacks
+    def test_writes_are_batched(self):
+        items = yield defer.gatherResults([self.lookup(location) for location in ("Hackney, London", "Brixton, London", "Camden, London")])
+        for item in items:
+            item.setdefault("geo", {"lat": 51.5, "lon": -0.1})
+            self.cache.item_scraped(item, self.spider)
+        yield self.cache.close_spider(self.spider)
+
+        stats = self.crawler.stats
+        self.assertEqual(stats.get_value("redis_cache/msets"), 1)
+        self.assertEqual(stats.get_value("redis_cache/mset_keys"), 2)
+        self.assertEqual(stats.get_value("redis_cache/writes_skipped"), 1)
+        self.assertEqual(json.loads(self.redis.values["ADDRESS_CACHE:Brixton, London"]), {"lat": 51.5, "lon": -0.1})
+        self.assertEqual(self.redis.expiries["ADDRESS_CACHE:Brixton, London"], 60)
@@ -0,0 +1,137 @@
+from scrapy import Request, Spider
+from scrapy.utils.test import get_crawler
+from twisted.internet import defer
+from twisted.trial import unittest
+
+from gumtree_scraper import scheduler
+
+
+class FakeRedis(object):
+    """Runs the scheduler's scripts in Python, on dicts and sets"""
+
+    def __init__(self):
+        self.sets = {}
+        self.sorted_sets = {}
+        self.counters = {}
+        self.expiries = {}
+        self.pops = []
+
+    def eval(self, script, keys, args):
+        if script == scheduler.PUSH_SCRIPT:
+            return defer.succeed(self._push(keys, args))
+        if script == scheduler.POP_SCRIPT:
+            return defer.succeed(self._pop(keys, args))
+        raise AssertionError("Unknown script")
+
+    def delete(self, *keys):
+        for key in keys:
+            self.sets.pop(key, None)
+            self.sorted_sets.pop(key, None)
+            self.counters.pop(key, None)
+        return defer.succeed(len(keys))
+
+    def _push(self, keys, args):
+        seen, queue, sequence = keys
+        fingerprint, score, data, dont_filter, ttl = args
+        if dont_filter == "0":
+            if fingerprint in self.sets.setdefault(seen, set()):
+                return 0
+            self.sets[seen].add(fingerprint)
+        self.counters[sequence] = self.counters.get(sequence, 0) + 1
+        self.sorted_sets.setdefault(queue, {})["%016d:%s" % (self.counters[sequence], data)] = float(score)
+        for key in keys:
+            self.expiries[key] = int(ttl)
+        return 1
+
+    def _pop(self, keys, args):
+        (queue,) = keys
+        members = self.sorted_sets.setdefault(queue, {})
+        # Like Redis: by score, then by member
+        popped = sorted(members, key=lambda member: (members[member], member))[: int(args[0])]
+        for member in popped:
+            del members[member]
+        self.pops.append(len(popped))
+        return [len(members)] + popped
+
+
+class RedisSchedulerTest(unittest.TestCase):
+    def setUp(self):
+        self.crawler = get_crawler(Spider)
+        self.crawler.stats.open_spider(None)
+        self.spider = Spider(name="test")
+        self.redis = FakeRedis()
+        self.scheduler = scheduler.RedisScheduler(self.crawler, self.redis, job="1", ttl=60, prefetch=4)
+        return self.scheduler.open(self.spider)
+
+    def tearDown(self):
+        return self.scheduler.close("finished")
+
+    def drain(self):
+        urls = []
+        while True:
+            request = self.scheduler.next_request()
+            if request is None:
+                return urls
+            urls.append(request.url)
+
+    def test_duplicates_are_dropped(self):
+        self.assertTrue(self.scheduler.enqueue_request(Request("https://example.com/a")))
+        self.assertFalse(self.scheduler.enqueue_request(Request("https://example.com/a")))
+        self.assertTrue(self.scheduler.enqueue_request(Request("https://example.com/a", dont_filter=True)))
+
+        stats = self.crawler.stats
+        self.assertEqual(stats.get_value("scheduler/enqueued/redis"), 2)
+        self.assertEqual(stats.get_value("dupefilter/filtered"), 1)
+        self.assertEqual(self.drain(), ["https://example.com/a", "https://example.com/a"])
+
+    def test_pop_order(self):
+        for i in range(10):
+            self.scheduler.enqueue_request(Request("https://example.com/low/%d" % i, priority=-1))
+        for i in range(10):
+            self.scheduler.enqueue_request(Request("https://example.com/high/%d" % i, priority=1))
+
+        expected = ["https://example.com/high/%d" % i for i in range(10)]
+        expected += ["https://example.com/low/%d" % i for i in range(10)]
+        self.assertEqual(self.drain(), expected)
+        self.assertFalse(self.scheduler.has_pending_requests())
+
+    def test_fetch_leaves_full_buffer_alone(self):
+        for i in range(10):
+            self.scheduler.enqueue_request(Request("https://example.com/%d" % i))
+        self.scheduler._fetch()
+        self.assertEqual(len(self.scheduler.local), 4)
+
+        pops = len(self.redis.pops)
+        self.scheduler._fetch()
+        self.assertEqual(len(self.redis.pops), pops)
+        self.assertEqual(len(self.scheduler.local), 4)
+        self.assertEqual(self.scheduler.remote_size, 6)
+
+    def test_close_gives_prefetched_requests_back(self):
+        for i in range(3):
+            self.scheduler.enqueue_request(Request("https://example.com/%d" % i))
+        self.scheduler._fetch()
+
+        d = self.scheduler.close("finished")
+        self.assertEqual(len(self.redis.sorted_sets[self.scheduler.queue_key]), 3)
+        return d
+
+    def test_keys_expire(self):
+        self.scheduler.enqueue_request(Request("https://example.com/a"))
+        for key in (self.scheduler.seen_key, self.scheduler.queue_key, self.scheduler.sequence_key):
+            self.assertEqual(self.redis.expiries[key], 60)
+
+    @defer.inlineCallbacks
+    def test_next_job_crawls_again(self):
+        self.scheduler.enqueue_request(Request("https://example.com/a"))
+        yield self.scheduler.close("finished")
+
+        self.scheduler = scheduler.RedisScheduler(self.crawler, self.redis, job="2", prefetch=4)
+        yield self.scheduler.open(self.spider)
+        self.assertTrue(self.scheduler.enqueue_request(Request("https://example.com/a")))
+        self.assertEqual(self.drain(), ["https://example.com/a"])
+
+    def test_failed_pushes_are_logged(self):
+        self.redis.eval = lambda script, keys, args: defer.fail(RuntimeError("boom"))
+        self.assertTrue(self.scheduler.enqueue_request(Request("https://example.com/a")))
+        self.assertEqual(self.crawler.stats.get_value("scheduler/redis_errors"), 1)